@@ -0,0 +1,93 @@
+"""Single-writer arbitration for servos that more than one source wants to move (the jaw and the eyelids).
+
+Producers (the audio callback, the joystick handlers, remote control, idle animations and lip sync playback) post
+an *intent*, an angle at a priority level, from whichever thread they run on. Once per frame, the control thread
+calls resolve(), which picks the highest priority intent for each actuator and stages only the angles that changed.
+Nothing but the control thread ever touches those servos, so there is no ordering between threads to get wrong.
+
+Intents are latched: an intent stays in effect until its producer posts a new one at the same level, or
+releases it. PRIORITY_REST holds the resting position, so an actuator falls back to it when everything else
+has been released.
+"""
+import threading
+
+
+PRIORITY_REST = 0        # resting position (e.g. jaw closed, eyelids open)
+PRIORITY_IDLE = 1        # idle animations: blinking, breathing
+PRIORITY_MIC = 2         # microphone lip sync
+PRIORITY_CONTROLLER = 3  # PS4 controller
+PRIORITY_REMOTE = 4      # remote control over the network (by default; see remote_control.py)
+PRIORITY_LIP_SYNC = 5    # Luna's Story lip sync playback
+PRIORITY_LEVELS = 6
+
+PRIORITY_NAMES = ["rest", "idle", "mic", "controller", "remote", "lip_sync"]
+
+
+class ActuatorArbiter:
+    """Latest intent per actuator and priority level; resolve() returns the winners that changed since last time"""
+    def __init__(self, actuators):
+        self._intents = {actuator: [None] * PRIORITY_LEVELS for actuator in actuators}
+        self._resolved = {actuator: None for actuator in actuators}
+        self._winners = {actuator: None for actuator in actuators}
+        self._lock = threading.Lock()
+
+        # Counters
+        self.posts = 0
+        self.superseded = 0  # intents replaced before any frame could use them
+        self.frames = 0
+        self.changes = 0
+        self._unresolved = set()
+
+    def __contains__(self, actuator):
+        return actuator in self._intents
+
+    def post(self, actuator, priority: int, angle: float):
+        with self._lock:
+            key = (actuator, priority)
+            if key in self._unresolved:
+                self.superseded += 1
+            self._unresolved.add(key)
+            self._intents[actuator][priority] = angle
+            self.posts += 1
+
+    def release(self, actuator, priority: int):
+        with self._lock:
+            self._intents[actuator][priority] = None
+
+    def release_all(self, priority: int):
+        with self._lock:
+            for intents in self._intents.values():
+                intents[priority] = None
+
+    def winner(self, actuator):
+        """Priority level of the intent that was in effect at the last resolve() (None if there was none)"""
+        return self._winners[actuator]
+
+    def resolve(self):
+        """{actuator: angle} of the winning intents whose angle changed since the last call. Control thread only."""
+        changed = {}
+        with self._lock:
+            self._unresolved.clear()
+            for actuator, intents in self._intents.items():
+                for priority in range(PRIORITY_LEVELS - 1, -1, -1):
+                    if intents[priority] is not None:
+                        break
+                else:
+                    priority = None
+                self._winners[actuator] = priority
+                angle = None if priority is None else intents[priority]
+                if angle is not None and angle != self._resolved[actuator]:
+                    self._resolved[actuator] = angle
+                    changed[actuator] = angle
+        self.frames += 1
+        self.changes += len(changed)
+        return changed
+
+    def invalidate(self):
+        """Forget the resolved angles, so the next resolve() returns every actuator's winner (e.g. after calibration)"""
+        with self._lock:
+            for actuator in self._resolved:
+                self._resolved[actuator] = None
+
+    def stats(self):
+        return {"posts": self.posts, "superseded": self.superseded, "frames": self.frames, "changes": self.changes}
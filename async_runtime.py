@@ -0,0 +1,212 @@
+"""Single-threaded asyncio runtime for LunaController (python luna_control.py --asyncio).
+
+Instead of pyPS4Controller's blocking listen() on the main thread plus the update_servos thread, one event loop:
+    - reads controller events from /dev/input/js0 without blocking (loop.add_reader), decoding them with the
+      controller's event_definition and calling its on_* handlers, as listen() does
+    - runs update_servos_tick() on the controller's FrameScheduler deadlines
+    - processes audio chunks, which the PortAudio callback thread only copies into the controller's ring buffer
+    - receives remote control datagrams (if remote_port is given), for the controller's RemoteControl
+Shutdown (SIGINT/SIGTERM, or the controller disconnecting) stops the loop and returns, instead of exit(1).
+"""
+import asyncio, logging, os, signal, struct
+from hardware import PA_CONTINUE
+from luna_log import fields
+
+
+log = logging.getLogger(__name__)
+
+# How pyPS4Controller's listen() picks the on_* handler for an event (decoded with the controller's event_definition):
+# (event test, handler, whether the handler gets the event's value). The first match wins; the stick groups first.
+STICK_EVENTS = {
+    "R3_event": [("R3_y_at_rest", "on_R3_y_at_rest", False), ("R3_x_at_rest", "on_R3_x_at_rest", False),
+                 ("R3_right", "on_R3_right", True), ("R3_left", "on_R3_left", True),
+                 ("R3_up", "on_R3_up", True), ("R3_down", "on_R3_down", True)],
+    "L3_event": [("L3_y_at_rest", "on_L3_y_at_rest", False), ("L3_x_at_rest", "on_L3_x_at_rest", False),
+                 ("L3_up", "on_L3_up", True), ("L3_down", "on_L3_down", True),
+                 ("L3_left", "on_L3_left", True), ("L3_right", "on_L3_right", True)]
+}
+BUTTON_EVENTS = [
+    ("circle_pressed", "on_circle_press", False), ("circle_released", "on_circle_release", False),
+    ("x_pressed", "on_x_press", False), ("x_released", "on_x_release", False),
+    ("triangle_pressed", "on_triangle_press", False), ("triangle_released", "on_triangle_release", False),
+    ("square_pressed", "on_square_press", False), ("square_released", "on_square_release", False),
+    ("L1_pressed", "on_L1_press", False), ("L1_released", "on_L1_release", False),
+    ("L2_pressed", "on_L2_press", True), ("L2_released", "on_L2_release", False),
+    ("R1_pressed", "on_R1_press", False), ("R1_released", "on_R1_release", False),
+    ("R2_pressed", "on_R2_press", True), ("R2_released", "on_R2_release", False),
+    ("options_pressed", "on_options_press", False), ("options_released", "on_options_release", False),
+    ("left_right_arrow_released", "on_left_right_arrow_release", False),
+    ("up_down_arrow_released", "on_up_down_arrow_release", False),
+    ("left_arrow_pressed", "on_left_arrow_press", False), ("right_arrow_pressed", "on_right_arrow_press", False),
+    ("up_arrow_pressed", "on_up_arrow_press", False), ("down_arrow_pressed", "on_down_arrow_press", False),
+    ("playstation_button_pressed", "on_playstation_button_press", False),
+    ("playstation_button_released", "on_playstation_button_release", False),
+    ("share_pressed", "on_share_press", False), ("share_released", "on_share_release", False),
+    ("R3_pressed", "on_R3_press", False), ("R3_released", "on_R3_release", False),
+    ("L3_pressed", "on_L3_press", False), ("L3_released", "on_L3_release", False)
+]
+
+
+def handler_for(event):
+    """(on_* handler name, whether it gets event.value) for a decoded event; None if it has no handler"""
+    for group, handlers in STICK_EVENTS.items():
+        if getattr(event, group)():
+            return next(((handler, has_value) for test, handler, has_value in handlers if getattr(event, test)()), None)
+    return next(((handler, has_value) for test, handler, has_value in BUTTON_EVENTS if getattr(event, test)()), None)
+
+
+class AsyncJoystick:
+    """Non-blocking reader of a joystick interface, with the same event decoding as pyPS4Controller's listen()"""
+    def __init__(self, interface="/dev/input/js0", timeout=300):
+        self.interface = interface
+        self.timeout = timeout
+        self.events = 0
+
+    async def run(self, controller):
+        """Dispatch events until the interface goes away or controller.stop is set.
+        Returns "timeout", "disconnected" or "stopped"."""
+        log.info("Waiting for the controller interface", extra=fields(interface=self.interface))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while not os.path.exists(self.interface):
+            if loop.time() >= deadline:
+                log.error("Controller interface not available", extra=fields(interface=self.interface, timeout=self.timeout))
+                return "timeout"
+            await asyncio.sleep(1)
+        log.info("Controller interface bound", extra=fields(interface=self.interface))
+        controller.is_connected = True
+
+        fd = os.open(self.interface, os.O_RDONLY | os.O_NONBLOCK)
+        readable = asyncio.Event()
+        loop.add_reader(fd, readable.set)
+        pending = b""
+        try:
+            while not controller.stop:
+                await readable.wait()
+                readable.clear()
+                try:
+                    data = os.read(fd, controller.event_size * 64)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""
+                if not data:
+                    log.warning("Controller interface lost (disconnected?)", extra=fields(interface=self.interface))
+                    return "disconnected"
+                pending += data
+                n_events = len(pending) // controller.event_size
+                for i in range(n_events):
+                    self.dispatch(controller, pending[i * controller.event_size:(i + 1) * controller.event_size])
+                pending = pending[n_events * controller.event_size:]
+            return "stopped"
+        finally:
+            controller.is_connected = False
+            loop.remove_reader(fd)
+            os.close(fd)
+
+    def dispatch(self, controller, data):
+        """Decode one raw event and call the controller's on_* handler for it"""
+        raw_event = struct.unpack(controller.event_format, data)
+        overflow, value, button_type, button_id = raw_event[3:], raw_event[2], raw_event[1], raw_event[0]
+        self.events += 1
+        if button_id in controller.black_listed_buttons:
+            return
+        event = controller.event_definition(button_id=button_id, button_type=button_type, value=value,
+                                            connecting_using_ds4drv=controller.connecting_using_ds4drv,
+                                            overflow=overflow, debug=controller.debug)
+        handler = handler_for(event)
+        if handler is not None:
+            handler_name, has_value = handler
+            getattr(controller, handler_name)(*((event.value,) if has_value else ()))
+
+
+class RemoteDatagramProtocol(asyncio.DatagramProtocol):
+    """Hands datagrams to a RemoteControl (see remote_control.py), which applies them at the next frame"""
+    def __init__(self, remote):
+        self.remote = remote
+
+    def datagram_received(self, data, address):
+        self.remote.receive(data, address)
+
+
+class AsyncRuntime:
+    """Runs a LunaController (built with start_update_thread=False and a NullMicrophone) on one asyncio loop.
+
+    microphone is the real audio backend (e.g. hardware.PyAudioMicrophone); its callback thread only copies chunks
+    into controller.audio_ring (which counts any it has to drop) and wakes up the loop.
+    remote_port: UDP port to receive remote control datagrams on, on the remote control's bind_address (None: no
+    remote control)
+    """
+    def __init__(self, controller, joystick: AsyncJoystick, microphone=None, remote_port=None):
+        self.controller = controller
+        self.joystick = joystick
+        self.microphone = microphone
+        self.remote_port = remote_port
+        self._loop = None
+        self._audio_ready = None
+        self._stopping = None
+
+    def stop(self):
+        """Thread-safe request to shut down"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    def audio_callback(self, input_data, frame_count, time_info, flags):
+        """PortAudio stream callback (PortAudio's thread): hand the chunk over to the loop and return right away"""
+        self.controller.audio_stream_callback(input_data, frame_count, time_info, flags)
+        self._loop.call_soon_threadsafe(self._audio_ready.set)
+        return None, PA_CONTINUE
+
+    async def _process_audio(self):
+        while True:
+            await self._audio_ready.wait()
+            self._audio_ready.clear()
+            self.controller.process_pending_audio()
+
+    async def _run_frames(self):
+        scheduler = self.controller.update_scheduler
+        while True:
+            await asyncio.sleep(scheduler.remaining())
+            self.controller.update_servos_tick(scheduler.wait())
+
+    async def run(self):
+        """Run until stopped or the controller goes away; returns the reason ("stopped", "disconnected", "timeout")"""
+        self._loop = asyncio.get_running_loop()
+        self._audio_ready = asyncio.Event()
+        self._stopping = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            self._loop.add_signal_handler(signal_number, self._stopping.set)
+
+        remote_transport = None
+        if self.remote_port is not None:
+            remote_transport, _ = await self._loop.create_datagram_endpoint(
+                lambda: RemoteDatagramProtocol(self.controller.remote),
+                local_addr=(self.controller.remote.bind_address, self.remote_port))
+        tasks = [asyncio.create_task(self._run_frames()), asyncio.create_task(self._process_audio())]
+        joystick_task = asyncio.create_task(self.joystick.run(self.controller))
+        stop_task = asyncio.create_task(self._stopping.wait())
+        audio_start_task = None
+        if self.microphone is not None:
+            # Opening the mic takes a while; frames and controller events are already running meanwhile
+            self.controller.microphone = self.microphone
+            audio_start_task = asyncio.create_task(asyncio.to_thread(self.controller.start_audio, self.audio_callback))
+        try:
+            # The frame and audio tasks only finish by raising; that ends the run too
+            done, _ = await asyncio.wait(tasks + [joystick_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if audio_start_task is not None:
+                await asyncio.gather(audio_start_task, return_exceptions=True)
+                self.microphone.stop()
+            for task in tasks + [joystick_task, stop_task]:
+                task.cancel()
+            await asyncio.gather(*tasks, joystick_task, stop_task, return_exceptions=True)
+            if remote_transport is not None:
+                remote_transport.close()
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                self._loop.remove_signal_handler(signal_number)
+        for task in tasks:
+            if task in done:
+                task.result()  # re-raises the exception
+        if joystick_task in done:
+            return joystick_task.result()
+        return "stopped"
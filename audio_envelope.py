@@ -0,0 +1,224 @@
+import json, logging, os, time
+import numpy as np
+# scipy.signal is imported only when a filter has to be designed: importing it takes over a second on a Pi
+
+
+log = logging.getLogger(__name__)
+
+KAISER_BETA = 5.0  # about 54 dB of stopband attenuation
+
+
+def kaiser_transition_hz(numtaps, rate, beta=KAISER_BETA):
+    """Width of the transition band of a Kaiser-window FIR low-pass (Kaiser's design formula, solved for the width)"""
+    attenuation = beta / 0.1102 + 8.7
+    return (attenuation - 7.95) / (2.285 * 2 * np.pi * (numtaps - 1)) * rate
+
+
+def lowpass_taps(numtaps, cutoff, rate, cache=None):
+    """Kaiser-window FIR low-pass taps; designed once, then taken from cache (a FilterCache) when given"""
+    key = f"firwin_kaiser5_{numtaps}_{cutoff:g}_{rate:g}"
+    if cache is not None and key in cache:
+        return np.array(cache[key], dtype=np.float64)
+    from scipy import signal
+    taps = signal.firwin(numtaps, cutoff, window=('kaiser', KAISER_BETA), fs=rate)
+    if cache is not None:
+        cache[key] = taps
+    return taps
+
+
+class FilterCache:
+    """Filter coefficients by design parameters, kept in a JSON file (next to calibration.json), so that a
+    restart doesn't have to import SciPy and design them again"""
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.filters = {}
+        self.changed = False
+        try:
+            with open(filepath) as cache_file:
+                self.filters = json.load(cache_file)
+        except (OSError, ValueError):
+            pass
+
+    def __contains__(self, key):
+        return key in self.filters
+
+    def __getitem__(self, key):
+        return self.filters[key]
+
+    def __setitem__(self, key, coefficients):
+        self.filters[key] = np.asarray(coefficients).tolist()
+        self.changed = True
+
+    def save(self):
+        """Write the file if filters were added (atomically; a cache that can't be written is only slower)"""
+        if not self.changed:
+            return
+        from calibration_store import atomic_write_text
+        try:
+            atomic_write_text(self.filepath, json.dumps(self.filters))
+            self.changed = False
+        except OSError as err:
+            log.warning(f"Could not write filter cache: {err}")
+
+
+ENVELOPE_MODES = ("rms", "peak")
+SILENCE_AMPLITUDE = 2**16 * 10 ** (-90 / 20)  # -90 dB, the level reported for silence
+
+
+class MultirateEnvelope:
+    """Loudness (dB) of raw 16-bit PortAudio chunks, computed at a reduced sample rate.
+
+    Nothing above the low-pass (about 4 kHz) survives anyway, so the chunk is decimated (by an integer factor,
+    e.g. 44.1 kHz to 11.025 kHz) with a polyphase FIR that is both the low-pass and the anti-alias filter: its
+    cutoff is set so that the stopband starts at the decimated Nyquist frequency, and only the output samples
+    that are kept are ever computed. The envelope detector then measures each of
+    several blocks per chunk (RMS, or peak scaled to match RMS for a sine wave), and smooths them with
+    separate attack and release time constants. process() returns the newest value; block_levels holds
+    all of them for the chunk.
+
+    With bands (a list of [low, high] Hz), band_levels also holds the energy of each frequency band of
+    the chunk, in dB, for driving more than the jaw.
+    """
+    def __init__(self, rate: int, chunk: int, channels: int = 1, decimated_rate=11025, lowpass_hz=5000,
+                 numtaps=48, envelope="rms", attack_seconds=0.005, release_seconds=0.05, blocks_per_chunk=4,
+                 bands=None, filter_cache=None):
+        if envelope not in ENVELOPE_MODES:
+            raise ValueError(f"envelope must be one of {ENVELOPE_MODES}")
+        self.rate = rate
+        self.channels = channels
+        self.decimation = max(1, int(round(rate / decimated_rate)))
+        self.decimated_rate = rate / self.decimation
+        # Half the transition band below Nyquist, so that nothing that would alias gets through
+        cutoff = min(lowpass_hz, self.decimated_rate / 2 - kaiser_transition_hz(numtaps, rate) / 2)
+        # Reversed, so that a window of input samples dotted with it is one filter output
+        self.taps = lowpass_taps(numtaps, cutoff, rate, filter_cache)[::-1].copy()
+        self.envelope = envelope
+        self.attack_seconds = attack_seconds
+        self.release_seconds = release_seconds
+        self.blocks_per_chunk = blocks_per_chunk
+        self.bands = [] if bands is None else bands
+        self.level = 0.0
+        self.block_levels = np.full(blocks_per_chunk, -90.0)
+        self.band_levels = np.full(len(self.bands), -90.0)
+        self._phase = 0  # index in the next chunk of the first sample that is kept
+        self._allocate(chunk)
+
+    @classmethod
+    def from_settings(cls, audio_input_settings, filter_cache=None):
+        """Built from calibration.json's audio_input_settings (which may predate the front-end settings)"""
+        return cls(audio_input_settings["rate"], audio_input_settings["chunk"], audio_input_settings["channels"],
+                   decimated_rate=audio_input_settings.get("decimated_rate", 11025),
+                   envelope=audio_input_settings.get("envelope", "rms"),
+                   attack_seconds=audio_input_settings.get("attack_seconds", 0.005),
+                   release_seconds=audio_input_settings.get("release_seconds", 0.05),
+                   blocks_per_chunk=audio_input_settings.get("envelope_blocks_per_chunk", 4),
+                   bands=audio_input_settings.get("bands_hz"), filter_cache=filter_cache)
+
+    def _allocate(self, chunk: int):
+        self.chunk = chunk
+        history = len(self.taps) - 1
+        self._buffer = np.zeros(history + chunk)
+        self._windows = np.lib.stride_tricks.sliding_window_view(self._buffer, len(self.taps))
+        block_seconds = chunk / self.rate / self.blocks_per_chunk
+        self._attack = np.exp(-block_seconds / self.attack_seconds) if self.attack_seconds > 0 else 0.0
+        self._release = np.exp(-block_seconds / self.release_seconds) if self.release_seconds > 0 else 0.0
+        self._block_starts = {}
+        if self.bands:
+            n_outputs = -(-chunk // self.decimation)
+            self._spectrum_window = np.hanning(n_outputs)
+            frequencies = np.fft.rfftfreq(n_outputs, 1 / self.decimated_rate)
+            # Sums the power spectrum bins of each band, in one matrix product
+            self._band_matrix = np.array([(frequencies >= low) & (frequencies < high) for low, high in self.bands],
+                                         dtype=np.float64)
+            self._spectrum_scale = 2 / np.sum(self._spectrum_window ** 2) / n_outputs
+
+    def reset(self):
+        """Forget the filter and envelope history (e.g. after the stream was restarted)"""
+        self._buffer.fill(0)
+        self._phase = 0
+        self.level = 0.0
+
+    def _starts(self, n_outputs):
+        starts = self._block_starts.get(n_outputs)
+        if starts is None:
+            starts = self._block_starts[n_outputs] = np.linspace(0, n_outputs, self.blocks_per_chunk, endpoint=False).astype(np.intp)
+        return starts
+
+    def process(self, input_data) -> float:
+        """Return the loudness of one chunk of little-endian int16 audio, in dB (the newest envelope value)"""
+        int_data = np.frombuffer(input_data, dtype='<i2')[::self.channels]
+        if len(int_data) != self.chunk:
+            self._allocate(len(int_data))
+        if self.chunk == 0:
+            return -90
+        history = len(self.taps) - 1
+        buffer = self._buffer
+        buffer[:history] = buffer[self.chunk:]
+        np.copyto(buffer[history:], int_data, casting='unsafe')
+
+        # Polyphase decimation: filter outputs only for the samples that are kept
+        decimated = self._windows[self._phase::self.decimation] @ self.taps
+        self._phase = (self._phase - self.chunk) % self.decimation
+
+        if self.envelope == "rms" and len(decimated) % self.blocks_per_chunk == 0:
+            blocks = decimated.reshape(self.blocks_per_chunk, -1)
+            amplitudes = np.sqrt(np.einsum('ij,ij->i', blocks, blocks) / blocks.shape[1])
+        elif self.envelope == "rms":
+            starts = self._starts(len(decimated))
+            counts = np.diff(np.append(starts, len(decimated)))
+            amplitudes = np.sqrt(np.add.reduceat(decimated * decimated, starts) / counts)
+        else:
+            # Peak of a sine wave is sqrt(2) times its RMS; scaled so that the mic thresholds work for both
+            amplitudes = np.maximum.reduceat(np.abs(decimated), self._starts(len(decimated))) / np.sqrt(2)
+
+        # Attack/release smoothing, one step per block
+        level = self.level
+        smoothed = amplitudes.tolist()
+        for i, amplitude in enumerate(smoothed):
+            coefficient = self._attack if amplitude > level else self._release
+            level = coefficient * level + (1 - coefficient) * amplitude
+            smoothed[i] = level
+        self.level = level
+
+        # Amplitude over 2**16, in dB: the scale the mic thresholds are calibrated in (floored at -90 dB)
+        self.block_levels = 20 * np.log10(np.maximum(smoothed, SILENCE_AMPLITUDE) / (2**16))
+        if self.bands:
+            spectrum = np.fft.rfft(decimated * self._spectrum_window[:len(decimated)], n=len(self._spectrum_window))
+            power = (spectrum.real ** 2 + spectrum.imag ** 2) * self._spectrum_scale
+            self.band_levels = 10 * np.log10(np.maximum(self._band_matrix @ power, SILENCE_AMPLITUDE ** 2) / (2**32))
+        return float(self.block_levels[-1])
+
+
+def benchmark(rate=44100, chunk=512, iterations=2000):
+    """Time MultirateEnvelope.process per chunk (with and without bands), and compare against the chunk period"""
+    envelopes = {
+        "MultirateEnvelope": MultirateEnvelope(rate, chunk),
+        "MultirateEnvelope + bands": MultirateEnvelope(rate, chunk, bands=[[80, 300], [300, 1000], [1000, 2500], [2500, 5000]])
+    }
+    rng = np.random.default_rng(0)
+    chunks = [rng.integers(-8000, 8000, chunk, dtype=np.int16).tobytes() for _ in range(16)]
+    chunk_period_ms = 1000 * chunk / rate
+    results = {}
+    for name, envelope in envelopes.items():
+        # Warm up
+        for input_data in chunks:
+            envelope.process(input_data)
+
+        durations = np.empty(iterations)
+        for i in range(iterations):
+            input_data = chunks[i % len(chunks)]
+            start = time.perf_counter()
+            envelope.process(input_data)
+            durations[i] = time.perf_counter() - start
+
+        mean_ms = 1000 * durations.mean()
+        p99_ms = 1000 * np.percentile(durations, 99)
+        print(f"{name}.process: {iterations} chunks of {chunk} samples @ {rate} Hz")
+        print(f"  mean: {mean_ms:.4f} ms\tp99: {p99_ms:.4f} ms\tmax: {1000 * durations.max():.4f} ms")
+        print(f"  chunk period: {chunk_period_ms:.2f} ms\t(p99 uses {100 * p99_ms / chunk_period_ms:.2f}% of the budget)")
+        results[name] = {"mean_ms": mean_ms, "p99_ms": p99_ms, "chunk_period_ms": chunk_period_ms}
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,116 @@
+"""Lock-free single-producer/single-consumer ring buffer of audio chunks, between PortAudio and the DSP.
+
+The PortAudio callback (the producer) only copies each chunk into the next preallocated slot and moves its
+write counter; a consumer thread reads the slots in order and does the filtering and jaw updates. Each counter
+is only ever written by one side, and a slot is published by moving the counter after the copy, so no lock
+is needed around the data (under the GIL, an int assignment is atomic).
+
+Instead of dropping chunks silently, the buffer counts what went wrong:
+    dropped           chunks the producer had to throw away because the consumer was a full buffer behind
+    input_overflows   chunks PortAudio flagged paInputOverflow (audio was lost before it reached the callback)
+    input_underflows  chunks PortAudio flagged paInputUnderflow
+    underruns         times the consumer waited a whole timeout without any audio arriving, once audio has
+                      started arriving (so no mic, or a simulated one, doesn't count as missing audio)
+    high_water        the most chunks that were ever waiting in the buffer at once
+"""
+import threading
+import numpy as np
+
+
+PA_INPUT_UNDERFLOW = 0x1  # pyaudio.paInputUnderflow
+PA_INPUT_OVERFLOW = 0x2   # pyaudio.paInputOverflow
+
+
+class AudioRingBuffer:
+    """capacity slots of up to slot_samples int16 samples each (a chunk, all channels interleaved)"""
+    def __init__(self, slot_samples: int, capacity: int = 32):
+        self.capacity = capacity
+        self.slots = np.zeros((capacity, slot_samples), dtype='<i2')
+        self.lengths = np.zeros(capacity, dtype=np.intp)
+        self.flags = np.zeros(capacity, dtype=np.int64)
+        self.timestamps = np.zeros(capacity)
+        self.adc_latencies = np.zeros(capacity)
+        self._slot_bytes = memoryview(self.slots).cast('B')
+        self._data_available = threading.Event()
+
+        # Written by the producer only
+        self.written = 0
+        self.dropped = 0
+        self.input_overflows = 0
+        self.input_underflows = 0
+        self.high_water = 0
+        # Written by the consumer only
+        self.read = 0
+        self.underruns = 0
+
+    def __len__(self):
+        """Chunks waiting to be read"""
+        return self.written - self.read
+
+    def write(self, input_data, flags: int = 0, timestamp: float = 0.0, adc_latency: float = 0.0) -> bool:
+        """Producer: copy one chunk in. Returns False (and counts it) if the chunk had to be dropped."""
+        if flags & PA_INPUT_OVERFLOW:
+            self.input_overflows += 1
+        if flags & PA_INPUT_UNDERFLOW:
+            self.input_underflows += 1
+        waiting = self.written - self.read
+        n_bytes = len(input_data)
+        if waiting >= self.capacity or n_bytes > self.slots.shape[1] * 2:
+            self.dropped += 1
+            return False
+        slot = self.written % self.capacity
+        start = slot * self.slots.shape[1] * 2
+        self._slot_bytes[start:start + n_bytes] = input_data
+        self.lengths[slot] = n_bytes // 2
+        self.flags[slot] = flags
+        self.timestamps[slot] = timestamp
+        self.adc_latencies[slot] = adc_latency
+        # Publish the slot
+        self.written += 1
+        if waiting + 1 > self.high_water:
+            self.high_water = waiting + 1
+        self._data_available.set()
+        return True
+
+    def peek(self):
+        """Consumer: (samples, flags, timestamp, adc_latency) of the oldest chunk, or None if there is none.
+        samples is a view into the slot, valid until advance() is called."""
+        if self.read == self.written:
+            return None
+        slot = self.read % self.capacity
+        return (self.slots[slot, :self.lengths[slot]], int(self.flags[slot]), float(self.timestamps[slot]),
+                float(self.adc_latencies[slot]))
+
+    def advance(self):
+        """Consumer: done with the chunk from peek(); its slot can be reused"""
+        self.read += 1
+
+    def wait(self, timeout: float = None) -> bool:
+        """Consumer: block until a chunk is waiting (False if timeout passes first: an underrun, once audio has
+        started arriving)"""
+        if self.read != self.written:
+            return True
+        self._data_available.clear()
+        # Check again: a chunk may have been written between the first check and clear()
+        if self.read != self.written or self._data_available.wait(timeout):
+            return True
+        if self.written:
+            self.underruns += 1
+        return False
+
+    def wake(self):
+        """Wake up a waiting consumer (e.g. to shut it down)"""
+        self._data_available.set()
+
+    def stats(self):
+        return {
+            "written": self.written,
+            "read": self.read,
+            "waiting": len(self),
+            "high_water": self.high_water,
+            "capacity": self.capacity,
+            "dropped": self.dropped,
+            "input_overflows": self.input_overflows,
+            "input_underflows": self.input_underflows,
+            "underruns": self.underruns
+        }
@@ -0,0 +1,270 @@
+"""Performance benchmarks for the control loop, on simulated hardware (no PCA9685, PS4 controller or mic needed).
+
+    python benchmarks.py                     # run all, print them, and write benchmark_results.json
+    python benchmarks.py --save-baseline     # ... and store the results as the baseline (benchmark_baseline.json)
+    python benchmarks.py tick_idle map_values
+
+Each benchmark times one unit of work many times, on the servo boards, clock and microphone from hardware.py:
+    audio_callback      audio_stream_callback with one chunk (PortAudio's real-time callback)
+    audio_processing    process_pending_audio of that chunk (loudness filter, envelope and jaw mapping)
+    tick_normal         one update_servos_tick with the sticks moving
+    tick_idle           ... with no input for longer than the idle timeout (blinking and breathing)
+    tick_lip_sync       ... playing Luna's Story
+    tick_calibrate_*    ... in each calibration mode, with the sticks moving
+    map_values          one call, as in handle_mic_level
+    lip_sync_seek       advancing the jaw track's index by one frame, over all of lunas_story_jaw_values.json
+    startup             process start to the first servo write, in a new process each time
+Budgets are for a Raspberry Pi 4: the audio work has to fit in the time between chunks (512 samples at 44.1 kHz is
+about 11.6 ms), a tick in one PWM frame (16.7 ms at 60 Hz). A benchmark fails if its p99 is over its budget, or
+(with a baseline) more than --tolerance slower than the baseline's p99; the exit code is then 1. A baseline from a
+different machine (see "machine" in the results) is not comparable.
+"""
+import argparse, json, logging, os, platform, random, subprocess, sys, time
+import numpy as np
+from hardware import NullMicrophone, SimulatedClock, SimulatedServoBoards
+from lip_sync_track import LipSyncTrack
+from luna_control import AUDIO_INPUT_SETTINGS, PWM_FREQUENCY, LunaController
+from luna_utils import map_values
+
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+RESULTS_FILEPATH = os.path.join(SCRIPT_DIR, "benchmark_results.json")
+BASELINE_FILEPATH = os.path.join(SCRIPT_DIR, "benchmark_baseline.json")
+CHUNK_PERIOD_MS = 1000 * AUDIO_INPUT_SETTINGS["chunk"] / AUDIO_INPUT_SETTINGS["rate"]
+FRAME_PERIOD_MS = 1000 / PWM_FREQUENCY
+CALIBRATION_MODES = {0: "eyes", 1: "eyelids", 2: "jaw", 3: "neck"}
+NOISE_MS = 0.002  # p99 differences smaller than this are timer and scheduling noise, not regressions
+
+
+def summarize(durations, budget_ms=None):
+    """Statistics (in milliseconds) of durations in seconds, and how much of the budget the p99 uses"""
+    durations_ms = 1000 * np.asarray(durations)
+    summary = {"count": len(durations_ms), "mean_ms": float(durations_ms.mean()),
+               "p50_ms": float(np.percentile(durations_ms, 50)), "p99_ms": float(np.percentile(durations_ms, 99)),
+               "max_ms": float(durations_ms.max()), "budget_ms": budget_ms}
+    if budget_ms is not None:
+        summary["budget_used"] = summary["p99_ms"] / budget_ms
+    return summary
+
+
+def simulated_controller():
+    """A LunaController on simulated servo boards and clock, driven by the caller (no threads)"""
+    clock = SimulatedClock()
+    controller = LunaController(SimulatedServoBoards(PWM_FREQUENCY), microphone=NullMicrophone(), clock=clock,
+                                sleep=clock.sleep, start_update_thread=False, interface="/dev/input/js0",
+                                connecting_using_ds4drv=False)
+    return controller, clock
+
+
+def time_ticks(controller, clock, iterations, before_tick=None):
+    """Time update_servos_tick, one PWM frame of simulated time apart"""
+    dt = 1 / PWM_FREQUENCY
+    durations = np.empty(iterations)
+    for i in range(iterations):
+        clock.sleep(dt)
+        if before_tick is not None:
+            before_tick(i)
+        start = time.perf_counter()
+        controller.update_servos_tick(dt)
+        durations[i] = time.perf_counter() - start
+    return durations
+
+
+def move_sticks(controller):
+    """before_tick: sweep both sticks back and forth (as a puppeteer would, about once a second)"""
+    def before_tick(i):
+        value = int(32767 * np.sin(2 * np.pi * i / PWM_FREQUENCY))
+        controller.on_R3_right(value)
+        controller.on_R3_down(value // 2)
+        controller.on_L3_right(-value)
+        controller.on_L3_down(value // 3)
+    return before_tick
+
+
+def benchmark_audio(iterations):
+    controller, clock = simulated_controller()
+    chunk = controller.audio_input_settings["chunk"]
+    rng = np.random.default_rng(0)
+    chunks = [rng.integers(-8000, 8000, chunk * controller.audio_input_settings["channels"], dtype=np.int16).tobytes()
+              for _ in range(16)]
+    time_info = {"current_time": 0.0, "input_buffer_adc_time": 0.0}
+    callback_durations = np.empty(iterations)
+    processing_durations = np.empty(iterations)
+    for i in range(iterations + 100):
+        start = time.perf_counter()
+        controller.audio_stream_callback(chunks[i % len(chunks)], chunk, time_info, 0)
+        callback_done = time.perf_counter()
+        controller.process_pending_audio()
+        processing_done = time.perf_counter()
+        if i >= 100:  # after warming up
+            callback_durations[i - 100] = callback_done - start
+            processing_durations[i - 100] = processing_done - callback_done
+    return {"audio_callback": summarize(callback_durations, CHUNK_PERIOD_MS),
+            "audio_processing": summarize(processing_durations, CHUNK_PERIOD_MS)}
+
+
+def benchmark_tick_normal(iterations):
+    controller, clock = simulated_controller()
+    return summarize(time_ticks(controller, clock, iterations, move_sticks(controller)), FRAME_PERIOD_MS)
+
+
+def benchmark_tick_idle(iterations):
+    controller, clock = simulated_controller()
+    # Past the idle timeout, so blinking and breathing are automated
+    clock.sleep(controller.idle_timeout_seconds + 1)
+    return summarize(time_ticks(controller, clock, iterations), FRAME_PERIOD_MS)
+
+
+def benchmark_tick_lip_sync(iterations):
+    controller, clock = simulated_controller()
+
+    def before_tick(i):
+        if not controller.show_active:
+            controller.start_show()
+    before_tick(0)
+    if not controller.show_active:
+        raise RuntimeError("Luna's Story could not be started")
+    return summarize(time_ticks(controller, clock, iterations, before_tick), FRAME_PERIOD_MS)
+
+
+def benchmark_tick_calibration(mode, iterations):
+    controller, clock = simulated_controller()
+    controller.enter_calibration_mode(mode)
+    return summarize(time_ticks(controller, clock, iterations, move_sticks(controller)), FRAME_PERIOD_MS)
+
+
+def benchmark_map_values(iterations, batch=100):
+    """Per call, timed in batches (a single call is too short to time on its own)"""
+    rng = np.random.default_rng(0)
+    levels = rng.uniform(-50, -10, batch).tolist()
+    durations = np.empty(iterations // batch)
+    for i in range(len(durations)):
+        start = time.perf_counter()
+        for db in levels:
+            map_values(db, -38, -21, 50, 110, clamp=True)
+        durations[i] = (time.perf_counter() - start) / batch
+    return summarize(durations)
+
+
+def benchmark_lip_sync_seek():
+    """One seek per PWM frame, as in play_show, from the start to the end of the track"""
+    with open(os.path.join(SCRIPT_DIR, "lunas_story_jaw_values.json")) as track_file:
+        track = LipSyncTrack.from_keyframes(json.load(track_file))
+    frame_times = np.arange(0, track.duration + 1, 1 / PWM_FREQUENCY).tolist()
+    durations = np.empty(len(frame_times))
+    index = track.seek(0.0)
+    for i, t in enumerate(frame_times):
+        start = time.perf_counter()
+        index = track.seek(t, index)
+        durations[i] = time.perf_counter() - start
+    summary = summarize(durations)
+    summary["total_ms"] = 1000 * float(durations.sum())
+    return summary
+
+
+def startup_run():
+    """(In a new process) build the controller and run its first tick; prints the startup milestones as JSON"""
+    controller, clock = simulated_controller()
+    controller.update_servos_tick(1 / PWM_FREQUENCY)
+    print(json.dumps(controller.startup.stats()))
+
+
+def benchmark_startup(runs):
+    durations = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, os.path.realpath(__file__), "--startup-run"], capture_output=True,
+                                text=True, check=True, cwd=SCRIPT_DIR).stdout
+        durations.append(json.loads(output.splitlines()[-1])["first_servo_write"])
+    return summarize(durations)
+
+
+def run_benchmarks(names=None, iterations=1000, startup_runs=5):
+    """Run the benchmarks named (all by default); returns {name: summary}"""
+    benchmarks = {
+        "audio": lambda: benchmark_audio(iterations),
+        "tick_normal": lambda: benchmark_tick_normal(iterations),
+        "tick_idle": lambda: benchmark_tick_idle(iterations),
+        "tick_lip_sync": lambda: benchmark_tick_lip_sync(iterations),
+        **{f"tick_calibrate_{name}": (lambda mode=mode: benchmark_tick_calibration(mode, iterations))
+           for mode, name in CALIBRATION_MODES.items()},
+        "map_values": lambda: benchmark_map_values(100 * iterations),
+        "lip_sync_seek": benchmark_lip_sync_seek,
+        "startup": lambda: benchmark_startup(startup_runs)
+    }
+    results = {}
+    for name, benchmark in benchmarks.items():
+        selected = names is None or name in names or (name == "audio" and
+                                                       {"audio_callback", "audio_processing"} & set(names))
+        if not selected:
+            continue
+        random.seed(0)
+        result = benchmark()
+        results.update(result if name == "audio" else {name: result})
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Failures: benchmarks over their budget, or slower than the baseline by more than tolerance (a fraction)"""
+    failures = []
+    for name, result in results.items():
+        if result["budget_ms"] is not None and result["p99_ms"] > result["budget_ms"]:
+            failures.append(f"{name}: p99 {result['p99_ms']:.3f} ms is over the {result['budget_ms']:.1f} ms budget")
+        previous = baseline.get(name)
+        if previous is not None and result["p99_ms"] > (1 + tolerance) * previous["p99_ms"] and \
+                result["p99_ms"] - previous["p99_ms"] > NOISE_MS:
+            failures.append(f"{name}: p99 {result['p99_ms']:.4f} ms, up from {previous['p99_ms']:.4f} ms "
+                            f"({100 * (result['p99_ms'] / previous['p99_ms'] - 1):+.0f}%)")
+    return failures
+
+
+def machine():
+    return {"platform": platform.platform(), "machine": platform.machine(), "python": platform.python_version(),
+            "numpy": np.__version__}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control loop benchmarks, on simulated hardware")
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default: all)")
+    parser.add_argument("--iterations", type=int, default=1000, help="ticks (and audio chunks) per benchmark")
+    parser.add_argument("--startup-runs", type=int, default=5, help="processes to start for the startup benchmark")
+    parser.add_argument("-o", "--output", default=RESULTS_FILEPATH, help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=BASELINE_FILEPATH, help="results to compare against, if the file exists")
+    parser.add_argument("--save-baseline", action="store_true", help="also store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="how much slower than the baseline (p99, as a fraction) counts as a regression")
+    parser.add_argument("--startup-run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.startup_run:
+        startup_run()
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline_data = json.load(baseline_file)
+        if baseline_data.get("machine", {}).get("machine") != platform.machine():
+            print(f"Note: the baseline is from a different machine ({baseline_data.get('machine')})")
+        baseline = baseline_data["results"]
+
+    results = run_benchmarks(args.names or None, args.iterations, args.startup_runs)
+    for name, result in results.items():
+        line = f"{name:<24} mean {result['mean_ms']:9.4f} ms  p99 {result['p99_ms']:9.4f} ms  max {result['max_ms']:9.4f} ms"
+        if result["budget_ms"] is not None:
+            line += f"  ({100 * result['budget_used']:.1f}% of {result['budget_ms']:.1f} ms)"
+        if name in baseline:
+            line += f"  baseline p99 {baseline[name]['p99_ms']:.4f} ms"
+        print(line)
+
+    data = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine(), "results": results}
+    for filepath in [args.output] + ([args.baseline] if args.save_baseline else []):
+        with open(filepath, 'w') as results_file:
+            json.dump(data, results_file, indent=2)
+    failures = compare(results, baseline, args.tolerance)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""calibration.json persistence off the control thread: write-behind saves and change detection for hot-reload.
+
+Saving from the update thread used to stall every servo for as long as the SD card took to write, and a crash
+mid-write left a truncated file. CalibrationStore serializes the data on the caller's thread (so it is a
+consistent snapshot) and hands the text to its own thread, which writes it atomically: to a temporary file
+next to calibration.json, fsync'd, then renamed over it. Several saves in a row only write the newest one.
+
+The same thread polls the file's modification time, and when the file was changed by something else (an
+editor, scp), reads and validates it and leaves it for the update thread to pick up between frames
+(take_reload()). Files that don't parse or validate are reported and ignored, so a half-edited file never
+reaches the servos.
+"""
+import json, logging, os, tempfile, threading
+
+
+log = logging.getLogger(__name__)
+
+
+def atomic_write_text(filepath, text):
+    """Replace filepath with text, so that readers (and a crash) see either the old file or the new one"""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, temp_filepath = tempfile.mkstemp(dir=directory, prefix=os.path.basename(filepath) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            temp_file.write(text)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_filepath, filepath)
+    except BaseException:
+        try:
+            os.unlink(temp_filepath)
+        except OSError:
+            pass
+        raise
+    # Make the rename itself durable
+    try:
+        directory_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(directory_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(directory_fd)
+
+
+class CalibrationStore:
+    """Write-behind saving and change polling of one JSON file.
+
+    validate(data) is called on new file contents before they are offered for reload; it raises ValueError
+    (or KeyError/TypeError) to reject them.
+    """
+    def __init__(self, filepath, validate=None, poll_interval=1.0):
+        self.filepath = filepath
+        self.validate = validate
+        self.poll_interval = poll_interval
+        self.saves = 0
+        self.reloads = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending_text = None
+        self._writing = False
+        self._written = threading.Condition(self._lock)
+        self._reload = None
+        self._file_state = None
+        self._thread = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.filepath)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def load(self):
+        """Read the file now (at startup); {} if there is none"""
+        self._file_state = self._stat()
+        try:
+            with open(self.filepath, 'r') as calibration_file:
+                return json.load(calibration_file)
+        except FileNotFoundError:
+            log.info("Using default calibration values")
+            return {}
+
+    def start(self):
+        """Start the writer/watcher thread (a daemon; call flush() before exiting to finish pending saves)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def save(self, data):
+        """Queue data to be written; returns right away. Only the newest of several queued saves is written."""
+        text = json.dumps(data, indent=2)
+        with self._lock:
+            self._pending_text = text
+        if self._thread is None:
+            # Nothing running in the background (e.g. a simulation): write it now
+            self._write_pending()
+        else:
+            self._wake.set()
+
+    def flush(self, timeout=5.0) -> bool:
+        """Wait until queued saves have been written; False if they were not within timeout"""
+        if self._thread is None:
+            self._write_pending()
+            return True
+        self._wake.set()
+        with self._written:
+            return self._written.wait_for(lambda: self._pending_text is None and not self._writing, timeout)
+
+    def take_reload(self):
+        """Validated new file contents, if the file changed since the last call (else None)"""
+        with self._lock:
+            data, self._reload = self._reload, None
+        return data
+
+    def _write_pending(self):
+        with self._lock:
+            text, self._pending_text = self._pending_text, None
+            if text is None:
+                return
+            self._writing = True
+        try:
+            atomic_write_text(self.filepath, text)
+            self.saves += 1
+        except OSError as err:
+            log.error(f"Could not save calibration: {err}")
+        finally:
+            # Our own write is not a change to reload
+            self._file_state = self._stat()
+            with self._written:
+                self._writing = False
+                self._written.notify_all()
+
+    def _check_for_changes(self):
+        file_state = self._stat()
+        if file_state is None or file_state == self._file_state:
+            return
+        self._file_state = file_state
+        try:
+            with open(self.filepath, 'r') as calibration_file:
+                data = json.load(calibration_file)
+            if self.validate is not None:
+                self.validate(data)
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            self.rejected += 1
+            log.warning(f"Ignoring changed {os.path.basename(self.filepath)}: {err}")
+            return
+        with self._lock:
+            self._reload = data
+        self.reloads += 1
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            self._write_pending()
+            self._check_for_changes()
+
+    def stats(self):
+        return {"saves": self.saves, "reloads": self.reloads, "rejected": self.rejected}
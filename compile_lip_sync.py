@@ -0,0 +1,162 @@
+"""Compile a WAV file into a lip-sync jaw track (the same [[t, value], ...] format as lunas_story_jaw_values.json)
+
+Runs the same pipeline as the live mic (LunaController.process_pending_audio: MultirateEnvelope's decimating
+low-pass and smoothed envelope on the first channel, then map_values), over the whole file as fast as it goes
+instead of in real time.
+
+Usage:
+    python compile_lip_sync.py lunas_story.wav -o lunas_story_jaw_values.json
+"""
+import argparse, hashlib, json, logging, os, time
+import numpy as np
+from scipy.io import wavfile
+from audio_envelope import FilterCache, MultirateEnvelope
+from luna_utils import map_values
+from show_library import compiled_show_path, write_show
+
+
+log = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(SCRIPT_DIR, ".lip_sync_cache")
+DEFAULT_STEP_SECONDS = 0.075
+JAW_CLOSED_VALUE = -32767  # in "controller input" units
+JAW_OPEN_VALUE = 32767     # in "controller input" units
+# The audio_input_settings MultirateEnvelope.from_settings reads, besides chunk (part of compiled tracks' cache key)
+ENVELOPE_SETTINGS = ("decimated_rate", "envelope", "attack_seconds", "release_seconds", "envelope_blocks_per_chunk")
+BLOCK_CHUNKS = 2048        # chunks converted to int16 per block, keeps memory flat for long files
+
+
+def load_audio_input_settings(calibration_filepath):
+    """Mic thresholds etc. come from calibration.json, so compiled tracks match the live mic behavior"""
+    settings = {"chunk": 512, "mic_threshold_low": -38, "mic_threshold_hi": -21}
+    try:
+        with open(calibration_filepath, 'r') as calibration_file:
+            settings.update(json.load(calibration_file).get("audio_input_settings", {}))
+    except FileNotFoundError:
+        log.warning("No calibration file, using default audio input settings")
+    return settings
+
+
+def file_hash(filepath):
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def chunk_loudness(samples, rate, audio_input_settings, filter_cache=None):
+    """Return the loudness (dB) of every chunk of the file, as MultirateEnvelope.process gives it for the live mic"""
+    chunk = audio_input_settings["chunk"]
+    channels = samples.shape[1] if samples.ndim > 1 else 1
+    envelope = MultirateEnvelope.from_settings({**audio_input_settings, "rate": rate, "channels": channels},
+                                               filter_cache)
+    full_scale = np.iinfo(samples.dtype).max + 1 if samples.dtype.kind in 'iu' else 1.0
+    n_chunks = len(samples) // chunk
+    db = np.empty(n_chunks)
+    block_size = BLOCK_CHUNKS * chunk
+    for first_chunk in range(0, n_chunks, BLOCK_CHUNKS):
+        block = samples[first_chunk * chunk:first_chunk * chunk + block_size]
+        block = block[:len(block) - len(block) % chunk]
+        if block.dtype != np.dtype('<i2'):
+            # The mic is read as int16, and its thresholds are calibrated against that
+            block = np.clip(np.rint(block * (2**15 / full_scale)), -2**15, 2**15 - 1).astype('<i2')
+        # Interleaved frames, as PortAudio hands them over (the envelope uses the first channel, like the mic's)
+        block = np.ascontiguousarray(block)
+        for i in range(len(block) // chunk):
+            db[first_chunk + i] = envelope.process(block[i * chunk:(i + 1) * chunk])
+    return db
+
+
+def reduce_to_keyframes(jaw_values, chunk_seconds, step_seconds, tolerance=0):
+    """Decimate per-chunk jaw values to one value per step (the widest opening in that step),
+    then keep only the steps where the value changes by more than tolerance."""
+    step_seconds = max(step_seconds, chunk_seconds)
+    step_index = (np.arange(len(jaw_values)) * chunk_seconds // step_seconds).astype(int)
+    n_steps = step_index[-1] + 1 if len(step_index) else 0
+    step_starts = np.searchsorted(step_index, np.arange(n_steps))
+    stepped = np.maximum.reduceat(jaw_values, step_starts) if n_steps else np.empty(0)
+    stepped = np.rint(stepped).astype(int)
+
+    track = [[0.0, int(stepped[0]) if n_steps else JAW_CLOSED_VALUE]]
+    for i, value in enumerate(stepped):
+        if abs(value - track[-1][1]) > tolerance:
+            track.append([round(i * step_seconds, 3), int(value)])
+    end_time = round(n_steps * step_seconds, 3)
+    if track[-1][1] != JAW_CLOSED_VALUE or len(track) == 1:
+        track.append([end_time, JAW_CLOSED_VALUE])
+    return track
+
+
+def compile_track(wav_filepath, audio_input_settings, step_seconds=DEFAULT_STEP_SECONDS, tolerance=0,
+                  cache_dir=DEFAULT_CACHE_DIR):
+    """Return the jaw track for a WAV file, reusing a cached result when the audio and settings are unchanged"""
+    cache_filepath = None
+    if cache_dir:
+        key_data = json.dumps({
+            "audio": file_hash(wav_filepath),
+            "chunk": audio_input_settings["chunk"],
+            "mic_threshold_low": audio_input_settings["mic_threshold_low"],
+            "mic_threshold_hi": audio_input_settings["mic_threshold_hi"],
+            "envelope": {name: audio_input_settings.get(name) for name in ENVELOPE_SETTINGS},
+            "step_seconds": step_seconds,
+            "tolerance": tolerance
+        }, sort_keys=True)
+        cache_filepath = os.path.join(cache_dir, hashlib.sha256(key_data.encode()).hexdigest() + ".json")
+        if os.path.exists(cache_filepath):
+            with open(cache_filepath, 'r') as cache_file:
+                return json.load(cache_file)
+
+    rate, samples = wavfile.read(wav_filepath, mmap=True)
+    chunk = audio_input_settings["chunk"]
+    filter_cache = FilterCache(os.path.join(SCRIPT_DIR, "filter_cache.json"))
+    db = chunk_loudness(samples, rate, audio_input_settings, filter_cache)
+    filter_cache.save()
+    jaw_values = map_values(
+        db,
+        audio_input_settings["mic_threshold_low"],
+        audio_input_settings["mic_threshold_hi"],
+        JAW_CLOSED_VALUE,
+        JAW_OPEN_VALUE,
+        clamp=True
+    )
+    track = reduce_to_keyframes(jaw_values, chunk / rate, step_seconds, tolerance)
+
+    if cache_filepath:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_filepath, 'w') as cache_file:
+            json.dump(track, cache_file)
+    return track
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a WAV file into a lip-sync jaw track")
+    parser.add_argument("wav_file")
+    parser.add_argument("-o", "--output", help="output .json track (default: <wav name>_jaw_values.json)")
+    parser.add_argument("--calibration", default=os.path.join(SCRIPT_DIR, "calibration.json"),
+                        help="calibration.json to read the mic thresholds from")
+    parser.add_argument("--step", type=float, default=DEFAULT_STEP_SECONDS, help="seconds between keyframes")
+    parser.add_argument("--tolerance", type=int, default=0,
+                        help="drop keyframes that change the jaw value by this much or less")
+    parser.add_argument("--no-cache", action="store_true", help="always recompile, ignoring cached results")
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.wav_file)[0] + "_jaw_values.json"
+    start = time.perf_counter()
+    track = compile_track(
+        args.wav_file,
+        load_audio_input_settings(args.calibration),
+        step_seconds=args.step,
+        tolerance=args.tolerance,
+        cache_dir=None if args.no_cache else DEFAULT_CACHE_DIR
+    )
+    with open(output, 'w') as output_file:
+        json.dump(track, output_file)
+    # Ready to play as a jaw-only show
+    write_show({"jaw": track}, compiled_show_path(output))
+    print(f"Wrote {len(track)} keyframes ({track[-1][0]:.1f} s) to {output} in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Control-loop watchdog: notices when the servo updates stop, and gets them going again.
+
+If the I2C bus hangs or the update_servos thread dies, the process itself keeps running (the controller input
+loop is still alive), so startup_and_monitor.bash never restarts it and Luna just freezes. LunaController
+records a heartbeat at the end of every update tick; the watchdog thread checks it every budget / 4 seconds.
+
+When the heartbeat is older than budget (or the update thread has died), it tries, in order:
+    1. In-process recovery: re-initialize the PCA9685s (fresh I2C connections, if a factory was given), and
+       restart the update and audio threads. A thread stuck in the hung I2C write is abandoned: the servo output
+       gets new board writers, and when (if ever) the write returns, the old thread writes nothing more and exits.
+    2. If the heartbeat has not resumed budget seconds after a recovery attempt, another attempt, up to
+       max_recoveries within recovery_window seconds.
+    3. After that, restart(): exit the whole process, for the monitor script to start it again.
+
+Stall and recovery times are logged, and kept in stats() (exported with the latency stats, as luna_watchdog):
+    stall_seconds     from the last heartbeat before the stall to the first one after it
+    recovery_seconds  from detecting the stall to the first heartbeat after it
+"""
+import logging, os, threading, time
+from luna_log import fields
+
+
+log = logging.getLogger(__name__)
+
+WATCHDOG_EXIT_CODE = 75  # exit status when the watchdog gives up and restarts the process
+
+
+class ControlWatchdog:
+    def __init__(self, controller, budget=0.2, max_recoveries=3, recovery_window=60.0, reinitialize_boards=None,
+                 restart=None, clock=time.perf_counter):
+        """controller: a LunaController (its heartbeat, recover_control_loop() and update thread are used)
+        reinitialize_boards: returns newly initialized servo boards (like hardware.I2CServoBoards), for recovery
+            (None: keep the current ones)
+        restart: called when in-process recovery failed (default: exit with WATCHDOG_EXIT_CODE)
+        """
+        self.controller = controller
+        self.budget = budget
+        self.max_recoveries = max_recoveries
+        self.recovery_window = recovery_window
+        self.reinitialize_boards = reinitialize_boards
+        self.restart = self.exit_process if restart is None else restart
+        self.clock = clock
+        self.stalls = 0
+        self.recoveries = 0
+        self.last_stall_seconds = 0.0
+        self.last_recovery_seconds = 0.0
+        self.max_stall_seconds = 0.0
+        self._attempts = []          # times of recent recovery attempts
+        self._stall_heartbeat = None  # last heartbeat before the current stall (None: not stalled)
+        self._detected = None
+        self._thread = None
+        self.gave_up = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.budget / 4)
+            self.check()
+
+    def check(self, now=None):
+        """Check the heartbeat once (the watchdog thread does this every budget / 4 seconds)"""
+        now = self.clock() if now is None else now
+        if self.gave_up:
+            return
+        heartbeat = self.controller.heartbeat
+        if self._stall_heartbeat is not None and heartbeat > self._attempts[-1]:
+            # Running again since the last recovery attempt
+            self.recoveries += 1
+            self.last_stall_seconds = heartbeat - self._stall_heartbeat
+            self.last_recovery_seconds = heartbeat - self._detected
+            self.max_stall_seconds = max(self.max_stall_seconds, self.last_stall_seconds)
+            log.warning("Control loop recovered", extra=fields(stall_seconds=self.last_stall_seconds,
+                                                               recovery_seconds=self.last_recovery_seconds))
+            self._stall_heartbeat = None
+            return
+
+        thread_died = self.controller.update_thread_running and not self.controller.update_thread.is_alive()
+        if now - heartbeat < self.budget and not thread_died:
+            return
+        if self._stall_heartbeat is None:
+            self.stalls += 1
+            self._stall_heartbeat = heartbeat
+            self._detected = now
+            log.error("Control loop stalled", extra=fields(seconds_since_heartbeat=now - heartbeat,
+                                                           update_thread_died=thread_died))
+        elif now - self._attempts[-1] < self.budget:
+            # Give the last recovery attempt time to work
+            return
+
+        self._attempts = [t for t in self._attempts if now - t < self.recovery_window]
+        if len(self._attempts) >= self.max_recoveries:
+            log.critical("Control loop did not recover; restarting the process",
+                         extra=fields(attempts=len(self._attempts), stalled_seconds=now - self._stall_heartbeat))
+            self.gave_up = True
+            self.restart()
+            return
+        self._attempts.append(now)
+        servo_boards = None
+        if self.reinitialize_boards is not None:
+            try:
+                servo_boards = self.reinitialize_boards()
+            except Exception as err:
+                log.error(f"Could not re-initialize the servo boards: {err}")
+        self.controller.recover_control_loop(servo_boards)
+
+    def exit_process(self):
+        """Exit right away, from any thread (listen() would keep the process alive otherwise)"""
+        logging.shutdown()
+        os._exit(WATCHDOG_EXIT_CODE)
+
+    def stats(self):
+        return {
+            "stalls": self.stalls,
+            "recoveries": self.recoveries,
+            "last_stall_seconds": self.last_stall_seconds,
+            "last_recovery_seconds": self.last_recovery_seconds,
+            "max_stall_seconds": self.max_stall_seconds
+        }
@@ -0,0 +1,102 @@
+"""Fixed-rate scheduling for the servo update loop, on absolute monotonic deadlines.
+
+Sleeping a fixed time after each iteration makes the real tick period drift with the work done in it.
+FrameScheduler instead computes each deadline from the start time, so the average rate stays locked,
+and keeps statistics on how late each tick woke up (jitter) and how many deadlines were missed (overruns).
+"""
+import time
+import numpy as np
+
+
+CATCH_UP_POLICIES = ("skip", "burst", "reset")
+
+
+class FrameScheduler:
+    """Call wait() once per loop iteration; it sleeps until the next deadline and returns the elapsed time (dt).
+
+    When a tick overruns past the next deadline(s), catch_up decides what happens:
+        "skip":  drop the missed ticks and continue on the original grid of deadlines (default)
+        "burst": run the missed ticks back to back without sleeping, up to max_burst ticks, then skip the rest
+        "reset": restart the grid of deadlines from now
+    """
+    def __init__(self, rate_hz: float, catch_up: str = "skip", max_burst: int = 4, clock=time.monotonic,
+                 sleep=time.sleep, history: int = 1024):
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"catch_up must be one of {CATCH_UP_POLICIES}")
+        self.period = 1.0 / rate_hz
+        self.catch_up = catch_up
+        self.max_burst = max_burst
+        self.clock = clock
+        self.sleep = sleep
+        self._jitter = np.zeros(history)  # seconds late, for the most recent ticks
+        self.reset()
+
+    @property
+    def rate_hz(self) -> float:
+        return 1.0 / self.period
+
+    def reset(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self._burst = 0
+        self._jitter.fill(0)
+        self.next_deadline = None
+        self.last_tick = None
+
+    def remaining(self) -> float:
+        """Seconds until the next deadline (0 if it has already passed, or before the first tick).
+        For event loops that sleep on their own before calling wait()."""
+        if self.next_deadline is None:
+            return 0.0
+        return max(0.0, self.next_deadline - self.clock())
+
+    def wait(self) -> float:
+        """Sleep until the next deadline; return the seconds since the previous tick"""
+        now = self.clock()
+        if self.next_deadline is None:
+            # First tick runs immediately
+            self.next_deadline = now
+        elif now < self.next_deadline:
+            self.sleep(self.next_deadline - now)
+            now = self.clock()
+
+        late = now - self.next_deadline
+        if late >= self.period:
+            # This tick overran one or more whole periods
+            self.overruns += 1
+            missed = int(late // self.period)
+            if self.catch_up == "reset":
+                self.missed_ticks += missed
+                self.next_deadline = now
+            elif self.catch_up == "burst" and self._burst < self.max_burst:
+                # Run the next tick right away, without skipping
+                self._burst += 1
+            else:
+                self.missed_ticks += missed
+                self.next_deadline += missed * self.period
+        else:
+            self._burst = 0
+
+        self._jitter[self.ticks % len(self._jitter)] = now - self.next_deadline
+        self.ticks += 1
+        self.next_deadline += self.period
+
+        dt = self.period if self.last_tick is None else now - self.last_tick
+        self.last_tick = now
+        return dt
+
+    def stats(self):
+        """Tick statistics: counts, and jitter (how late ticks woke up) over the most recent ticks, in milliseconds"""
+        jitter = self._jitter[:min(self.ticks, len(self._jitter))]
+        if len(jitter) == 0:
+            jitter = np.zeros(1)
+        return {
+            "rate_hz": self.rate_hz,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "missed_ticks": self.missed_ticks,
+            "jitter_mean_ms": 1000 * float(jitter.mean()),
+            "jitter_p99_ms": 1000 * float(np.percentile(jitter, 99)),
+            "jitter_max_ms": 1000 * float(jitter.max())
+        }
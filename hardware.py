@@ -0,0 +1,376 @@
+"""Pluggable hardware backends for LunaController: servo output (I2C bus), controller input, and audio input.
+
+Each has the real implementation used on the Raspberry Pi, and a simulated one that runs in-process on any
+computer, so the control logic can be run headless (and faster than real time) for testing and profiling:
+
+    servo output:     I2CServoBoards           SimulatedServoBoards (SimulatedI2CBuses with SimulatedPCA9685Chip
+                                               register files)
+    controller input: JoystickInput (js0)      ScriptedJoystick (timed on_* handler calls)
+    audio input:      PyAudioMicrophone        WavFileMicrophone (or NullMicrophone)
+"""
+import json, logging, threading, time
+import numpy as np
+from luna_log import fields
+from luna_utils import SupressStdoutStderr
+from servo_output import DEFAULT_BUS
+
+
+log = logging.getLogger(__name__)
+
+PA_CONTINUE = 0  # pyaudio.paContinue, for stream callbacks
+
+PCA9685_ADDRESS = 0x40
+PCA9685_MODE1 = 0x00
+PCA9685_PRESCALE = 0xFE
+PCA9685_LED0_ON_L = 0x06
+
+
+class SimulatedClock:
+    """A virtual monotonic clock; sleep() advances it instantly, so simulations run as fast as possible"""
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            self.now += seconds
+
+
+#### SERVO OUTPUT ####
+
+class SimulatedPCA9685Chip:
+    """Register file of a PCA9685, as seen over I2C (including MODE1 register auto-increment)"""
+    def __init__(self, reference_clock_speed=25000000):
+        self.reference_clock_speed = reference_clock_speed
+        self.registers = bytearray(256)
+        self.registers[PCA9685_MODE1] = 0x11      # power-on default: sleep, respond to all-call
+        self.registers[PCA9685_PRESCALE] = 0x1E   # power-on default: 200 Hz
+        self.pointer = 0
+        self.writes = 0
+
+    def _advance(self):
+        if self.registers[PCA9685_MODE1] & 0x20:
+            self.pointer = (self.pointer + 1) & 0xFF
+
+    def write(self, data):
+        if len(data) == 0:
+            return
+        self.writes += 1
+        self.pointer = data[0]
+        for byte in data[1:]:
+            self.registers[self.pointer] = byte
+            self._advance()
+
+    def read(self, length):
+        data = bytearray(length)
+        for i in range(length):
+            data[i] = self.registers[self.pointer]
+            self._advance()
+        return data
+
+    @property
+    def frequency(self) -> float:
+        return self.reference_clock_speed / 4096 / (self.registers[PCA9685_PRESCALE] + 1)
+
+    def channel_off(self, channel: int) -> int:
+        """12-bit OFF register value of a channel (0x1000 when fully off)"""
+        register = PCA9685_LED0_ON_L + 4 * channel + 2
+        return self.registers[register] | (self.registers[register + 1] << 8)
+
+    def channel_angle(self, channel: int, actuation_range=180, min_pulse=750, max_pulse=2250):
+        """Servo angle that a channel's current pulse width corresponds to (None when off)"""
+        off = self.channel_off(channel)
+        if off & 0x1000 or off == 0:
+            return None
+        pulse = (off / 4096) / self.frequency * 1000000
+        return actuation_range * (pulse - min_pulse) / (max_pulse - min_pulse)
+
+
+class SimulatedI2CBus:
+    """In-process stand-in for busio.I2C (as returned by board.I2C()), with simulated devices attached by address"""
+    def __init__(self, devices=None):
+        self.devices = {PCA9685_ADDRESS: SimulatedPCA9685Chip()} if devices is None else devices
+        self._lock = threading.Lock()
+        self.transactions = 0
+        self.bytes_transferred = 0
+        self.closed = False
+
+    def _device(self, address):
+        if self.closed:
+            raise OSError("Simulated I2C bus is closed")
+        if address not in self.devices:
+            raise OSError(f"No simulated I2C device at address 0x{address:x}")
+        return self.devices[address]
+
+    def try_lock(self) -> bool:
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return sorted(self.devices.keys())
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        data = bytes(buffer[start:end])
+        self._device(address).write(data)
+        self.transactions += 1
+        self.bytes_transferred += len(data) + 1
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        buffer[start:end] = self._device(address).read(end - start)
+        self.transactions += 1
+        self.bytes_transferred += end - start + 1
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        device = self._device(address)
+        out_data = bytes(buffer_out[out_start:out_end])
+        in_end = len(buffer_in) if in_end is None else in_end
+        device.write(out_data)
+        buffer_in[in_start:in_end] = device.read(in_end - in_start)
+        self.transactions += 1
+        self.bytes_transferred += len(out_data) + (in_end - in_start) + 2
+
+    def deinit(self):
+        self.closed = True
+
+
+class I2CServoBoards:
+    """Opens the PCA9685 servo boards in servo_mapping, on the Raspberry Pi's I2C buses: called as (bus, address),
+    it returns the board's adafruit_pca9685.PCA9685, with its PWM frequency set.
+
+    Bus 1 is the I2C pins (board.SCL, board.SDA). Other buses are /dev/i2c-N (e.g. the Pi 4's i2c-3 to i2c-6
+    device tree overlays), which needs the adafruit-extended-bus package.
+    """
+    def __init__(self, frequency):
+        self.frequency = frequency
+        self.buses = {}
+        self.boards = {}
+
+    def open_bus(self, bus):
+        if bus == DEFAULT_BUS:
+            import board, busio
+            return busio.I2C(board.SCL, board.SDA)
+        try:
+            from adafruit_extended_bus import ExtendedI2C
+        except ImportError:
+            raise OSError(f"I2C bus {bus} needs the adafruit-extended-bus package (pip install adafruit-extended-bus)")
+        return ExtendedI2C(bus)
+
+    def __call__(self, bus, address):
+        if (bus, address) not in self.boards:
+            from adafruit_pca9685 import PCA9685
+            if bus not in self.buses:
+                self.buses[bus] = self.open_bus(bus)
+            pca = PCA9685(self.buses[bus], address=address)
+            # This also enables register auto-increment, which ServoFrameWriter relies on
+            pca.frequency = self.frequency
+            self.boards[(bus, address)] = pca
+        return self.boards[(bus, address)]
+
+    def deinit(self):
+        """Turn off every board's outputs, and close the I2C buses"""
+        for pca in self.boards.values():
+            pca.deinit()
+        self.close()
+
+    def close(self):
+        """Close the I2C buses, leaving the boards as they are (e.g. when newer connections to them replace these)"""
+        for i2c in self.buses.values():
+            i2c.deinit()
+        self.buses.clear()
+        self.boards.clear()
+
+
+class SimulatedServoBoards(I2CServoBoards):
+    """PCA9685 boards on SimulatedI2CBuses, with a SimulatedPCA9685Chip at every address that a board is opened at"""
+    def open_bus(self, bus):
+        return SimulatedI2CBus(devices={})
+
+    def __call__(self, bus, address):
+        if bus not in self.buses:
+            self.buses[bus] = self.open_bus(bus)
+        self.buses[bus].devices.setdefault(address, SimulatedPCA9685Chip())
+        return super().__call__(bus, address)
+
+    @property
+    def transactions(self):
+        return sum(i2c.transactions for i2c in self.buses.values())
+
+    @property
+    def bytes_transferred(self):
+        return sum(i2c.bytes_transferred for i2c in self.buses.values())
+
+
+#### CONTROLLER INPUT ####
+
+class JoystickInput:
+    """The PS4 controller at /dev/input/js0, read by pyPS4Controller's listen()"""
+    def __init__(self, timeout=300):
+        self.timeout = timeout
+
+    def run(self, controller):
+        """Blocks, dispatching controller events to controller's on_* handlers"""
+        controller.listen(timeout=self.timeout)
+
+
+class ScriptedJoystick:
+    """Replays a script of timed controller events: [[t, "on_L2_press", value], [t, "on_L2_release"], ...]
+
+    t is in seconds from the start of the script. The handler names are the same as pyPS4Controller's.
+    """
+    def __init__(self, events, clock=time.monotonic, sleep=time.sleep):
+        self.events = sorted(events, key=lambda event: event[0])
+        self.clock = clock
+        self.sleep = sleep
+        self.index = 0
+        self.start_time = None
+
+    @classmethod
+    def from_file(cls, filepath, **kwargs):
+        with open(filepath) as script_file:
+            return cls(json.load(script_file), **kwargs)
+
+    def pump(self, controller, now: float = None):
+        """Dispatch every event that is due by now; returns the number dispatched"""
+        now = self.clock() if now is None else now
+        if self.start_time is None:
+            self.start_time = now
+        dispatched = 0
+        while self.index < len(self.events) and self.events[self.index][0] <= now - self.start_time:
+            _, handler_name, *args = self.events[self.index]
+            getattr(controller, handler_name)(*args)
+            self.index += 1
+            dispatched += 1
+        return dispatched
+
+    @property
+    def finished(self) -> bool:
+        return self.index >= len(self.events)
+
+    def run(self, controller):
+        """Blocks until the script is over, dispatching events at their scheduled times"""
+        self.start_time = self.clock()
+        while not self.finished and not controller.stop:
+            self.sleep(max(0, self.start_time + self.events[self.index][0] - self.clock()))
+            self.pump(controller)
+
+
+#### AUDIO INPUT ####
+
+class NullMicrophone:
+    """No audio input"""
+    def start(self, callback):
+        return False
+
+    def pump(self, now: float = None):
+        return 0
+
+    def stop(self):
+        pass
+
+
+class PyAudioMicrophone:
+    """USB microphone, found by (partial) device name, delivering chunks through a PyAudio stream callback"""
+    def __init__(self, audio_input_settings):
+        self.audio_input_settings = audio_input_settings
+        self.stream = None
+
+    def start(self, callback):
+        import pyaudio
+        with SupressStdoutStderr():
+            audio = pyaudio.PyAudio()
+
+        # Find mic input device by name
+        device_index = None
+        for i in range(audio.get_device_count()):
+            if self.audio_input_settings["mic_name"] in audio.get_device_info_by_index(i)["name"]:
+                device_index = i
+        if device_index is None:
+            log.warning(f"Microphone named '{self.audio_input_settings['mic_name']}' not found. Make sure it is plugged in!")
+            return False
+        log.info("Microphone found", extra=fields(name=audio.get_device_info_by_index(device_index)['name'],
+                                                  index=device_index))
+        # Initialize Mic Input Stream
+        self.stream = audio.open(format=pyaudio.paInt16,
+                                 channels=self.audio_input_settings["channels"],
+                                 rate=self.audio_input_settings["rate"],
+                                 input=True,
+                                 output=False,
+                                 input_device_index=device_index,
+                                 stream_callback=callback,
+                                 frames_per_buffer=self.audio_input_settings["chunk"])
+        return True
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+
+
+class WavFileMicrophone:
+    """Plays a WAV file into the audio callback, chunk by chunk, as if it came from the mic.
+
+    With realtime=True, a thread delivers chunks at the file's sample rate. Otherwise nothing happens until
+    pump(now) is called, which delivers every chunk that would have arrived by then (for simulations).
+    """
+    def __init__(self, filepath, chunk=512, realtime=True, loop=False, clock=time.monotonic, sleep=time.sleep):
+        from scipy.io import wavfile
+        self.rate, samples = wavfile.read(filepath)
+        if samples.ndim > 1:
+            samples = samples[:, 0]
+        if samples.dtype != np.int16:
+            # Rescale other sample formats to int16, which is what the mic delivers
+            full_scale = np.iinfo(samples.dtype).max + 1 if samples.dtype.kind in 'iu' else 1.0
+            samples = np.clip(samples.astype(np.float64) * (2**15 / full_scale), -32768, 32767).astype(np.int16)
+        self.samples = np.ascontiguousarray(samples, dtype='<i2')
+        self.chunk = chunk
+        self.realtime = realtime
+        self.loop = loop
+        self.clock = clock
+        self.sleep = sleep
+        self.callback = None
+        self.chunk_index = 0
+        self.start_time = None
+        self._stop = threading.Event()
+
+    @property
+    def chunk_seconds(self) -> float:
+        return self.chunk / self.rate
+
+    @property
+    def finished(self) -> bool:
+        return not self.loop and (self.chunk_index + 1) * self.chunk > len(self.samples)
+
+    def start(self, callback):
+        self.callback = callback
+        self.start_time = self.clock()
+        if self.realtime:
+            threading.Thread(target=self._run, daemon=True).start()
+        return True
+
+    def _next_chunk(self):
+        first = (self.chunk_index * self.chunk) % len(self.samples) if self.loop else self.chunk_index * self.chunk
+        data = self.samples[first:first + self.chunk]
+        self.chunk_index += 1
+        return data.tobytes()
+
+    def pump(self, now: float = None):
+        """Deliver every chunk that has been fully 'recorded' by now; returns the number delivered"""
+        now = self.clock() if now is None else now
+        delivered = 0
+        while not self.finished and self.start_time + (self.chunk_index + 1) * self.chunk_seconds <= now:
+            self.callback(self._next_chunk(), self.chunk, None, 0)
+            delivered += 1
+        return delivered
+
+    def _run(self):
+        while not self.finished and not self._stop.is_set():
+            self.sleep(max(0, self.start_time + (self.chunk_index + 1) * self.chunk_seconds - self.clock()))
+            self.pump()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,178 @@
+"""Keyframe animation engine for Luna's idle behaviors (blinking, breathing, tail sway).
+
+Each animation is described as data (see IDLE_ANIMATIONS in luna_control.py) and compiled once into a lookup
+table sampled at a fixed rate, so evaluating it at any time is one index computation and one linear
+interpolation between two table entries, no matter how many keyframes it has.
+
+An animation entry:
+    "channel":       name of the output it drives (several animations may drive the same channel)
+    "keyframes":     [[t, value], ...], interpolated as "step" (hold each value), "linear" or "cubic"
+                     (monotone cubic, so it never overshoots the keyframe values)
+      or
+    "waveform":      "sine", with "period" (seconds), "amplitude" and optionally "phase" (0 to 1)
+    "offset":        added to every value (default 0)
+    "loop":          keyframes repeat instead of holding the last value (waveforms always repeat)
+    "origin":        name of the time origin the animation runs from (set with Animator.set_origin), default "clock"
+    "weight":        blend weight among the animations on the same channel (default 1)
+    "additive":      add to the blended value instead of being blended in (default false)
+    "enabled":       whether it plays without being started (default true; false for one-shots like a blink)
+"""
+import math
+import numpy as np
+
+
+SAMPLE_RATE = 1000        # lookup table samples per second, for keyframe curves
+WAVEFORM_SAMPLES = 1024   # lookup table samples per period, for waveforms
+INTERPOLATIONS = ("step", "linear", "cubic")
+
+
+class AnimationCurve:
+    """A value over time as a lookup table: table[i] is the value at time i / sample_rate"""
+    def __init__(self, table, sample_rate, loop=False, interpolate=True):
+        self.table = np.asarray(table, dtype=np.float64)
+        self.sample_rate = float(sample_rate)
+        self.loop = loop
+        self.interpolate = interpolate
+        self._values = self.table.tolist()  # indexing a list is much faster than indexing an array, per value
+        self._length = len(self._values)
+        self.duration = (len(self.table) - (0 if loop else 1)) / self.sample_rate
+
+    @classmethod
+    def from_keyframes(cls, keyframes, interpolation="linear", loop=False, sample_rate=SAMPLE_RATE):
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"interpolation must be one of {INTERPOLATIONS}")
+        times = np.array([keyframe[0] for keyframe in keyframes], dtype=np.float64)
+        values = np.array([keyframe[1] for keyframe in keyframes], dtype=np.float64)
+        sample_times = np.arange(int(round(times[-1] * sample_rate)) + 1) / sample_rate
+        if interpolation == "step":
+            # Small tolerance, so a keyframe at 0.05 s is reached by the sample at 0.05 s despite float rounding
+            table = values[np.searchsorted(times, sample_times + 1e-9, side='right') - 1]
+        elif interpolation == "cubic" and len(keyframes) > 2:
+            from scipy.interpolate import PchipInterpolator  # only imported (slowly) when a cubic curve is used
+            table = PchipInterpolator(times, values)(sample_times)
+        else:
+            table = np.interp(sample_times, times, values)
+        if loop:
+            table = table[:-1]  # the last keyframe is where the next repetition starts
+        return cls(table, sample_rate, loop=loop, interpolate=interpolation != "step")
+
+    @classmethod
+    def from_waveform(cls, waveform, period, amplitude=1.0, phase=0.0, samples=WAVEFORM_SAMPLES):
+        if waveform != "sine":
+            raise ValueError(f"Unknown waveform '{waveform}'")
+        table = amplitude * np.sin(2 * np.pi * (np.arange(samples) / samples + phase))
+        return cls(table, samples / period, loop=True)
+
+    def __call__(self, t: float) -> float:
+        position = t * self.sample_rate
+        index = math.floor(position)
+        values = self._values
+        if self.loop:
+            index %= self._length
+        elif index < 0:
+            return values[0]
+        elif index >= self._length - 1:
+            return values[-1]
+        if not self.interpolate:
+            return values[index]
+        value = values[index]
+        return value + (position - math.floor(position)) * (values[index + 1 - self._length] - value)
+
+
+class Animation:
+    """A compiled curve placed on a channel, with its offset, blend weight and time origin"""
+    def __init__(self, name, channel, curve: AnimationCurve, offset=0.0, weight=1.0, additive=False,
+                 origin="clock", enabled=True):
+        self.name = name
+        self.channel = channel
+        self.curve = curve
+        self.offset = offset
+        self.weight = weight
+        self.additive = additive
+        self.origin = origin
+        self.enabled = enabled
+
+    @classmethod
+    def from_data(cls, name, data):
+        if "waveform" in data:
+            curve = AnimationCurve.from_waveform(data["waveform"], data["period"], data.get("amplitude", 1.0),
+                                                 data.get("phase", 0.0))
+        else:
+            curve = AnimationCurve.from_keyframes(data["keyframes"], data.get("interpolation", "linear"),
+                                                  data.get("loop", False))
+        return cls(name, data["channel"], curve, offset=data.get("offset", 0.0), weight=data.get("weight", 1.0),
+                   additive=data.get("additive", False), origin=data.get("origin", "clock"),
+                   enabled=data.get("enabled", True))
+
+
+class Animator:
+    """Evaluates the animations on each channel at a point in time, blending the ones that are playing"""
+    def __init__(self, animations):
+        self.animations = {animation.name: animation for animation in animations}
+        self.channels = {}
+        for animation in animations:
+            self.channels.setdefault(animation.channel, []).append(animation)
+        self.origins = {"clock": 0.0}
+        # One-shot animations that were started, by name: their start time
+        self._started = {}
+        # Each channel's value while none of its animations are playing: their blend at their start
+        self.rest_values = {}
+        for channel, channel_animations in self.channels.items():
+            blended = [animation for animation in channel_animations if not animation.additive]
+            total_weight = sum(animation.weight for animation in blended)
+            total = sum(animation.weight * (animation.offset + animation.curve(0.0)) for animation in blended)
+            added = sum(animation.weight * (animation.offset + animation.curve(0.0))
+                        for animation in channel_animations if animation.additive)
+            self.rest_values[channel] = (total / total_weight if total_weight else 0.0) + added
+
+    @classmethod
+    def from_data(cls, animations_data):
+        return cls([Animation.from_data(name, data) for name, data in animations_data.items()])
+
+    def set_origin(self, origin, t0: float):
+        """Set the time (on the caller's clock) that animations using this origin count from"""
+        self.origins[origin] = t0
+
+    def start(self, name, now: float):
+        """Play an animation once from now (for animations that are not enabled, like a blink)"""
+        self._started[name] = now
+
+    def stop(self, name):
+        self._started.pop(name, None)
+
+    def is_playing(self, name, now: float) -> bool:
+        """Whether the named animation is playing at now (False if there is no such animation)"""
+        animation = self.animations.get(name)
+        if animation is None:
+            return False
+        if name in self._started:
+            return animation.curve.loop or now - self._started[name] < animation.curve.duration
+        return animation.enabled
+
+    def _local_time(self, animation, now):
+        if animation.name in self._started:
+            return now - self._started[animation.name]
+        if animation.enabled:
+            return now - self.origins.get(animation.origin, 0.0)
+        return None
+
+    def value(self, channel, now: float):
+        """Blended value of the channel's playing animations (its rest value if none are playing; 0 if it has none)"""
+        total = 0.0
+        total_weight = 0.0
+        added = 0.0
+        playing = False
+        for animation in self.channels.get(channel, ()):
+            t = self._local_time(animation, now)
+            if t is None:
+                continue
+            playing = True
+            value = animation.offset + animation.curve(t)
+            if animation.additive:
+                added += animation.weight * value
+            else:
+                total += animation.weight * value
+                total_weight += animation.weight
+        if not playing:
+            return self.rest_values.get(channel, 0.0)
+        return (total / total_weight if total_weight else 0.0) + added
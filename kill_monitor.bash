@@ -1,27 +1,31 @@
 #!/bin/bash
 
-SCRIPT_NAME="Lunas-Code/startup_and_monitor.bash"
-GREP_COUNT=$(ps aux | grep -c $SCRIPT_NAME)
+SCRIPT_DIR="$(dirname $0)"
 
-if [ $GREP_COUNT -eq "1" ]; then
-    echo "Monitoring script was not found running"
-else
-    PIDS=$(ps aux | grep $SCRIPT_NAME | awk -v max="$GREP_COUNT" 'NR < max {print $2}')
-    for P in $PIDS; do
-        kill $P
-    done
-    echo "Killed $((GREP_COUNT - 1)) Monitoring script process(es)"
-fi
+# Stops the process in a PID file, if it is still running (and is the program the PID file is for:
+# after a reboot, the same PID may belong to something else)
+stop_pid_file() {
+    PID_FILE=$1
+    NAME=$2
+    if [ ! -f "$PID_FILE" ]; then
+        echo "$NAME was not found running"
+        return
+    fi
+    PID=$(cat "$PID_FILE")
+    if kill -0 "$PID" 2>/dev/null && tr '\0' ' ' < /proc/$PID/cmdline | grep -q "$3"; then
+        kill "$PID"
+        # Wait up to 5 seconds for it to exit
+        for i in $(seq 50); do
+            kill -0 "$PID" 2>/dev/null || break
+            sleep 0.1
+        done
+        echo "Killed $NAME (PID $PID)"
+    else
+        echo "$NAME was not found running"
+    fi
+    rm -f "$PID_FILE"
+}
 
-PYTHON_NAME="luna_control.py"
-GREP_PY_COUNT=$(ps aux | grep -c $PYTHON_NAME)
-
-if [ $GREP_PY_COUNT -eq "1" ]; then
-    echo "Python control script was not found running"
-else
-    PIDS=$(ps aux | grep $PYTHON_NAME | awk -v max="$GREP_PY_COUNT" 'NR < max {print $2}')
-    for P in $PIDS; do
-        kill $P
-    done
-    echo "Killed $((GREP_PY_COUNT - 1)) Python script process(es)"
-fi
+# The monitor script stops the python script itself when it is killed
+stop_pid_file "$SCRIPT_DIR/monitor.pid" "Monitoring script" "startup_and_monitor.bash"
+stop_pid_file "$SCRIPT_DIR/luna.pid" "Python control script" "luna_control.py"
@@ -0,0 +1,228 @@
+"""End-to-end latency instrumentation: fixed-memory streaming histograms per stage, readable while Luna is running.
+
+Stages recorded by LunaController (all in seconds):
+    audio_arrival       PortAudio ADC time to audio_stream_callback (from PortAudio's time_info)
+    audio_handoff       PortAudio callback to the audio thread (or event loop) starting on the chunk
+    mic_filter          decimating low-pass + envelope of one chunk
+    mic_map             map_values from dB to jaw angle
+    mic_to_jaw          start of audio_stream_callback to the jaw angle being set
+    mic_to_i2c          start of audio_stream_callback to the I2C write that sent the jaw position
+    stick_to_tick       joystick event receipt to the start of the next update_servos tick
+    stick_to_i2c        joystick event receipt to the I2C write that sent the result
+    remote_jitter       how much later a remote control message arrived than the fastest one lately
+    remote_to_tick      remote control message receipt to being applied (including the jitter buffer)
+    remote_to_i2c       remote control message receipt to the I2C write that sent the result
+    tick                one update_servos tick, including the I2C write
+    i2c_write           the I2C write(s) of one frame
+
+To read p50/p99 per stage from a running process (see --latency-socket in luna_control.py):
+    python latency_stats.py /tmp/luna_latency.sock
+"""
+import logging, math, os, socket, sys, threading, time
+import numpy as np
+
+
+log = logging.getLogger(__name__)
+
+
+class LatencyHistogram:
+    """HDR-style histogram: log-linear buckets with bounded relative error, over a fixed range, in fixed memory"""
+    def __init__(self, lowest=1e-6, highest=10.0, sub_buckets=16):
+        self.lowest = lowest
+        self.sub_buckets = sub_buckets
+        self.magnitudes = int(math.ceil(math.log2(highest / lowest))) + 1
+        self.counts = np.zeros(self.magnitudes * sub_buckets, dtype=np.int64)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        if value < self.lowest:
+            return 0
+        ratio = value / self.lowest
+        magnitude = min(int(math.log2(ratio)), self.magnitudes - 1)
+        sub_bucket = min(int((ratio / 2**magnitude - 1) * self.sub_buckets), self.sub_buckets - 1)
+        return magnitude * self.sub_buckets + sub_bucket
+
+    def _bucket_upper(self, index):
+        magnitude, sub_bucket = divmod(index, self.sub_buckets)
+        return self.lowest * 2**magnitude * (1 + (sub_bucket + 1) / self.sub_buckets)
+
+    def record(self, value):
+        index = self._index(value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, p):
+        """Upper edge of the bucket holding the p-th percentile (0 to 100)"""
+        with self._lock:
+            if self.total == 0:
+                return 0.0
+            rank = max(1, int(math.ceil(self.total * p / 100)))
+            index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self._bucket_upper(index), self.max)
+
+    def reset(self):
+        with self._lock:
+            self.counts.fill(0)
+            self.total = 0
+            self.sum = 0.0
+            self.max = 0.0
+
+
+class LatencyMonitor:
+    """Named latency histograms, plus 'pending' event timestamps that are closed by a later stage (e.g. the I2C write)"""
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.histograms = {}
+        self.gauges = {}
+        self._pending = {}
+        # mark() runs on the receiving threads (audio, joystick, remote) and close() on the control thread
+        self._pending_lock = threading.Lock()
+        self._server = None
+
+    def record(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        histogram.record(seconds)
+
+    def since(self, stage, start):
+        """Record the time since start (a timestamp from this monitor's clock) for stage"""
+        self.record(stage, self.clock() - start)
+
+    def mark(self, path, timestamp=None):
+        """Note that an event on path happened, unless an earlier one is still waiting to be closed"""
+        if timestamp is None:
+            timestamp = self.clock()
+        with self._pending_lock:
+            if path not in self._pending:
+                self._pending[path] = timestamp
+
+    def pending(self, path):
+        with self._pending_lock:
+            return self._pending.get(path)
+
+    def close(self, path, stage, now=None):
+        """Record the time from the pending event on path to now, as stage"""
+        with self._pending_lock:
+            start = self._pending.pop(path, None)
+        if start is not None:
+            self.record(stage, (self.clock() if now is None else now) - start)
+
+    def discard(self, path):
+        with self._pending_lock:
+            self._pending.pop(path, None)
+
+    def add_gauges(self, name, stats_function):
+        """Also export the counters that stats_function() returns ({stat: number}), as luna_<name>{stat="..."}"""
+        self.gauges[name] = stats_function
+
+    def snapshot(self):
+        """{stage: {"count", "p50", "p90", "p99", "max", "mean"}} in seconds"""
+        snapshot = {}
+        for stage, histogram in list(self.histograms.items()):
+            stats = {"count": histogram.total, "max": histogram.max,
+                     "mean": histogram.sum / histogram.total if histogram.total else 0.0}
+            for q in self.QUANTILES:
+                stats[f"p{int(q * 100)}"] = histogram.percentile(q * 100)
+            snapshot[stage] = stats
+        return snapshot
+
+    def prometheus_text(self):
+        lines = ["# HELP luna_latency_seconds Latency per stage of Luna's control paths",
+                 "# TYPE luna_latency_seconds summary"]
+        for stage, histogram in sorted(self.histograms.items()):
+            for q in self.QUANTILES:
+                lines.append(f'luna_latency_seconds{{stage="{stage}",quantile="{q}"}} {histogram.percentile(q * 100):.9f}')
+            lines.append(f'luna_latency_seconds_sum{{stage="{stage}"}} {histogram.sum:.9f}')
+            lines.append(f'luna_latency_seconds_count{{stage="{stage}"}} {histogram.total}')
+        for name, stats_function in sorted(self.gauges.items()):
+            lines.append(f"# TYPE luna_{name} gauge")
+            for stat, value in stats_function().items():
+                lines.append(f'luna_{name}{{stat="{stat}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, filepath):
+        """Write the Prometheus text format to filepath (atomically, so scrapers never see half a file)"""
+        temp_filepath = filepath + ".tmp"
+        with open(temp_filepath, 'w') as prometheus_file:
+            prometheus_file.write(self.prometheus_text())
+        os.replace(temp_filepath, filepath)
+
+    def start_exporter(self, socket_path=None, prometheus_filepath=None, interval=10.0):
+        """Serve the stats on a Unix socket (sent to every client that connects), and/or rewrite a
+        Prometheus text file every interval seconds. Runs in a daemon thread."""
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(socket_path)
+            self._server.listen(4)
+            self._server.settimeout(interval if prometheus_filepath else None)
+        threading.Thread(target=self._export, args=(prometheus_filepath, interval), daemon=True).start()
+
+    def _export(self, prometheus_filepath, interval):
+        next_write = time.monotonic()
+        while True:
+            if prometheus_filepath and time.monotonic() >= next_write:
+                try:
+                    self.write_prometheus(prometheus_filepath)
+                except OSError as err:
+                    log.error(f"Could not write latency stats: {err}")
+                next_write = time.monotonic() + interval
+            if self._server is None:
+                time.sleep(interval)
+                continue
+            try:
+                connection, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            with connection:
+                try:
+                    connection.sendall(self.prometheus_text().encode())
+                except OSError:
+                    pass
+
+
+def format_report(prometheus_text):
+    """Turn the exporter's Prometheus text into a table of p50/p90/p99 in milliseconds"""
+    stats = {}
+    gauges = []
+    for line in prometheus_text.splitlines():
+        if line.startswith("luna_latency_seconds{"):
+            labels, value = line[len("luna_latency_seconds{"):].split("} ")
+            labels = dict(label.split("=") for label in labels.split(","))
+            stats.setdefault(labels["stage"].strip('"'), {})[labels["quantile"].strip('"')] = float(value)
+        elif line.startswith("luna_latency_seconds_count{"):
+            labels, value = line[len("luna_latency_seconds_count{"):].split("} ")
+            stats.setdefault(labels.split("=")[1].strip('"'), {})["count"] = int(value)
+        elif line.startswith("luna_") and 'stat="' in line:
+            name, rest = line.split('{stat="', 1)
+            stat, value = rest.split('"} ')
+            gauges.append(f"{name[len('luna_'):]}.{stat}: {value}")
+    rows = [f"{'stage':<16}{'count':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"]
+    for stage, values in sorted(stats.items()):
+        rows.append(f"{stage:<16}{values.get('count', 0):>10}" +
+                    "".join(f"{1000 * values.get(q, 0):>10.3f}" for q in ("0.5", "0.9", "0.99")))
+    if gauges:
+        rows.append("")
+        rows.extend(gauges)
+    return "\n".join(rows)
+
+
+if __name__ == "__main__":
+    socket_path = sys.argv[1] if len(sys.argv) > 1 else "/tmp/luna_latency.sock"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        data = b""
+        while chunk := client.recv(65536):
+            data += chunk
+    print(format_report(data.decode()))
@@ -0,0 +1,129 @@
+"""Compact binary lip-sync tracks, memory-mapped so load time and memory don't grow with track length.
+
+File layout (little-endian):
+    header:     8 bytes magic b"LUNATRK1", uint64 keyframe count
+    timestamps: count x float64, seconds from the start of the presentation
+    values:     count x int16, jaw value in "controller input" units (-32767 closed to 32767 open)
+
+The .bin file lives next to the .json track it was converted from, and is rebuilt automatically
+whenever the .json is newer.
+"""
+import json, logging, os, struct
+import numpy as np
+
+
+log = logging.getLogger(__name__)
+
+TRACK_MAGIC = b"LUNATRK1"
+HEADER_FORMAT = "<8sQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+def binary_track_path(json_filepath):
+    return os.path.splitext(json_filepath)[0] + ".bin"
+
+
+def write_binary_track(keyframes, filepath):
+    """Write [[t, value], ...] keyframes to a binary track file (atomically, via a temp file)"""
+    keyframes = np.asarray(keyframes, dtype=np.float64).reshape(-1, 2)
+    timestamps = np.ascontiguousarray(keyframes[:, 0], dtype='<f8')
+    values = np.ascontiguousarray(np.clip(np.rint(keyframes[:, 1]), -32767, 32767), dtype='<i2')
+    temp_filepath = filepath + ".tmp"
+    with open(temp_filepath, 'wb') as track_file:
+        track_file.write(struct.pack(HEADER_FORMAT, TRACK_MAGIC, len(timestamps)))
+        track_file.write(timestamps.tobytes())
+        track_file.write(values.tobytes())
+    os.replace(temp_filepath, filepath)
+
+
+class LipSyncTrack:
+    """A time-coded jaw track with O(log n) seeking.
+
+    Playback should call seek(t, hint) every tick with the previous index as the hint: moving forward a
+    few keyframes is checked directly, and anything else (start, resume, re-sync) falls back to a binary search.
+    """
+    def __init__(self, timestamps, values):
+        self.timestamps = timestamps
+        self.values = values
+        self._slew_limited = {}  # max_rate -> shaped copy
+
+    @classmethod
+    def from_keyframes(cls, keyframes):
+        keyframes = np.asarray(keyframes, dtype=np.float64).reshape(-1, 2)
+        return cls(keyframes[:, 0].copy(), np.rint(keyframes[:, 1]).astype(np.int16))
+
+    @classmethod
+    def from_binary(cls, filepath):
+        with open(filepath, 'rb') as track_file:
+            magic, count = struct.unpack(HEADER_FORMAT, track_file.read(HEADER_SIZE))
+        if magic != TRACK_MAGIC:
+            raise ValueError(f"{filepath} is not a lip sync track file")
+        timestamps = np.memmap(filepath, dtype='<f8', mode='r', offset=HEADER_SIZE, shape=(count,))
+        values = np.memmap(filepath, dtype='<i2', mode='r', offset=HEADER_SIZE + 8 * count, shape=(count,))
+        return cls(timestamps, values)
+
+    @classmethod
+    def load(cls, json_filepath):
+        """Load the binary track next to json_filepath, converting the JSON first if the binary is missing or stale.
+        Raises FileNotFoundError if neither exists."""
+        bin_filepath = binary_track_path(json_filepath)
+        json_exists = os.path.exists(json_filepath)
+        if json_exists and (not os.path.exists(bin_filepath) or os.path.getmtime(bin_filepath) < os.path.getmtime(json_filepath)):
+            with open(json_filepath) as json_file:
+                keyframes = json.load(json_file)
+            try:
+                write_binary_track(keyframes, bin_filepath)
+            except OSError as err:
+                log.warning(f"Could not write binary lip sync track, using JSON directly: {err}")
+                return cls.from_keyframes(keyframes)
+        elif not json_exists and not os.path.exists(bin_filepath):
+            raise FileNotFoundError(f"No lip sync track at {json_filepath} or {bin_filepath}")
+        return cls.from_binary(bin_filepath)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def duration(self) -> float:
+        return float(self.timestamps[-1])
+
+    def seek(self, t: float, hint: int = None) -> int:
+        """Return the index of the keyframe active at time t (the last one with timestamp <= t)"""
+        if hint is not None and 0 <= hint < len(self.timestamps) and self.timestamps[hint] <= t:
+            # Fast path for regular playback: only a few keyframes pass between ticks
+            for i in range(hint, min(hint + 4, len(self.timestamps) - 1)):
+                if self.timestamps[i + 1] > t:
+                    return i
+        return max(0, int(np.searchsorted(self.timestamps, t, side='right')) - 1)
+
+    def value_at(self, t: float, hint: int = None) -> int:
+        return int(self.values[self.seek(t, hint)])
+
+    def slew_limited(self, max_rate: float) -> "LipSyncTrack":
+        """A copy of the track shaped for a jaw that moves at most max_rate (units per second).
+
+        Each keyframe is moved earlier by half the time the jaw needs to travel to it from the previous value,
+        so large openings start early and are half way open on the beat, instead of starting on it and
+        arriving late. When the jaw couldn't make the move in the time since the previous keyframe, the
+        previous value is pulled toward this one too. Works backwards from the end,
+        so a big move can start several keyframes ahead.
+
+        This is a loop over every keyframe, so it is worked out ahead of playback (see ShowLibrary.prefetch()),
+        and kept: the same max_rate returns the same copy.
+        """
+        shaped = self._slew_limited.get(max_rate)
+        if shaped is None:
+            shaped = self._slew_limited[max_rate] = self._shape(max_rate)
+        return shaped
+
+    def _shape(self, max_rate):
+        timestamps = self.timestamps.tolist()
+        values = [float(value) for value in self.values]
+        shaped_timestamps = list(timestamps)
+        for i in range(len(values) - 2, -1, -1):
+            interval = timestamps[i + 1] - timestamps[i]
+            reach = max_rate * interval
+            values[i] = min(max(values[i], values[i + 1] - reach), values[i + 1] + reach)
+            # Centre the move on the keyframe: the jaw is half way there at the keyframe's time
+            shaped_timestamps[i + 1] = max(timestamps[i], timestamps[i + 1] - abs(values[i + 1] - values[i]) / (2 * max_rate))
+        return LipSyncTrack(np.array(shaped_timestamps), np.rint(values).astype(np.int16))
@@ -1,10 +1,28 @@
-import board, json, os, pyaudio, time, threading
+import argparse, logging, os, random, time, threading
 import numpy as np
-from adafruit_motor import servo
-from adafruit_pca9685 import PCA9685
-from scipy import signal
+from audio_envelope import FilterCache, MultirateEnvelope
+from audio_ring import AudioRingBuffer
+from calibration_store import CalibrationStore
+from servo_output import DEFAULT_BUS, MultiBoardFrameWriter, board_layout, output_indices, servo_board
+from servo_mapping import CompiledServoMap
+from motion_filter import MotionFilterBank, validate_filter
+from idle_animation import Animator
+from actuator_arbiter import ActuatorArbiter, PRIORITY_REST, PRIORITY_IDLE, PRIORITY_MIC, PRIORITY_CONTROLLER, PRIORITY_LIP_SYNC
+from frame_scheduler import FrameScheduler
+from luna_utils import map_values, constrain, smoothing_time_constant
+from session_recorder import SessionRecorder
+from show_library import ShowLibrary
+from remote_control import RemoteControl, validate_remote_settings
+from timecode_sync import LtcDecoder, MidiTimecodeInput, TimecodeFollower
+from latency_stats import LatencyMonitor
+from startup_timer import StartupTimer
+from luna_log import StatusLine, fields, setup_logging
+from control_watchdog import ControlWatchdog, WATCHDOG_EXIT_CODE
+from hardware import PA_CONTINUE, I2CServoBoards, JoystickInput, NullMicrophone, PyAudioMicrophone, ScriptedJoystick, SimulatedClock, SimulatedServoBoards, WavFileMicrophone
 from pyPS4Controller.controller import Controller
-from random import randint
+
+
+log = logging.getLogger("luna_control")  # (not __name__, which is "__main__" when run as a script)
 
 
 AUDIO_INPUT_SETTINGS = {
@@ -13,15 +31,107 @@ AUDIO_INPUT_SETTINGS = {
     "chunk": 512,
     "mic_name": "H17H_USB_AUDIO",
     "mic_threshold_low": -38,  # dba
-    "mic_threshold_hi": -21  # dba
+    "mic_threshold_hi": -21,  # dba
+    "decimated_rate": 11025,  # Hz, the rate the loudness is measured at
+    "envelope": "rms",  # "rms" or "peak"
+    "attack_seconds": 0.005,
+    "release_seconds": 0.05,
+    "envelope_blocks_per_chunk": 4,
+    "bands_hz": []  # e.g. [[80, 300], [300, 1000], [1000, 2500], [2500, 5000]] for audio_envelope.band_levels
+}
+
+# Servo PWM frequency, in Hz. The servos only see a new position once per PWM period.
+PWM_FREQUENCY = 60
+
+# Idle animations, as data (see idle_animation.py). Values are in "controller input" units.
+IDLE_ANIMATIONS = {
+    "blink": {
+        "channel": "eyelids",
+        "keyframes": [[0, -32767], [0.05, 0], [0.1, 32767], [0.15, 32767], [0.2, 0], [0.25, -32767]],
+        "interpolation": "step",
+        "enabled": False  # one-shot, started by initiate_blink()
+    },
+    "breath_neck": {
+        "channel": "neck_vertical",
+        "waveform": "sine",
+        "period": 6.5,
+        "amplitude": (35.0 / 128) * 32767,
+        "origin": "breath"  # the moment the breathing idle mode began
+    },
+    "breath_jaw": {
+        "channel": "jaw",
+        "waveform": "sine",
+        "period": 6.5,
+        "amplitude": -(35.0 / 128) * 32767,
+        "offset": -32767 + (40.0 / 128) * 32767,
+        "origin": "breath"
+    },
+    "tail": {
+        "channel": "tail",
+        "waveform": "sine",
+        "period": 5.0,
+        "amplitude": 32767
+    }
 }
-AUDIO_FORMAT = pyaudio.paInt16
 
+# The idle animations (by name) and channels animate_servos() uses
+IDLE_ANIMATION_NAMES = ["blink"]
+IDLE_ANIMATION_CHANNELS = ["eyelids", "neck_vertical", "jaw", "tail"]
+
+# audio_input_settings that can't change without reopening the audio stream (so they are not hot-reloaded)
+AUDIO_STREAM_SETTINGS = ["channels", "rate", "chunk", "mic_name"]
 
-# Controller Input Smoothing
+# Servos driven by more than one source, through the ActuatorArbiter (lip sync > remote > controller > mic > idle)
+ARBITRATED_SERVOS = ["jaw", "right_eyelid", "left_eyelid"]
+
+# Remote control over UDP (see remote_control.py; the port is set with --remote-port). It listens on bind_address
+# ("0.0.0.0": every network interface) and accepts datagrams from the IP addresses in allowed_senders ("*": any).
+# "priorities" are ActuatorArbiter levels, by sender IP address ("*": any other sender).
+REMOTE_CONTROL = {
+    "jitter_buffer_seconds": 0.02,
+    "hold_seconds": 0.5,
+    "priorities": {"*": "remote"},
+    "bind_address": "127.0.0.1",
+    "allowed_senders": ["127.0.0.1"]
+}
+
+# External timecode for show playback (see timecode_sync.py): None (shows start with Triangle), "udp" (from the
+# remote control port), "mtc" (MIDI Time Code from midi_port; None: the first MIDI input) or "ltc" (linear
+# timecode on audio input channel ltc_channel). Shows start, seek and stop with the timecode, offset_seconds
+# into the selected show being timecode 00:00:00:00.
+TIMECODE = {
+    "source": None,
+    "offset_seconds": 0.0,
+    "fps": 30,
+    "drop_frame": False,
+    "midi_port": None,
+    "ltc_channel": 1
+}
+TIMECODE_SOURCES = [None, "udp", "mtc", "ltc"]
+# timecode settings that can't change without reopening the timecode input (so they are not hot-reloaded)
+TIMECODE_INPUT_SETTINGS = ["source", "fps", "drop_frame", "midi_port", "ltc_channel"]
+
+
+# Controller Input Smoothing, as exponential smoothing time constants in seconds (independent of the update rate).
+# Only read from older calibration files, for the eye and neck motion filters.
 SMOOTHING_SETTINGS = {
-    "smoothing_ratio_eye": 0.8,
-    "smoothing_ratio_neck": 0.95
+    "smoothing_time_constant_eye": 0.022,
+    "smoothing_time_constant_neck": 0.097
+}
+
+# Motion filter per servo (see motion_filter.py): smoothed eyes and neck, springy jaw, eyelids and tail. Deadbands
+# (degrees) keep stick, trigger and mic noise from moving a servo that should be holding still.
+MOTION_FILTERS = {
+    "left_eye_horizontal": {"type": "ema", "time_constant": 0.022, "deadband": 0.5},
+    "left_eye_vertical": {"type": "ema", "time_constant": 0.022, "deadband": 0.5},
+    "right_eye_horizontal": {"type": "ema", "time_constant": 0.022, "deadband": 0.5},
+    "right_eye_vertical": {"type": "ema", "time_constant": 0.022, "deadband": 0.5},
+    "left_eyelid": {"type": "spring", "time_constant": 0.008, "max_speed": 900, "deadband": 1.0},
+    "right_eyelid": {"type": "spring", "time_constant": 0.008, "max_speed": 900, "deadband": 1.0},
+    "jaw": {"type": "spring", "time_constant": 0.01, "max_speed": 600, "deadband": 0.75},
+    "neck_horizontal": {"type": "ema", "time_constant": 0.097, "deadband": 0.75},
+    "neck_vertical": {"type": "ema", "time_constant": 0.097, "deadband": 0.75},
+    "tail": {"type": "spring", "time_constant": 0.05}
 }
 
 SERVO_MAPPING = {
@@ -58,7 +168,8 @@ SERVO_MAPPING = {
     "jaw": {
         "channel": 6,
         "min_angle": 80,
-        "max_angle": 55
+        "max_angle": 55,
+        "latency_seconds": 0.0  # command-to-motion latency, compensated in lip sync playback (see servo_latency.py)
         },
     "neck_horizontal": {
         "channel": 7,
@@ -80,84 +191,93 @@ SERVO_MAPPING = {
 
 
 class LunaController(Controller):
-    def __init__(self, pca_interface, **kwargs):
+    def __init__(self, servo_boards, microphone=None, update_rate_hz=PWM_FREQUENCY, clock=time.monotonic, sleep=time.sleep,
+                 start_update_thread=True, **kwargs):
+        """servo_boards: servo_boards(bus, address) returns the adafruit_pca9685.PCA9685 of each board in servo_mapping
+            (hardware.I2CServoBoards or SimulatedServoBoards); or a PCA9685, if all servos are on that one board
+        microphone: audio input backend (see hardware.py); defaults to the USB mic named in calibration.json
+        clock, sleep: time source for all animation timing (e.g. hardware.SimulatedClock, to run faster than real time)
+        start_update_thread: if False, the caller drives update_servos_tick() and process_pending_audio() itself
+        """
         super().__init__(**kwargs)
+        self.clock = clock
+        # Time from process start to servos and audio being live (see startup_timer.py)
+        self.startup = StartupTimer()
+        self.startup.mark("imports")
+        # Per-stage latency histograms for the mic-to-jaw and stick-to-servo paths (see latency_stats.py)
+        self.latency = LatencyMonitor()
+        self.latency.add_gauges("startup", self.startup.stats)
+        # Servos with more than one source (jaw, eyelids) are only written by the update thread, from posted intents
+        self.actuators = ActuatorArbiter(ARBITRATED_SERVOS)
+        # Servo targets and controller input from the network, applied at the start of each frame
+        self.remote = RemoteControl(self)
+        self.latency.add_gauges("remote", self.remote.stats)
+        # Show position from an external timecode (opened once the calibration says which, below)
+        self.timecode = TimecodeFollower()
+        self.latency.add_gauges("timecode", self.timecode.stats)
         
-        # Calibration and constants
+        # Calibration and constants. Saves are written in the background, and edits to the file are picked up
+        # between frames (see calibration_store.py)
         self.calibration_filepath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "calibration.json")
+        self.calibration_store = CalibrationStore(self.calibration_filepath, validate=validate_calibration)
         self.load_calibration()
+        self.startup.mark("calibration")
         self.calibration_mode = -1
+        self.calibration_status = StatusLine(log, "Calibrating", clock=clock)
+        self.calibration_save_status = StatusLine(log, "Saving calibration position", interval=1.0, clock=clock)
+        self.calibration_speed_eyes = 200.0  # degrees per second, at full stick
+        self.calibration_speed = 100.0       # degrees per second, at full stick
 
-        self.servos = {
-            name: servo.Servo(
-                pca_interface.channels[self.servo_info[name]["channel"]],
-                actuation_range=180
-            ) for name in self.servo_info.keys()
-        }
+        # Servo angles are staged here and written to the PCA9685 boards once per update_servos tick, changed channels
+        # only (each I2C bus from its own thread, see servo_output.py)
+        self.servo_boards = servo_boards if callable(servo_boards) else single_servo_board(servo_boards)
+        self.servo_output = self.open_servo_output(self.servo_info)
+        self.servos = self.output_servos()
 
-        with SupressStdoutStderr():
-            audio = pyaudio.PyAudio()
-        
-        # Find mic input device by name
-        device_index = None
-        for i in range(audio.get_device_count()):
-            # Uncomment the line below to print out all the audio devices
-            # print(f"Audio Input {i}: {audio.get_device_info_by_index(i)['name']}")
-            if self.audio_input_settings["mic_name"] in audio.get_device_info_by_index(i)["name"]:
-                device_index = i
-        # create low-pass filter; this filters out high frequences (like the letter 's'), preventing those from making the mouth open
-        self.lowpass_sos = signal.butter(6, 5000, 'lp', fs=self.audio_input_settings['rate'], output='sos')
-        if device_index is None:
-            print(f"\033[1m\033[33mWARNING: Microphone named '{self.audio_input_settings['mic_name']}' not found. Make sure it is plugged in!\033[0m")
-        else:
-            # Print Mic Input Info
-            print(f"{audio.get_device_info_by_index(device_index)['name']}")
-            # Initialize Mic Input Stream
-            self.stream = audio.open(format=AUDIO_FORMAT,
-                                     channels=self.audio_input_settings["channels"],
-                                     rate=self.audio_input_settings["rate"],
-                                     input=True,
-                                     output=False,
-                                     input_device_index=device_index,
-                                     stream_callback=self.audio_stream_callback,
-                                     frames_per_buffer=self.audio_input_settings["chunk"])
+        # Mic loudness (built by start_audio); its filter design is cached next to calibration.json
+        self.audio_envelope = None
+        self.filter_cache = FilterCache(os.path.join(os.path.dirname(self.calibration_filepath), "filter_cache.json"))
+        # The audio callback only copies chunks in here; the audio thread does the DSP and jaw updates
+        self.audio_ring = AudioRingBuffer(self.audio_input_settings["chunk"] * self.audio_input_settings["channels"])
+        self.latency.add_gauges("audio_ring", self.audio_ring.stats)
+        self.microphone = PyAudioMicrophone(self.audio_input_settings) if microphone is None else microphone
+        self.ltc_decoder = None
+        self.midi_timecode = None
+        self.open_timecode_input()
                                  
         # Idle Behavior State
         self.idle_timeout_seconds = 5
         self.idle_mode: int = 0  # different modes are represented bitwise
-        self.idle_blink_countdown_zero: float = time.monotonic() - self.idle_timeout_seconds
-        self.blink_zero_timestamp: float = time.monotonic()
+        self.idle_blink_countdown_zero: float = self.clock() - self.idle_timeout_seconds
         self.is_blinking: bool = False
-        self.idle_breath_countdown_zero: float = time.monotonic() - self.idle_timeout_seconds
-        self.breath_period_seconds = 6.5
-        self.breath_neck_half_amplitude = (35.0 / 128) * 32767        # in "controller input" units
-        self.breath_jaw_half_amplitude = (35.0 / 128) * 32767         # in "controller input" units
-        self.breath_jaw_center_value = -32767 + (40.0 / 128) * 32767  # in "controller input" units
-        self.tail_half_amplitude = self.servo_info["tail"]["angle_span"] / 2  # degrees
-        self.tail_period_seconds = 5.0
-        
-        # Luna's Story Lip Sync Playback
-        self.lip_sync_active = False
-        self.lip_sync_zero_timestamp: float = time.monotonic()
-        self.lip_sync_index = 0
-        jaw_values_file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "lunas_story_jaw_values.json")
-        try:
-            with open(jaw_values_file_path) as jaw_values_f:
-                self.lip_sync_jaw_values = json.load(jaw_values_f)
-        except FileNotFoundError as err:
-            print("Lip Sync Data not Found!")
-            print(err)
-            self.lip_sync_jaw_values = [[0, -32767], [1, -32767]]
+        self.blink_rate_per_second = 1.0  # average rate of idle blinks
+        self.idle_breath_countdown_zero: float = self.clock() - self.idle_timeout_seconds
+        
+        # Show Playback (pre-recorded tracks for any servos; Luna's Story is the jaw-only show "lunas_story")
+        self.show_active = False
+        self.show = None
+        self.show_zero_timestamp: float = self.clock()
+        self.show_tracks = {}  # servo name -> playback track (shaped for the servo's speed)
+        self.show_indices = {}
+        self.show_lookaheads = {}
+        self.show_following_timecode = False  # started by the timecode (and stopped when it stops)
+        self.timecode_show_done = False  # played (or stopped) since the timecode last started or jumped
+        self.timecode_seeks = 0
+        script_dir = os.path.dirname(os.path.realpath(__file__))
+        self.shows = ShowLibrary(os.path.join(script_dir, "shows"),
+                                 {"lunas_story": os.path.join(script_dir, "lunas_story_jaw_values.json")})
+        self.shows.max_rates = self.show_max_rates()
+        if len(self.shows):
+            # Open (compiling if needed) the first show in the background, so Triangle starts it right away
+            self.shows.prefetch(self.shows.selected_name)
+        else:
+            log.warning("No shows found (lunas_story_jaw_values.json or shows/)")
         
         # Controller Input State
         self.right_stick_x = 0
         self.right_stick_y = 0
         self.left_stick_x = 0
         self.left_stick_y = 0
-        self.right_stick_x_prev = 0
-        self.right_stick_y_prev = 0
-        self.left_stick_x_prev = 0
-        self.left_stick_y_prev = 0
         self.right_arrow_is_pressed = False
         self.left_arrow_is_pressed = False
         self.up_arrow_is_pressed = False
@@ -169,33 +289,209 @@ class LunaController(Controller):
         self.options_is_pressed = False
         self.playstation_button_is_pressed = False
         self.raised_eyelids = False
-        self.jaw_controller_priority = False
         
-        # Initiate animation
+        # Initiate animation, running update_servos on fixed deadlines (by default, once per PWM period)
+        self.update_scheduler = FrameScheduler(update_rate_hz, clock=clock, sleep=sleep)
         self.initialize_servo_positions()
-        self.update_thread = threading.Thread(target=self.update_servos)
+        # End of the latest update tick (latency clock), watched by control_watchdog.py
+        self.heartbeat = self.latency.clock()
+        self.update_generation = 0
+        self.update_thread_running = start_update_thread
+        self.update_thread = threading.Thread(target=self.update_servos, args=(self.update_generation,))
         self.update_thread.daemon = True
-        self.update_thread.start()
+        self.audio_thread = threading.Thread(target=self.process_audio)
+        self.audio_thread.daemon = True
+        if start_update_thread:
+            self.update_thread.start()
+            self.audio_thread.start()
+            self.calibration_store.start()
+            # Servos are already moving; finding and opening the mic (which takes seconds) happens in the background
+            threading.Thread(target=self.start_audio, daemon=True).start()
+        else:
+            self.start_audio()
+
+    def start_audio(self, callback=None):
+        """Set up mic loudness measurement and start mic input (into callback, audio_stream_callback by default)"""
+        self.build_audio_envelope()
+        # Mic input starts last, once everything the audio callback uses exists
+        if self.microphone.start(self.audio_stream_callback if callback is None else callback):
+            self.startup.mark("mic_started")
+        elif not isinstance(self.microphone, NullMicrophone):
+            self.startup.mark("audio_unavailable")
+            self.report_startup()
+
+    def build_audio_envelope(self):
+        """Mic loudness: decimate to ~11 kHz through a ~4 kHz low-pass (which filters out high frequences, like the letter 's',
+        preventing those from making the mouth open), then an RMS or peak envelope with attack/release smoothing"""
+        self.audio_envelope = MultirateEnvelope.from_settings(self.audio_input_settings, self.filter_cache)
+        self.filter_cache.save()
+
+    def open_timecode_input(self):
+        """Start feeding the timecode source from the calibration (if any) to the timecode follower"""
+        settings = self.timecode_settings
+        if settings["source"] == "udp":
+            self.remote.timecode = self.timecode
+        elif settings["source"] == "mtc":
+            self.midi_timecode = MidiTimecodeInput(self.timecode, settings["midi_port"], clock=self.clock)
+            try:
+                self.midi_timecode.start()
+            except OSError as err:
+                log.error(f"Could not open the MIDI timecode input: {err}")
+                self.midi_timecode = None
+        elif settings["source"] == "ltc":
+            # Decoded on the audio thread, from its channel of the mic input
+            self.ltc_decoder = LtcDecoder(self.timecode, self.audio_input_settings["rate"], settings["fps"],
+                                          settings["drop_frame"])
+
+    def report_startup(self):
+        """Log the startup times (once), when the servos and audio are both live (or audio could not start)"""
+        milestones = self.startup.milestones
+        audio_done = "audio_live" in milestones or "audio_unavailable" in milestones or \
+            isinstance(self.microphone, NullMicrophone)
+        if self.startup.reported or "first_servo_write" not in milestones or not audio_done:
+            return
+        self.startup.reported = True
+        log.info(self.startup.report())
         
     def load_calibration(self):
-        try:
-            with open(self.calibration_filepath, 'r') as calibration_file:
-                calibration_data = json.load(calibration_file)
-        except FileNotFoundError:
-            print("Using default calibration values")
-            calibration_data = {}
-        self.servo_info = calibration_data.get("servo_mapping", SERVO_MAPPING)
+        self.apply_calibration(self.calibration_store.load())
+
+    def apply_calibration(self, calibration_data):
+        """Take the settings from calibration data (as in calibration.json), defaults for any that are missing.
+        Raises (KeyError, ValueError, ...) without changing anything if the servo map or animations don't compile."""
+        servo_info = calibration_data.get("servo_mapping", SERVO_MAPPING)
+        idle_animation_settings = calibration_data.get("idle_animations", IDLE_ANIMATIONS)
+        servo_map = CompiledServoMap(servo_info)
+        idle_animations = Animator.from_data(idle_animation_settings)
+
+        self.servo_info = servo_info
         self.audio_input_settings = calibration_data.get("audio_input_settings", AUDIO_INPUT_SETTINGS)
-        self.smoothing_settings = calibration_data.get("smoothing_settings", SMOOTHING_SETTINGS)
+        self.idle_animation_settings = idle_animation_settings
+        self.idle_animations = idle_animations
+        self.motion_filter_settings = calibration_data.get("motion_filters")
+        if self.motion_filter_settings is None:
+            # Older calibration files only have smoothing_settings, for the eyes and neck
+            self.motion_filter_settings = legacy_motion_filters(calibration_data.get("smoothing_settings", {}))
+        self.remote_control_settings = {**REMOTE_CONTROL, **calibration_data.get("remote_control", {})}
+        self.remote.configure(self.remote_control_settings)
+        self.timecode_settings = {**TIMECODE, **calibration_data.get("timecode", {})}
+        self.compile_servo_map(servo_map)
+
+    def reload_calibration(self, calibration_data):
+        """Hot-swap settings from an edited calibration.json, between two frames (on the update thread)"""
+        audio_input_settings = calibration_data.get("audio_input_settings")
+        if audio_input_settings is not None:
+            for key in AUDIO_STREAM_SETTINGS:
+                if audio_input_settings.get(key) != self.audio_input_settings.get(key):
+                    log.warning(f"audio_input_settings '{key}' changes on the next restart")
+                    audio_input_settings[key] = self.audio_input_settings[key]
+        timecode_settings = calibration_data.get("timecode")
+        if timecode_settings is not None:
+            for key in TIMECODE_INPUT_SETTINGS:
+                if timecode_settings.get(key, TIMECODE[key]) != self.timecode_settings[key]:
+                    log.warning(f"timecode '{key}' changes on the next restart")
+                    timecode_settings[key] = self.timecode_settings[key]
+        previous_audio_input_settings = self.audio_input_settings
+        servo_info = calibration_data.get("servo_mapping", SERVO_MAPPING)
+        servo_output = None
+        if board_layout(servo_info) != self.servo_output.boards:
+            # Open any new boards before changing anything, so a board that isn't there leaves everything as it was
+            try:
+                servo_output = self.open_servo_output(servo_info)
+            except (OSError, ValueError) as err:
+                log.error(f"Calibration not reloaded, could not open the servo boards: {err}")
+                return
+        indices = output_indices(self.servo_info)
+        try:
+            self.apply_calibration(calibration_data)
+        except (KeyError, ValueError, TypeError) as err:
+            # Passed validate_calibration(), but still doesn't work: keep running on the old calibration
+            log.error(f"Calibration not reloaded: {err!r}")
+            if servo_output is not None:
+                servo_output.close()
+            return
+        # The new animator has no blink in progress
+        self.is_blinking = False
+
+        if servo_output is not None:
+            self.servo_output.close()
+            self.servo_output = servo_output
+        if output_indices(self.servo_info) != indices:
+            self.servos = self.output_servos()
+            # Don't keep filtering toward targets on the old channels
+            self.motion_filters.reset(self.servo_output.angles)
+        if any(self.audio_input_settings.get(key) != previous_audio_input_settings.get(key)
+               for key in ["decimated_rate", "envelope", "attack_seconds", "release_seconds",
+                           "envelope_blocks_per_chunk", "bands_hz"]):
+            # Designed in the background (possibly importing SciPy); the audio thread picks it up at its next chunk
+            threading.Thread(target=self.build_audio_envelope, daemon=True).start()
+        if self.show_active:
+            # Keep playing from the same point, with the servos' new latencies and speeds
+            offset = self.clock() - self.show_zero_timestamp
+            self.prepare_show_playback()
+            self.seek_show(offset)
+        self.actuators.invalidate()
+        log.info("Calibration reloaded from calibration.json")
+
+    def open_servo_output(self, servo_info):
+        """A frame writer for the boards that servo_info uses (opening them if needed)"""
+        pcas = {board: self.servo_boards(*board) for board in board_layout(servo_info)}
+        return MultiBoardFrameWriter({board: pca.i2c_device for board, pca in pcas.items()},
+                                     next(iter(pcas.values())).frequency, actuation_range=180)
+
+    def output_servos(self):
+        """{servo name: FrameServo} for the current servo_info and servo_output"""
+        indices = output_indices(self.servo_info)
+        return {name: self.servo_output.channel(indices[name]) for name in self.servo_info.keys()}
+
+    def compile_servo_map(self, servo_map=None):
+        """Precompute per-servo mapping coefficients; must be called whenever servo_info changes (servo_map: one
+        already compiled from it)"""
+        if servo_map is not None:
+            self.servo_map = servo_map
+        elif hasattr(self, "servo_map"):
+            self.servo_map.compile(self.servo_info)
+        else:
+            self.servo_map = CompiledServoMap(self.servo_info)
+        if not hasattr(self, "motion_filters"):
+            self.motion_filters = MotionFilterBank()
+        self.motion_filters.compile(self.servo_info, self.motion_filter_settings)
+        # Resting positions: eyelids open, jaw closed
+        for servo_name in ARBITRATED_SERVOS:
+            self.actuators.post(servo_name, PRIORITY_REST, self.servo_info[servo_name]["min_angle"])
+        if hasattr(self, "shows"):
+            max_rates = self.show_max_rates()
+            if max_rates != self.shows.max_rates:
+                # Shape the selected show's tracks for the new speeds before it plays
+                self.shows.max_rates = max_rates
+                self.shows.prefetch(self.shows.selected_name)
+
+    def show_max_rates(self):
+        """{servo name: how fast it can follow a show track, in "controller input" units per second}, for the servos
+        with a calibrated max_speed"""
+        max_rates = {}
+        for name, info in self.servo_info.items():
+            if info.get("max_speed") and name in self.servo_map.index:
+                # degrees per second to "controller input" units per second
+                max_rates[name] = info["max_speed"] / max(abs(self.servo_map.slope[self.servo_map.index[name]]), 1e-9)
+        return max_rates
+
+    def set_calibration_value(self, servo_name, key, value):
+        """Change one servo_info value (e.g. "center_angle"), keeping the compiled servo map up to date"""
+        self.servo_info[servo_name][key] = value
+        self.compile_servo_map()
     
     def save_calibration(self):
+        """Queue the current settings to be written to calibration.json; returns without waiting for the disk"""
         calibration_data = {
             "servo_mapping": self.servo_info,
             "audio_input_settings": self.audio_input_settings,
-            "smoothing_settings": self.smoothing_settings
+            "motion_filters": self.motion_filter_settings,
+            "idle_animations": self.idle_animation_settings,
+            "remote_control": self.remote_control_settings,
+            "timecode": self.timecode_settings
         }
-        with open(self.calibration_filepath, 'w') as calibration_file:
-            json.dump(calibration_data, calibration_file, indent=2)
+        self.calibration_store.save(calibration_data)
             
     def enter_calibration_mode(self, mode: int):
         self.calibration_mode = mode
@@ -203,9 +499,13 @@ class LunaController(Controller):
     
     def exit_calibration_mode(self):
         self.calibration_mode = -1
+        self.compile_servo_map()
         self.save_calibration()
-        print("\nCalibration values saved!")
+        log.info("Calibration values saved!")
         self.set_servos_calibration_ready()
+        # Calibration moved the servos directly; have the next frames move them back from there to where they belong
+        self.motion_filters.reset(self.servo_output.angles)
+        self.actuators.invalidate()
     
     def get_idle_mode(self):
         """Each bit in the output corresponds to a different independent idle animation:
@@ -219,58 +519,167 @@ class LunaController(Controller):
         MSB 7: [unused]
         """
         output = 0
-        if time.monotonic() - self.idle_breath_countdown_zero >= self.idle_timeout_seconds:
+        if self.clock() - self.idle_breath_countdown_zero >= self.idle_timeout_seconds:
             output = output | 0b10  # Idle mode 00000010: Breathing is automated
-        if time.monotonic() - self.idle_blink_countdown_zero >= self.idle_timeout_seconds:
+        if self.clock() - self.idle_blink_countdown_zero >= self.idle_timeout_seconds:
             output = output | 1     # Idle mode 00000001: Blinking is automated
         return output
     
     def initiate_blink(self):
-        self.blink_zero_timestamp = time.monotonic()
+        self.idle_animations.start("blink", self.clock())
         self.is_blinking = True
-    
-    def get_blink_animation_value(self):
-        if not self.is_blinking:
-            return 0
-        blink_values = [[0, 0], [0.05, 0.5], [0.1, 1], [0.15, 1], [0.2, 0.5], [0.25, 0]]
-        current_time = time.monotonic() - self.blink_zero_timestamp
-        i = 0
-        while i < len(blink_values) - 1 and blink_values[i + 1][0] <= current_time:
-            i += 1
-        if i == len(blink_values) - 1:
-            self.is_blinking = False
-        return blink_values[i][1]
-        
-    def start_lip_sync(self):
-        self.lip_sync_index = 0
-        self.lip_sync_active = True
-        self.lip_sync_zero_timestamp = time.monotonic()
-        print("Lip Sync Started")
-        
-    def stop_lip_sync(self):
-        self.lip_sync_active = False
+        
+    def start_show(self, offset: float = 0.0):
+        """Start (or resume) playback of the selected show, offset seconds into the presentation"""
+        show = self.shows.get()
+        if show is None:
+            return
+        self.show = show
+        self.prepare_show_playback()
+        self.seek_show(offset)
+        self.show_active = True
+        log.info("Show Started", extra=fields(show=show.name, offset=offset))
+
+    def seek_show(self, offset: float):
+        """Re-sync show playback so that the presentation is currently offset seconds in"""
+        self.show_zero_timestamp = self.clock() - offset
+        self.show_indices = {name: track.seek(offset + self.show_lookaheads[name])
+                             for name, track in self.show_tracks.items()}
+
+    def prepare_show_playback(self):
+        """Apply each servo's calibrated latency and speed to its track: the track is played latency_seconds
+        ahead of the presentation, and shaped so that the servo can keep up with it"""
+        self.show_tracks = {}
+        self.show_lookaheads = {}
+        for name, track in self.show.tracks.items():
+            if name not in self.servo_info:
+                log.warning(f"Show '{self.show.name}' has a track for unknown servo '{name}'")
+                continue
+            info = self.servo_info[name]
+            self.show_lookaheads[name] = info.get("latency_seconds", 0.0)
+            max_rate = self.shows.max_rates.get(name)
+            if max_rate:
+                # Already shaped by ShowLibrary.prefetch(), unless the show was opened just now
+                track = track.slew_limited(max_rate)
+            self.show_tracks[name] = track
+
+    def stop_show(self):
+        self.show_active = False
         # Reset the idle breathing routine
-        self.idle_breath_countdown_zero = time.monotonic()
-        self.on_L2_release()
-        print("Lip Sync Stopped / Ended")
+        self.idle_breath_countdown_zero = self.clock()
+        for servo_name in ARBITRATED_SERVOS:
+            self.actuators.release(servo_name, PRIORITY_LIP_SYNC)
+        if self.show_following_timecode:
+            self.timecode_show_done = True
+            self.show_following_timecode = False
+        log.info("Show Stopped / Ended", extra=fields(show=self.show.name))
+
+    def play_show(self):
+        """Drive every servo in the show from its track (over this tick's other inputs); stops at the end"""
+        now = self.clock() - self.show_zero_timestamp
+        playing = False
+        for name, track in self.show_tracks.items():
+            # Sample each track ahead of the presentation by its servo's latency, so the motion lines up with it
+            index = self.show_indices[name] = track.seek(now + self.show_lookaheads[name], self.show_indices[name])
+            playing = playing or index < len(track) - 1
+            value = track.values[index]
+            if name == "jaw":
+                self.handle_jaw_input(value, PRIORITY_LIP_SYNC)
+            elif name in ARBITRATED_SERVOS:
+                self.actuators.post(name, PRIORITY_LIP_SYNC, self.servo_map.angle(name, value))
+            else:
+                self.servo_map.set_input(name, value)
+        if not playing:
+            self.stop_show()
+
+    def follow_timecode(self):
+        """Start, re-sync and stop the selected show with the external timecode. Every frame, the show's position
+        is set from the timecode (which only jumps when the timecode does, see TimecodeFollower)."""
+        position = self.timecode.position(self.clock())
+        if position is None:
+            if self.show_active and self.show_following_timecode:
+                # Paused, stopped or lost
+                self.stop_show()
+            return
+        offset = position - self.timecode_settings["offset_seconds"]
+        seeked = self.timecode.seeks != self.timecode_seeks
+        self.timecode_seeks = self.timecode.seeks
+        if seeked:
+            self.timecode_show_done = False
+        if not self.show_active:
+            show = None if self.timecode_show_done or offset < 0 else self.shows.get()
+            if show is not None and offset < show.duration:
+                self.start_show(offset)
+                self.show_following_timecode = True
+        elif self.show_following_timecode:
+            if seeked:
+                self.seek_show(offset)
+            else:
+                # play_show() seeks its tracks from here on
+                self.show_zero_timestamp = self.clock() - offset
+
+    def select_show(self, delta: int):
+        """Select the next (or previous) show in the library, while none is playing"""
+        if self.show_active or not len(self.shows):
+            return
+        log.info("Show selected", extra=fields(show=self.shows.step(delta), number=self.shows.selected + 1,
+                                               of=len(self.shows)))
         
     def audio_stream_callback(self, input_data, frame_count, time_info, flags):
-        if flags != 0:
-            return None, pyaudio.paContinue
-        int_data = np.array([int.from_bytes(input_data[i:i+2], byteorder='little', signed=True) for i in range(0, len(input_data), 2)], dtype=np.int16)
-        # use low-pass filter; this filters out high frequences (like the letter 's'), preventing those from making the mouth open
-        filtered_data = signal.sosfilt(self.lowpass_sos, int_data)
-        squared_values = np.array(filtered_data ** 2)
-        # Calculate RMS (Root meen squared) for 'average loudness', on 0.0 to 1.0 scale
-        rms = np.sqrt(np.mean(squared_values)) / (2**16)
-        
-        # Standard conversion equation to dba (loudness scale)
-        db = 20 * np.log10(rms) if rms != 0 else -90
-        
+        """PortAudio's real-time callback: only hands the chunk over to the audio thread"""
+        adc_latency = 0.0
+        if time_info and time_info.get("input_buffer_adc_time", 0) > 0:
+            adc_latency = time_info["current_time"] - time_info["input_buffer_adc_time"]
+        # Chunks with flags (e.g. input overflow) are still good audio; the ring buffer counts them
+        self.audio_ring.write(input_data, flags, self.latency.clock(), adc_latency)
+        return None, PA_CONTINUE
+
+    def process_audio(self):
+        """Process audio chunks as the audio callback hands them over. This function is to run in a separate thread."""
+        chunk_seconds = self.audio_input_settings["chunk"] / self.audio_input_settings["rate"]
+        while True:
+            self.audio_ring.wait(timeout=10 * chunk_seconds)
+            self.process_pending_audio()
+
+    def process_pending_audio(self):
+        """Process every chunk waiting in the audio ring buffer; returns the number processed"""
+        processed = 0
+        while (chunk := self.audio_ring.peek()) is not None:
+            samples, flags, arrival, adc_latency = chunk
+            self.latency.since("audio_handoff", arrival)
+            if adc_latency > 0:
+                self.latency.record("audio_arrival", adc_latency)
+            # Decimating low-pass filter + envelope, in dba; filter and envelope state carry over between chunks
+            dsp_start = self.latency.clock()
+            if self.ltc_decoder is not None:
+                self.decode_timecode(samples, arrival, adc_latency)
+            db = self.audio_envelope.process(samples)
+            self.audio_ring.advance()
+            self.latency.since("mic_filter", dsp_start)
+            self.handle_mic_level(db, arrival)
+            processed += 1
+        if processed and "audio_live" not in self.startup.milestones:
+            self.startup.mark("audio_live")
+            self.report_startup()
+        return processed
+
+    def decode_timecode(self, samples, arrival, adc_latency):
+        """Linear timecode from its channel of one chunk of audio input"""
+        channels = self.audio_input_settings["channels"]
+        # When the chunk's first sample was taken (on our clock): before the callback by the ADC latency, or by
+        # the chunk's length if PortAudio doesn't tell
+        if adc_latency <= 0:
+            adc_latency = len(samples) / channels / self.audio_input_settings["rate"]
+        first_sample_time = self.clock() - (self.latency.clock() - arrival) - adc_latency
+        self.ltc_decoder.process(samples[self.timecode_settings["ltc_channel"]::channels], first_sample_time)
+
+    def handle_mic_level(self, db, arrival=None):
+        """Jaw control from the loudness (in dba) of one chunk of mic input"""
         if db > self.audio_input_settings["mic_threshold_low"]:
             # Reset the countdown timer to re-initiate idle breathe mode
-            self.idle_breath_countdown_zero = time.monotonic()
+            self.idle_breath_countdown_zero = self.clock()
         
+        map_start = self.latency.clock()
         jaw_value = map_values(
             db,
             self.audio_input_settings["mic_threshold_low"],
@@ -279,10 +688,16 @@ class LunaController(Controller):
             self.servo_info["jaw"]["max_angle"],
             clamp=True
         )
-        if self.jaw_controller_priority == False and self.get_idle_mode() & 0b10 == 0 and not self.lip_sync_active:
-            self.servos["jaw"].angle = jaw_value
-
-        return None, pyaudio.paContinue
+        self.latency.since("mic_map", map_start)
+        if self.get_idle_mode() & 0b10 == 0:
+            # Lip sync playback and the controller outrank the mic; the arbiter sorts that out at the next frame
+            self.actuators.post("jaw", PRIORITY_MIC, jaw_value)
+            if arrival is not None:
+                self.latency.since("mic_to_jaw", arrival)
+                self.latency.mark("mic", arrival)
+        else:
+            # Quiet long enough for idle breathing to take over the jaw
+            self.actuators.release("jaw", PRIORITY_MIC)
 
     def initialize_servo_positions(self):
         """Set initial positions of servos (useful for joints that don't activate until there is user input)"""
@@ -302,27 +717,35 @@ class LunaController(Controller):
         return inputValue
 
     def on_R3_left(self, value):
+        self.latency.mark("stick")
         self.right_stick_x = self.deadzone(value)
     
     def on_R3_right(self, value):
+        self.latency.mark("stick")
         self.right_stick_x = self.deadzone(value)
 
     def on_R3_up(self, value):
+        self.latency.mark("stick")
         self.right_stick_y = self.deadzone(value)
     
     def on_R3_down(self, value):
+        self.latency.mark("stick")
         self.right_stick_y = self.deadzone(value)
         
     def on_L3_left(self, value):
+        self.latency.mark("stick")
         self.left_stick_x = self.deadzone(value)
     
     def on_L3_right(self, value):
+        self.latency.mark("stick")
         self.left_stick_x = self.deadzone(value)
 
     def on_L3_up(self, value):
+        self.latency.mark("stick")
         self.left_stick_y = self.deadzone(value)
     
     def on_L3_down(self, value):
+        self.latency.mark("stick")
         self.left_stick_y = self.deadzone(value)
     
     def on_R3_x_at_rest(self):
@@ -337,17 +760,20 @@ class LunaController(Controller):
     def on_L3_y_at_rest(self):
         pass
         
-    def calibrate_eyes(self):
+    def report_calibration(self, servo_names):
+        """Log the angles being calibrated (rate-limited: this runs every tick)"""
+        self.calibration_status.update(**{servo_name: round(self.servos[servo_name].angle, 1) for servo_name in servo_names})
+
+    def calibrate_eyes(self, dt):
+        step = self.calibration_speed_eyes * dt / 32767
         # Left Eye (Right Stick)
-        self.servos["left_eye_horizontal"].angle = constrain(self.servos["left_eye_horizontal"].angle + self.right_stick_x / 32767)
-        self.servos["left_eye_vertical"].angle = constrain(self.servos["left_eye_vertical"].angle + self.right_stick_y / 32767)
+        self.servos["left_eye_horizontal"].angle = constrain(self.servos["left_eye_horizontal"].angle + self.right_stick_x * step)
+        self.servos["left_eye_vertical"].angle = constrain(self.servos["left_eye_vertical"].angle + self.right_stick_y * step)
         # Right Eye (Left Stick)
-        self.servos["right_eye_horizontal"].angle = constrain(self.servos["right_eye_horizontal"].angle + self.left_stick_x / 32767)
-        self.servos["right_eye_vertical"].angle = constrain(self.servos["right_eye_vertical"].angle - self.left_stick_y / 32767)
+        self.servos["right_eye_horizontal"].angle = constrain(self.servos["right_eye_horizontal"].angle + self.left_stick_x * step)
+        self.servos["right_eye_vertical"].angle = constrain(self.servos["right_eye_vertical"].angle - self.left_stick_y * step)
         
-        for servo_name in ["left_eye_horizontal", "left_eye_vertical", "right_eye_horizontal", "right_eye_vertical"]:
-            print(f"{servo_name}: {self.servos[servo_name].angle}", end="\t")
-        print("\r", end="")
+        self.report_calibration(["left_eye_horizontal", "left_eye_vertical", "right_eye_horizontal", "right_eye_vertical"])
         
         if self.circle_is_pressed:
             # Reset positions to previously-saved center
@@ -357,32 +783,29 @@ class LunaController(Controller):
         if self.playstation_button_is_pressed:
             # Save current position
             for servo_name in ["left_eye_horizontal", "left_eye_vertical", "right_eye_horizontal", "right_eye_vertical"]:
-                self.servo_info[servo_name]["center_angle"] = self.servos[servo_name].angle
+                self.set_calibration_value(servo_name, "center_angle", self.servos[servo_name].angle)
             self.exit_calibration_mode()
         
-        time.sleep(5 / 1000.)
-        
-    def calibrate_eyelids(self):
+    def calibrate_eyelids(self, dt):
+        step = self.calibration_speed * dt / 32767
         # Left Eyelid (Right Stick)
-        self.servos["left_eyelid"].angle = constrain(self.servos["left_eyelid"].angle + self.right_stick_y / (2**16))
+        self.servos["left_eyelid"].angle = constrain(self.servos["left_eyelid"].angle + self.right_stick_y * step)
         # Right Eyelid (Left Stick)
-        self.servos["right_eyelid"].angle = constrain(self.servos["right_eyelid"].angle + self.left_stick_y / (2**16))
+        self.servos["right_eyelid"].angle = constrain(self.servos["right_eyelid"].angle + self.left_stick_y * step)
         
-        for servo_name in ["right_eyelid", "left_eyelid"]:
-            print(f"{servo_name}: {self.servos[servo_name].angle}", end="\t")
-        print("\r", end="")
+        self.report_calibration(["right_eyelid", "left_eyelid"])
                 
         if self.triangle_is_pressed:
             # Save open (minimum) position
-            print("\nSaving Open Eyelid Positions")
+            self.calibration_save_status.update(position="open eyelids")
             for servo_name in ["right_eyelid", "left_eyelid"]:
-                self.servo_info[servo_name]["min_angle"] = self.servos[servo_name].angle
+                self.set_calibration_value(servo_name, "min_angle", self.servos[servo_name].angle)
         
         if self.cross_is_pressed:
             # Save closed (maximum) position
-            print("\nSaving Closed Eyelid Positions")
+            self.calibration_save_status.update(position="closed eyelids")
             for servo_name in ["right_eyelid", "left_eyelid"]:
-                self.servo_info[servo_name]["max_angle"] = self.servos[servo_name].angle
+                self.set_calibration_value(servo_name, "max_angle", self.servos[servo_name].angle)
                 
         if self.circle_is_pressed:
             # Reset positions to previously-saved center
@@ -392,25 +815,22 @@ class LunaController(Controller):
         if self.playstation_button_is_pressed:
             # Exit Calibration, save to disk
             self.exit_calibration_mode()
-        
-        time.sleep(5 / 1000.)
     
-    def calibrate_jaw(self):
-        self.servos["jaw"].angle = constrain(self.servos["jaw"].angle - self.right_stick_y / (2**16))
+    def calibrate_jaw(self, dt):
+        step = self.calibration_speed * dt / 32767
+        self.servos["jaw"].angle = constrain(self.servos["jaw"].angle - self.right_stick_y * step)
         
-        for servo_name in ["jaw"]:
-            print(f"{servo_name}: {self.servos[servo_name].angle}", end="\t")
-        print("\r", end="")
+        self.report_calibration(["jaw"])
                 
         if self.triangle_is_pressed:
             # Save closed (minimum) position
-            print("\nSaving Closed Jaw Positions")
-            self.servo_info["jaw"]["min_angle"] = self.servos["jaw"].angle
+            self.calibration_save_status.update(position="closed jaw")
+            self.set_calibration_value("jaw", "min_angle", self.servos["jaw"].angle)
         
         if self.cross_is_pressed:
             # Save open (maximum) position
-            print("\nSaving Open Jaw Positions")
-            self.servo_info["jaw"]["max_angle"] = self.servos["jaw"].angle
+            self.calibration_save_status.update(position="open jaw")
+            self.set_calibration_value("jaw", "max_angle", self.servos["jaw"].angle)
                 
         if self.circle_is_pressed:
             # Reset position to previously-saved center
@@ -420,15 +840,12 @@ class LunaController(Controller):
             # Exit Calibration, save to disk
             self.exit_calibration_mode()
         
-        time.sleep(5 / 1000.)
-        
-    def calibrate_neck(self):
-        self.servos["neck_horizontal"].angle = constrain(self.servos["neck_horizontal"].angle - self.left_stick_x / (2**16))
-        self.servos["neck_vertical"].angle = constrain(self.servos["neck_vertical"].angle - self.left_stick_y / (2**16))
+    def calibrate_neck(self, dt):
+        step = self.calibration_speed * dt / 32767
+        self.servos["neck_horizontal"].angle = constrain(self.servos["neck_horizontal"].angle - self.left_stick_x * step)
+        self.servos["neck_vertical"].angle = constrain(self.servos["neck_vertical"].angle - self.left_stick_y * step)
         
-        for servo_name in ["neck_vertical", "neck_horizontal"]:
-            print(f"{servo_name}: {self.servos[servo_name].angle}", end="\t")
-        print("\r", end="")
+        self.report_calibration(["neck_vertical", "neck_horizontal"])
         
         if self.circle_is_pressed:
             # Reset positions to previously-saved center
@@ -438,10 +855,8 @@ class LunaController(Controller):
         if self.playstation_button_is_pressed:
             # Save current position
             for servo_name in ["neck_vertical", "neck_horizontal"]:
-                self.servo_info[servo_name]["center_angle"] = self.servos[servo_name].angle
+                self.set_calibration_value(servo_name, "center_angle", self.servos[servo_name].angle)
             self.exit_calibration_mode()
-        
-        time.sleep(5 / 1000.)
 
     def on_right_arrow_press(self):
         self.right_arrow_is_pressed = True
@@ -471,142 +886,181 @@ class LunaController(Controller):
         self.up_arrow_is_pressed = False
         self.down_arrow_is_pressed = False
 
-    def update_servos(self):
+    def update_servos(self, generation=0):
         """At a regular interval, update the positions of servos that use input smoothing, or autonomous functions.
-        This function is to run in a separate thread.
+        This function is to run in a separate thread, until a newer generation of it is started.
         """
-        while True:
-            # Handle calibration modes first
-            if self.calibration_mode == 0:
-                self.calibrate_eyes()
-                continue
-            elif self.calibration_mode == 1:
-                self.calibrate_eyelids()
-                continue
-            elif self.calibration_mode == 2:
-                self.calibrate_jaw()
-                continue
-            elif self.calibration_mode == 3:
-                self.calibrate_neck()
-                continue
-                
-            # Handle Lip Sync start/stop
-            if self.triangle_is_pressed and not self.lip_sync_active:
-                self.start_lip_sync()
-            if self.lip_sync_active and self.square_is_pressed:
-                self.stop_lip_sync()
-
-            #### EYES ####
-            _eye_x = (self.right_stick_x_prev *  self.smoothing_settings["smoothing_ratio_eye"]) + (self.right_stick_x * (1 - self.smoothing_settings["smoothing_ratio_eye"]))
-            self.right_stick_x_prev = _eye_x
-            _eye_y = (self.right_stick_y_prev * self.smoothing_settings["smoothing_ratio_eye"]) + (self.right_stick_y * (1 - self.smoothing_settings["smoothing_ratio_eye"]))
-            self.right_stick_y_prev = _eye_y
-            
-            self.servos["right_eye_horizontal"].angle = map_values(
-                _eye_x,
-                -32767,
-                32767,
-                self.servo_info["right_eye_horizontal"]["center_angle"] - self.servo_info["right_eye_horizontal"]["angle_span"] / 2,
-                self.servo_info["right_eye_horizontal"]["center_angle"] + self.servo_info["right_eye_horizontal"]["angle_span"] / 2
-            )
-            self.servos["left_eye_horizontal"].angle = map_values(
-                _eye_x,
-                -32767,
-                32767,
-                self.servo_info["left_eye_horizontal"]["center_angle"] - self.servo_info["left_eye_horizontal"]["angle_span"] / 2,
-                self.servo_info["left_eye_horizontal"]["center_angle"] + self.servo_info["left_eye_horizontal"]["angle_span"] / 2
-            )
-            self.servos["right_eye_vertical"].angle = map_values(
-                _eye_y,
-                -32767,
-                32767,
-                self.servo_info["right_eye_vertical"]["center_angle"] + self.servo_info["right_eye_vertical"]["angle_span"] / 2,
-                self.servo_info["right_eye_vertical"]["center_angle"] - self.servo_info["right_eye_vertical"]["angle_span"] / 2
-            )
-            self.servos["left_eye_vertical"].angle = map_values(
-                _eye_y,
-                -32767,
-                32767,
-                self.servo_info["left_eye_vertical"]["center_angle"] - self.servo_info["left_eye_vertical"]["angle_span"] / 2,
-                self.servo_info["left_eye_vertical"]["center_angle"] + self.servo_info["left_eye_vertical"]["angle_span"] / 2
-            )
-            # print(f"Left -- h: {self.servos['left_eye_horizontal'].angle}\tv: {self.servos['left_eye_vertical'].angle}\t\tRight -- h: {self.servos['right_eye_horizontal'].angle}\tv: {self.servos['right_eye_vertical'].angle}\r")
-
-            #### EYELIDS / AUTONOMOUS BLINKING ####
-            if self.get_idle_mode() & 1 == 1:
-                if self.is_blinking:
-                    blink_value = (self.get_blink_animation_value() * (2**16)) - 32767
-                    self.handle_blink_input(blink_value)
-                elif randint(0, 1000) < 5:
-                    self.initiate_blink()
+        while generation == self.update_generation:
+            dt = self.update_scheduler.wait()
+            self.update_servos_tick(dt, generation)
 
-            
-            #### NECK  / AUTONOMOUS BREATHING (+jaw) ####
-            if self.left_stick_x > 100 or self.left_stick_x < -100 or self.left_stick_y > 100 or self.left_stick_y < -100:
-                # Reset the countdown timer to re-initiate idle breathe mode
-                self.idle_breath_countdown_zero = time.monotonic()
-            
-            # Check for breathing idle mode
-            if self.get_idle_mode() & 0b10 == 0b10:
-                # t should be equal to zero at the moment the idle countdown is zero
-                t = time.monotonic() - self.idle_breath_countdown_zero - self.idle_timeout_seconds
-                _neck_y = self.breath_neck_half_amplitude * np.sin(t * 2 * np.pi / self.breath_period_seconds)
-                _neck_x = 0
-                
-                # Also move the JAW with autonomous breathing
-                if not self.lip_sync_active:
-                    jaw_input_value = self.breath_jaw_center_value - self.breath_jaw_half_amplitude * np.sin(t * 2 * np.pi / self.breath_period_seconds)
-                    self.handle_jaw_input(jaw_input_value)
+    def recover_control_loop(self, servo_boards=None):
+        """Get the servo updates going again after a stall (called by the watchdog, from its own thread):
+        switch to re-initialized servo boards if given (as servo_boards in __init__), and restart the update and
+        audio threads"""
+        devices = None
+        if servo_boards is not None:
+            try:
+                devices = {board: servo_boards(*board).i2c_device for board in self.servo_output.boards}
+            except (OSError, ValueError) as err:
+                log.error(f"Could not re-initialize the servo boards: {err}")
+                close_buses(servo_boards)
             else:
-                # Apply smoothing to the neck, if not in idle mode
-                _neck_x = (self.left_stick_x_prev * self.smoothing_settings["smoothing_ratio_neck"]) + (self.left_stick_x * (1 - self.smoothing_settings["smoothing_ratio_neck"]))
-                _neck_y = (self.left_stick_y_prev * self.smoothing_settings["smoothing_ratio_neck"]) + (self.left_stick_y * (1 - self.smoothing_settings["smoothing_ratio_neck"]))
+                # Only the old buses are closed: deinit() would reset the chips, which the new boards just set up
+                previous_boards, self.servo_boards = self.servo_boards, servo_boards
+                if previous_boards is not servo_boards:
+                    close_buses(previous_boards)
+        # New writers (on the re-initialized boards, if any), so a stalled thread that gets out of its write can't
+        # write at the same time as the new one. The chips may have been reset: write every channel, and every
+        # arbitrated servo, in the next frame
+        self.servo_output.set_devices(devices)
+        self.actuators.invalidate()
+        if self.update_thread_running:
+            # A thread stuck in an I2C write exits once (if ever) the write returns
+            self.update_generation += 1
+            self.update_thread = threading.Thread(target=self.update_servos, args=(self.update_generation,), daemon=True)
+            self.update_thread.start()
+            if not self.audio_thread.is_alive():
+                self.audio_thread = threading.Thread(target=self.process_audio, daemon=True)
+                self.audio_thread.start()
 
-            self.left_stick_x_prev = _neck_x
-            self.left_stick_y_prev = _neck_y
-            # print(f"_neck_x: {_neck_x}\tneck_x_prev: {self.left_stick_x_prev}\t_neck_y: {_neck_y}\tneck_y_prev: {self.left_stick_y_prev}\t")
-            
-            self.servos["neck_horizontal"].angle = map_values(
-                _neck_x,
-                -32767,
-                32767,
-                self.servo_info["neck_horizontal"]["center_angle"] + self.servo_info["neck_horizontal"]["angle_span"] / 2,
-                self.servo_info["neck_horizontal"]["center_angle"] - self.servo_info["neck_horizontal"]["angle_span"] / 2
-            )
-            self.servos["neck_vertical"].angle = map_values(
-                _neck_y,
-                -32767,
-                32767,
-                self.servo_info["neck_vertical"]["center_angle"] + self.servo_info["neck_vertical"]["angle_span"] / 2,
-                self.servo_info["neck_vertical"]["center_angle"] - self.servo_info["neck_vertical"]["angle_span"] / 2,
-                clamp_min=self.servo_info["neck_vertical"]["min_angle"]
-            )
-            # print(f"Neck -- h: {self.servos['neck_horizontal'].angle}\tv: {self.servos['neck_vertical'].angle}\r")
-            
-            # print("Idle mode: ", "{0:b}".format(self.get_idle_mode()))
-            
-            #### JAW (Lip Sync) ####
-            # Idle animation handled above (under NECK); mic input sync handled under audio_stream_callback; controller input handled under on_L2_press
-            if self.lip_sync_active:
-                ts = time.monotonic() - self.lip_sync_zero_timestamp
-                if self.lip_sync_index + 1 >= len(self.lip_sync_jaw_values) - 1:
-                    self.stop_lip_sync()
-                    self.lip_sync_index = len(self.lip_sync_jaw_values) - 1
-                else:
-                    while self.lip_sync_jaw_values[self.lip_sync_index + 1][0] < ts:
-                        self.lip_sync_index += 1
-                self.handle_jaw_input(self.lip_sync_jaw_values[self.lip_sync_index][1])
-                # print(f"ts: {ts}\tcur: {self.lip_sync_jaw_values[self.lip_sync_index][0]}\traw:{self.lip_sync_jaw_values[self.lip_sync_index][1]}\tangle: {self.servos['jaw'].angle}")
+    def update_servos_tick(self, dt, generation=None):
+        """One frame of update_servos; dt is the time in seconds since the previous frame. generation: that of the
+        update thread calling it (the frame is dropped if the thread was replaced by recover_control_loop())"""
+        tick_start = self.latency.clock()
+        stick_event = self.latency.pending("stick")
+        if stick_event is not None:
+            self.latency.record("stick_to_tick", tick_start - stick_event)
+
+        # Edits to calibration.json are applied here, between frames (but not while calibrating with the controller)
+        if self.calibration_mode == -1:
+            calibration_data = self.calibration_store.take_reload()
+            if calibration_data is not None:
+                self.reload_calibration(calibration_data)
+
+        # Handle calibration modes first
+        if self.calibration_mode == 0:
+            self.calibrate_eyes(dt)
+        elif self.calibration_mode == 1:
+            self.calibrate_eyelids(dt)
+        elif self.calibration_mode == 2:
+            self.calibrate_jaw(dt)
+        elif self.calibration_mode == 3:
+            self.calibrate_neck(dt)
+        else:
+            self.animate_servos(dt)
+            # Resolve jaw and eyelid intents from all threads into this frame
+            for servo_name, angle in self.actuators.resolve().items():
+                self.motion_filters.set_angle(self.servo_map.channels[self.servo_map.index[servo_name]], angle)
+            # Every servo's target goes through its motion filter (see motion_filter.py)
+            self.motion_filters.step(dt)
+            self.motion_filters.write(self.servo_output)
+
+        if generation is not None and generation != self.update_generation:
+            # This thread stalled, and another one took over: leave the servo output to that one
+            return
+
+        # Write this frame's changed servo positions to the PCA9685
+        write_start = self.latency.clock()
+        if self.servo_output.flush() > 0:
+            write_done = self.latency.clock()
+            self.latency.record("i2c_write", write_done - write_start)
+            if "first_servo_write" not in self.startup.milestones:
+                self.startup.mark("first_servo_write")
+                self.report_startup()
+            self.latency.close("stick", "stick_to_i2c", write_done)
+            self.latency.close("mic", "mic_to_i2c", write_done)
+            self.latency.close("remote", "remote_to_i2c", write_done)
+        else:
+            # Nothing changed on the bus, so there is no end-to-end latency to measure
+            self.latency.discard("stick")
+            self.latency.discard("mic")
+            self.latency.discard("remote")
+        self.heartbeat = self.latency.clock()
+        self.latency.since("tick", tick_start)
+
+    def animate_servos(self, dt):
+        """Normal operation: smoothed controller input, remote control, idle animations and lip sync playback"""
+        # Remote messages that are due act like controller events, before this frame reads the inputs
+        self.remote.dispatch()
+
+        # Handle show start/stop
+        if self.triangle_is_pressed and not self.show_active:
+            self.start_show()
+        if self.show_active and self.square_is_pressed:
+            self.stop_show()
+
+        #### EYES ####
+        # (smoothed by their motion filters)
+        _eye_x = self.right_stick_x
+        _eye_y = self.right_stick_y
+        
+        self.servo_map.set_input("right_eye_horizontal", _eye_x)
+        self.servo_map.set_input("left_eye_horizontal", _eye_x)
+        self.servo_map.set_input("right_eye_vertical", _eye_y)
+        self.servo_map.set_input("left_eye_vertical", _eye_y)
+        # print(f"Left -- h: {self.servos['left_eye_horizontal'].angle}\tv: {self.servos['left_eye_vertical'].angle}\t\tRight -- h: {self.servos['right_eye_horizontal'].angle}\tv: {self.servos['right_eye_vertical'].angle}\r")
+
+        #### EYELIDS / AUTONOMOUS BLINKING ####
+        if self.get_idle_mode() & 1 == 1:
+            if self.is_blinking:
+                now = self.clock()
+                self.handle_blink_input(self.idle_animations.value("eyelids", now), PRIORITY_IDLE)
+                if not self.idle_animations.is_playing("blink", now):
+                    self.idle_animations.stop("blink")
+                    self.is_blinking = False
+            elif random.random() < 1 - np.exp(-self.blink_rate_per_second * dt):
+                self.initiate_blink()
+        if not self.is_blinking:
+            self.actuators.release("right_eyelid", PRIORITY_IDLE)
+            self.actuators.release("left_eyelid", PRIORITY_IDLE)
+
+        
+        #### NECK  / AUTONOMOUS BREATHING (+jaw) ####
+        if self.left_stick_x > 100 or self.left_stick_x < -100 or self.left_stick_y > 100 or self.left_stick_y < -100:
+            # Reset the countdown timer to re-initiate idle breathe mode
+            self.idle_breath_countdown_zero = self.clock()
+        
+        # Check for breathing idle mode
+        if self.get_idle_mode() & 0b10 == 0b10:
+            # The breathing animations start at the moment the idle countdown is zero
+            self.idle_animations.set_origin("breath", self.idle_breath_countdown_zero + self.idle_timeout_seconds)
+            now = self.clock()
+            _neck_y = self.idle_animations.value("neck_vertical", now)
+            _neck_x = 0
             
-            #### TAIL ####
-            t = time.monotonic()
-            self.servos["tail"].angle = constrain(
-                self.servo_info["tail"]["center_angle"] + self.tail_half_amplitude * np.sin(t * 2 * np.pi / self.tail_period_seconds)
-            )
-            # print(f"Tail -- {self.servos['tail'].angle}\r")
-
-            # Finally, ensure at least 5ms go by before this thread continues
-            time.sleep(5 / 1000.)
+            # Also move the JAW with autonomous breathing
+            self.handle_jaw_input(self.idle_animations.value("jaw", now), PRIORITY_IDLE)
+        else:
+            self.actuators.release("jaw", PRIORITY_IDLE)
+            # Controller input, if not in idle mode (smoothed by the neck's motion filters)
+            _neck_x = self.left_stick_x
+            _neck_y = self.left_stick_y
+        
+        self.servo_map.set_input("neck_horizontal", _neck_x)
+        self.servo_map.set_input("neck_vertical", _neck_y)
+        # print(f"Neck -- h: {self.servos['neck_horizontal'].angle}\tv: {self.servos['neck_vertical'].angle}\r")
+        
+        # print("Idle mode: ", "{0:b}".format(self.get_idle_mode()))
+        
+        #### TAIL ####
+        self.servo_map.set_input("tail", self.idle_animations.value("tail", self.clock()))
+
+        #### REMOTE CONTROL ####
+        # Servo targets from the network override the sticks and idle animations (jaw and eyelids: see dispatch())
+        self.remote.write_inputs(self.servo_map)
+
+        #### SHOW (Lip Sync and other pre-recorded tracks) ####
+        # Idle jaw animation handled above (under NECK); mic input sync handled under audio_stream_callback;
+        # controller input handled under on_L2_press. Show tracks take priority over all of them.
+        if self.timecode_settings["source"] is not None:
+            self.follow_timecode()
+        if self.show_active:
+            self.play_show()
+
+        # Map all of this tick's inputs to servo angles at once, as targets for the motion filters
+        self.servo_map.write(self.motion_filters)
+        # print(f"Tail -- {self.servos['tail'].angle}\r")
     
     def on_triangle_press(self):
         self.triangle_is_pressed = True
@@ -638,6 +1092,12 @@ class LunaController(Controller):
     def on_options_release(self):
         self.options_is_pressed = False
         
+    def on_L1_press(self):
+        self.select_show(1)
+
+    def on_share_press(self):
+        self.select_show(-1)
+
     def on_playstation_button_press(self):
         self.playstation_button_is_pressed = True
     
@@ -654,34 +1114,25 @@ class LunaController(Controller):
                 
 
     def on_R2_press(self, value):
+        self.press_eyelids(value)
+
+    def press_eyelids(self, value, priority=PRIORITY_CONTROLLER):
+        """Eyelids from a trigger (R2, or a remote source's)"""
+        self.latency.mark("stick")
         if not self.is_blinking:
-            self.handle_blink_input(value)
+            self.handle_blink_input(value, priority)
             
             # Reset the countdown timer to re-initiate idle blink mode
-            self.idle_blink_countdown_zero = time.monotonic()
+            self.idle_blink_countdown_zero = self.clock()
         
-    def handle_blink_input(self, value):
+    def handle_blink_input(self, value, priority=PRIORITY_CONTROLLER):
         """Fine Eylid Control"""
-        right_lid_angle = map_values(
-            value,
-            -32767,
-            32767,
-            self.servo_info["right_eyelid"]["min_angle"],
-            self.servo_info["right_eyelid"]["max_angle"],
-            clamp=True
-        )
-        left_lid_angle = map_values(
-            value,
-            -32767,
-            32767,
-            self.servo_info["left_eyelid"]["min_angle"],
-            self.servo_info["left_eyelid"]["max_angle"],
-            clamp=True
-        )
+        right_lid_angle = self.servo_map.angle("right_eyelid", value)
+        left_lid_angle = self.servo_map.angle("left_eyelid", value)
         # print(f"Raw: {value}\tRight: {right_lid_angle}\tLeft: {left_lid_angle}\tEyelids Raised: {self.raised_eyelids}")
         if not self.raised_eyelids:
-            self.servos["right_eyelid"].angle = right_lid_angle
-            self.servos["left_eyelid"].angle = left_lid_angle
+            self.actuators.post("right_eyelid", priority, right_lid_angle)
+            self.actuators.post("left_eyelid", priority, left_lid_angle)
     
     def on_R2_release(self):
         """Release Eyelids: fine control"""
@@ -689,110 +1140,292 @@ class LunaController(Controller):
             self.on_R1_release()
 
     def on_R1_press(self):
+        self.raise_eyelids()
+
+    def raise_eyelids(self, priority=PRIORITY_CONTROLLER):
         """Eyelid raised gesture"""
         self.raised_eyelids = True
-        self.servos["right_eyelid"].angle = self.servo_info["left_eyelid"]["min_angle"] - 20
-        self.servos["left_eyelid"].angle = self.servo_info["left_eyelid"]["min_angle"] - 20
+        self.actuators.post("right_eyelid", priority, self.servo_info["left_eyelid"]["min_angle"] - 20)
+        self.actuators.post("left_eyelid", priority, self.servo_info["left_eyelid"]["min_angle"] - 20)
         
         # Reset the countdown timer to re-initiate idle blink mode
-        self.idle_blink_countdown_zero = time.monotonic()
+        self.idle_blink_countdown_zero = self.clock()
 
     def on_R1_release(self):
+        self.release_eyelids()
+
+    def release_eyelids(self, priority=PRIORITY_CONTROLLER):
         """Release Eyelids to Neutral"""
         self.raised_eyelids = False
-        self.servos["right_eyelid"].angle = self.servo_info["right_eyelid"]["min_angle"]
-        self.servos["left_eyelid"].angle = self.servo_info["left_eyelid"]["min_angle"]
+        # Back to the resting position, unless something else (e.g. a blink) wants the eyelids
+        self.actuators.release("right_eyelid", priority)
+        self.actuators.release("left_eyelid", priority)
 
     def on_L2_press(self, value):
-        if self.lip_sync_active:
-            # Lip Sync takes priority over everything, abort here
-            return
-        self.jaw_controller_priority = True
-        
+        self.press_jaw(value)
+
+    def press_jaw(self, value, priority=PRIORITY_CONTROLLER):
+        """Jaw from a trigger (L2, or a remote source's)"""
+        self.latency.mark("stick")
         # Reset the countdown timer to re-initiate idle breathe mode
-        self.idle_breath_countdown_zero = time.monotonic()
+        self.idle_breath_countdown_zero = self.clock()
         
-        self.handle_jaw_input(value)
+        # Lip Sync takes priority over the controller; the arbiter keeps the jaw on the track while it plays
+        self.handle_jaw_input(value, priority)
 
-    def handle_jaw_input(self, value):
+    def handle_jaw_input(self, value, priority=PRIORITY_CONTROLLER):
         """Jaw Control"""
-        jawAngle = map_values(
-            value,
-            -32767,
-            32767,
-            self.servo_info["jaw"]["min_angle"],
-            self.servo_info["jaw"]["max_angle"],
-            clamp=True
-        )
-        self.servos["jaw"].angle = jawAngle
+        jawAngle = self.servo_map.angle("jaw", value)
+        self.actuators.post("jaw", priority, jawAngle)
             
     def on_L2_release(self):
+        self.release_jaw()
+
+    def release_jaw(self, priority=PRIORITY_CONTROLLER):
         """Release Jaw to Neutral"""
-        if self.lip_sync_active:
-            # Lip Sync takes priority over everything, abort here
-            return
-        self.servos["jaw"].angle = self.servo_info["jaw"]["min_angle"]
-        self.jaw_controller_priority = False
-        
-
-class SupressStdoutStderr(object):
-    """
-    A context manager for doing a "deep suppression" of stdout and stderr in 
-    Python, i.e. will suppress all print, even if the print originates in a 
-    compiled C/Fortran sub-function.
-       This will not suppress raised exceptions, since exceptions are printed
-    to stderr just before a script exits, and after the context manager has
-    exited (at least, I think that is why it lets exceptions through).
-    
-    from:
-    https://stackoverflow.com/questions/11130156/suppress-stdout-stderr-print-from-python-functions      
-    """
-    def __init__(self):
-        # Open a pair of null files
-        self.null_fds =  [os.open(os.devnull, os.O_RDWR) for x in range(2)]
-        # Save the actual stdout (1) and stderr (2) file descriptors.
-        self.save_fds = [os.dup(1), os.dup(2)]
-
-    def __enter__(self):
-        # Assign the null pointers to stdout and stderr.
-        os.dup2(self.null_fds[0],1)
-        os.dup2(self.null_fds[1],2)
-
-    def __exit__(self, *_):
-        # Re-assign the real stdout/stderr back to (1) and (2)
-        os.dup2(self.save_fds[0],1)
-        os.dup2(self.save_fds[1],2)
-        # Close all file descriptors
-        for fd in self.null_fds + self.save_fds:
-            os.close(fd)
-
-
-def map_values(value, in_min, in_max, out_min, out_max, clamp=False, clamp_min=None, clamp_max=None):
-    slope = (out_max - out_min) / (in_max - in_min)
-    intercept = out_min - (slope * in_min)
-    out = (slope * value) + intercept
-    if clamp or clamp_min or clamp_max:
-        clamp_min = min(out_max, out_min) if clamp_min is None else clamp_min
-        clamp_max = max(out_max, out_min) if clamp_max is None else clamp_max
-        out = max(clamp_min, min(out, clamp_max))
-    return out
-
-def constrain(value, minimum=0, maximum=180):
-    return max(min(minimum, maximum), min(value, max(minimum, maximum)))
-
-# Create the I2C bus interface.
-i2c = board.I2C()  # uses board.SCL and board.SDA
-
-# Servo Interface Board
-pca = PCA9685(i2c)
-
-# Set the PWM frequency to 60hz.
-pca.frequency = 60
-
-controller = LunaController(pca, interface="/dev/input/js0", connecting_using_ds4drv=False)
-try:
-    controller.listen(timeout=300)
-finally:
-    # the listen() function annoyingly uses exit(1) internally, so we need to do any cleanup here
-    pca.deinit()
-    exit(1)
+        # Falls back to the mic (or the closed, resting position)
+        self.actuators.release("jaw", priority)
+        
+
+def close_buses(servo_boards):
+    """Close the I2C buses of servo_boards, if it opened them itself (like hardware.I2CServoBoards)"""
+    if hasattr(servo_boards, "close"):
+        servo_boards.close()
+
+
+def single_servo_board(pca_interface):
+    """servo_boards for LunaController when all servos are on one PCA9685 (on the default bus)"""
+    def open_board(bus, address):
+        if (bus, address) != (DEFAULT_BUS, pca_interface.i2c_device.device_address):
+            raise ValueError(f"No servo board on I2C bus {bus} at address 0x{address:x}")
+        return pca_interface
+    return open_board
+
+
+def legacy_motion_filters(smoothing_settings):
+    """MOTION_FILTERS with the eye and neck time constants from an older calibration file's smoothing_settings"""
+    motion_filters = {servo_name: dict(settings) for servo_name, settings in MOTION_FILTERS.items()}
+    for joint in ["eye", "neck"]:
+        time_constant = smoothing_settings.get(f"smoothing_time_constant_{joint}")
+        if time_constant is None:
+            # Even older ones have per-iteration smoothing ratios
+            ratio = smoothing_settings.get(f"smoothing_ratio_{joint}")
+            time_constant = SMOOTHING_SETTINGS[f"smoothing_time_constant_{joint}"] if ratio is None else float(smoothing_time_constant(ratio))
+        for servo_name, settings in motion_filters.items():
+            if f"_{joint}_" in f"_{servo_name}_":
+                settings["time_constant"] = time_constant
+    return motion_filters
+
+
+def validate_calibration(calibration_data):
+    """Raise ValueError if calibration data (as in calibration.json) would not work, before it is applied"""
+    if not isinstance(calibration_data, dict):
+        raise ValueError("not a JSON object")
+    servo_info = calibration_data.get("servo_mapping", SERVO_MAPPING)
+    for servo_name in SERVO_MAPPING:
+        if servo_name not in servo_info:
+            raise ValueError(f"servo_mapping has no '{servo_name}'")
+        info = servo_info[servo_name]
+        if not isinstance(info.get("channel"), int) or not 0 <= info["channel"] < 16:
+            raise ValueError(f"{servo_name}: channel must be 0 to 15")
+        bus, address = servo_board(info)
+        if not isinstance(bus, int) or bus < 0:
+            raise ValueError(f"{servo_name}: bus must be an I2C bus number (e.g. 1 for /dev/i2c-1)")
+        if not isinstance(address, int) or not 0x40 <= address <= 0x7F:
+            raise ValueError(f"{servo_name}: address must be a PCA9685 address, 0x40 to 0x7F")
+        for key in ["center_angle", "min_angle", "max_angle"]:
+            if key in info and not 0 <= info[key] <= 180:
+                raise ValueError(f"{servo_name}: {key} must be 0 to 180 degrees")
+        # As CompiledServoMap.compile() maps them
+        if "center_angle" in info:
+            if "angle_span" not in info:
+                raise ValueError(f"{servo_name}: center_angle needs angle_span")
+        elif "min_angle" not in info or "max_angle" not in info:
+            raise ValueError(f"{servo_name}: needs center_angle and angle_span, or min_angle and max_angle")
+        if servo_name in ARBITRATED_SERVOS and ("min_angle" not in info or "max_angle" not in info):
+            raise ValueError(f"{servo_name}: needs min_angle (its resting position) and max_angle")
+    channels = [servo_board(servo_info[servo_name]) + (servo_info[servo_name]["channel"],) for servo_name in SERVO_MAPPING]
+    if len(set(channels)) != len(channels):
+        raise ValueError("two servos share a channel")
+    audio_input_settings = calibration_data.get("audio_input_settings", AUDIO_INPUT_SETTINGS)
+    if not audio_input_settings["mic_threshold_low"] < audio_input_settings["mic_threshold_hi"]:
+        raise ValueError("mic_threshold_low must be below mic_threshold_hi")
+    if audio_input_settings.get("envelope", "rms") not in ("rms", "peak"):
+        raise ValueError("envelope must be 'rms' or 'peak'")
+    for key, value in calibration_data.get("smoothing_settings", SMOOTHING_SETTINGS).items():
+        if not value >= 0:
+            raise ValueError(f"{key} must not be negative")
+    for servo_name, settings in calibration_data.get("motion_filters", {}).items():
+        try:
+            validate_filter(settings)
+        except ValueError as err:
+            raise ValueError(f"motion_filters: {servo_name}: {err}")
+    try:
+        validate_remote_settings(calibration_data.get("remote_control", {}))
+    except ValueError as err:
+        raise ValueError(f"remote_control: {err}")
+    timecode_settings = {**TIMECODE, **calibration_data.get("timecode", {})}
+    if timecode_settings["source"] not in TIMECODE_SOURCES:
+        raise ValueError(f"timecode: source must be one of {TIMECODE_SOURCES}")
+    if not timecode_settings["fps"] > 0:
+        raise ValueError("timecode: fps must be positive")
+    if timecode_settings["source"] == "ltc" and \
+            not 0 <= timecode_settings["ltc_channel"] < audio_input_settings.get("channels", 1):
+        raise ValueError("timecode: ltc_channel must be one of the audio input's channels")
+    idle_animations = calibration_data.get("idle_animations", IDLE_ANIMATIONS)
+    for name in IDLE_ANIMATION_NAMES:
+        if name not in idle_animations:
+            raise ValueError(f"idle_animations has no '{name}'")
+    animator = Animator.from_data(idle_animations)
+    for channel in IDLE_ANIMATION_CHANNELS:
+        if channel not in animator.channels:
+            raise ValueError(f"idle_animations has nothing on channel '{channel}'")
+
+
+def run_simulation(controller, clock, duration, joystick=None, microphone=None, on_tick=None):
+    """Drive a controller built with start_update_thread=False on a SimulatedClock, as fast as possible.
+    on_tick is called after every update_servos tick. Returns the number of ticks run."""
+    end_time = clock() + duration
+    ticks = 0
+    while clock() < end_time:
+        dt = controller.update_scheduler.wait()
+        if joystick is not None:
+            joystick.pump(controller, clock())
+        if microphone is not None:
+            microphone.pump(clock())
+        controller.process_pending_audio()
+        controller.update_servos_tick(dt)
+        if on_tick is not None:
+            on_tick()
+        ticks += 1
+    return ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Luna the Animatronic Alebrije")
+    parser.add_argument("--simulate", action="store_true",
+                        help="run headless on simulated hardware (no PCA9685, controller or mic needed)")
+    parser.add_argument("--duration", type=float, default=60, help="simulated seconds to run (with --simulate)")
+    parser.add_argument("--wav", help="WAV file to use as the microphone (with --simulate)")
+    parser.add_argument("--script", help="JSON script of controller events to replay (with --simulate)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, for repeatable simulations")
+    parser.add_argument("--latency-socket", default="/tmp/luna_latency.sock",
+                        help="Unix socket serving latency stats (read with 'python latency_stats.py'); '' to disable")
+    parser.add_argument("--latency-file", help="also write latency stats to this Prometheus text file every 10 s")
+    parser.add_argument("--record", metavar="LOG_FILE",
+                        help="record controller events, mic levels, remote control messages and timecode to a session "
+                             "log (see session_recorder.py)")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="run controller input, servo updates and audio processing on one asyncio event loop")
+    parser.add_argument("--log-file",
+                        help="log file, rotated by size (default: luna.log next to this script; none with --simulate)")
+    parser.add_argument("--watchdog-budget", type=float, default=0.2,
+                        help="seconds without a servo update before the watchdog steps in (0 to disable)")
+    parser.add_argument("--pid-file", help="write this process's PID to this file (for startup_and_monitor.bash)")
+    parser.add_argument("--remote-port", type=int, default=0,
+                        help="UDP port for remote control (OSC messages, see remote_control.py; it listens on the "
+                             "remote_control bind_address in calibration.json); 0 (default) to disable")
+    args = parser.parse_args()
+    log_filepath = args.log_file
+    if log_filepath is None and not args.simulate:
+        log_filepath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "luna.log")
+    log_writer = setup_logging(log_filepath)
+    random.seed(args.seed)
+    recorder = SessionRecorder(args.record, seed=args.seed) if args.record else None
+
+    if args.simulate:
+        clock = SimulatedClock()
+        servo_boards = SimulatedServoBoards(PWM_FREQUENCY)
+        microphone = NullMicrophone()
+        if args.wav:
+            microphone = WavFileMicrophone(args.wav, chunk=AUDIO_INPUT_SETTINGS["chunk"], realtime=False, clock=clock)
+        joystick = ScriptedJoystick.from_file(args.script, clock=clock) if args.script else None
+        controller = LunaController(servo_boards, microphone=microphone,
+                                    clock=clock, sleep=clock.sleep, start_update_thread=False,
+                                    interface="/dev/input/js0", connecting_using_ds4drv=False)
+        if recorder:
+            recorder.attach(controller)
+        start = time.perf_counter()
+        ticks = run_simulation(controller, clock, args.duration, joystick, microphone)
+        if recorder:
+            recorder.close()
+        log_writer.stop()
+        elapsed = time.perf_counter() - start
+        print(f"Simulated {args.duration:.1f} s ({ticks} ticks) in {elapsed:.2f} s ({args.duration / elapsed:.1f}x real time)")
+        print(f"I2C: {servo_boards.transactions} transactions, {servo_boards.bytes_transferred} bytes "
+              f"({len(servo_boards.boards)} boards on {len(servo_boards.buses)} buses)")
+        print(f"Scheduler: {controller.update_scheduler.stats()}")
+        print(f"Jaw/eyelid intents: {controller.actuators.stats()}")
+        print(f"Audio ring buffer: {controller.audio_ring.stats()}")
+        controller.calibration_store.flush()
+        if args.latency_file:
+            controller.latency.write_prometheus(args.latency_file)
+        return
+
+    if args.pid_file:
+        with open(args.pid_file, 'w') as pid_file:
+            pid_file.write(f"{os.getpid()}\n")
+
+    # Servo Interface Boards (PCA9685), opened on their I2C buses as servo_mapping needs them, at 60 Hz
+    servo_boards = I2CServoBoards(PWM_FREQUENCY)
+
+    def reinitialize_boards():
+        """New I2C connections and reset PCA9685s, for the watchdog to recover from a hung bus"""
+        return I2CServoBoards(PWM_FREQUENCY)
+
+    if args.asyncio:
+        from async_runtime import AsyncJoystick, AsyncRuntime
+        # The event loop drives the update ticks and the audio processing; PortAudio's thread only queues chunks
+        controller = LunaController(servo_boards, microphone=NullMicrophone(), start_update_thread=False,
+                                    interface="/dev/input/js0", connecting_using_ds4drv=False)
+        runtime = AsyncRuntime(controller, AsyncJoystick(controller.interface, timeout=300),
+                               microphone=PyAudioMicrophone(controller.audio_input_settings),
+                               remote_port=args.remote_port or None)
+    else:
+        controller = LunaController(servo_boards, interface="/dev/input/js0", connecting_using_ds4drv=False)
+        if args.remote_port:
+            controller.remote.start(args.remote_port)
+    if args.latency_socket or args.latency_file:
+        controller.latency.start_exporter(socket_path=args.latency_socket, prometheus_filepath=args.latency_file)
+    if recorder:
+        recorder.attach(controller)
+    if args.watchdog_budget > 0:
+        def restart_process():
+            controller.calibration_store.flush(timeout=1.0)
+            if recorder:
+                # The session up to the stall is the part worth having
+                recorder.close()
+            log_writer.stop()
+            os._exit(WATCHDOG_EXIT_CODE)
+        watchdog = ControlWatchdog(controller, budget=args.watchdog_budget, reinitialize_boards=reinitialize_boards,
+                                   restart=restart_process)
+        controller.latency.add_gauges("watchdog", watchdog.stats)
+        watchdog.start()
+    if args.asyncio:
+        controller.calibration_store.start()
+        import asyncio
+        try:
+            reason = asyncio.run(runtime.run())
+        finally:
+            controller.calibration_store.flush()
+            if recorder:
+                recorder.close()
+            controller.servo_boards.deinit()
+        log.info(f"Luna Controller stopped ({reason})")
+        log_writer.stop()
+        # Non-zero when the controller went away, so startup_and_monitor.bash restarts and waits for it again
+        return 0 if reason == "stopped" else 1
+    try:
+        JoystickInput(timeout=300).run(controller)
+    finally:
+        # the listen() function annoyingly uses exit(1) internally, so we need to do any cleanup here
+        controller.calibration_store.flush()
+        if recorder:
+            recorder.close()
+        controller.servo_boards.deinit()
+        log_writer.stop()
+        exit(1)
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,171 @@
+"""Logging for luna_control.py that never blocks the control loop and goes easy on the SD card.
+
+    - Records are put on a queue by the thread that logs them; a writer thread does all the file I/O.
+    - The log file (luna.log by default) is rotated by size by the process itself (luna.log.1, .2, ...), and is
+      flushed at most once a second (immediately for warnings and errors), instead of after every line.
+    - StatusLine is for values that change every tick (like servo angles while calibrating): it only logs
+      them at most every interval seconds, and only when they changed.
+    - Debug records only go to an in-memory ring buffer of the most recent ones, which is written to the log
+      when an error is logged, to see what led up to it.
+
+Extra fields are logged as key=value after the message: log.info("Lip sync started", extra=fields(offset=30.0))
+"""
+import collections, logging, logging.handlers, queue, sys, threading, time
+
+
+def fields(**values):
+    """extra= for a logging call, to log values as key=value fields"""
+    return {"fields": values}
+
+
+def _format_fields(record):
+    values = getattr(record, "fields", None)
+    if not values:
+        return ""
+    return " " + " ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+                          for key, value in values.items())
+
+
+class FieldFormatter(logging.Formatter):
+    """Log file lines: time, level, logger name, message and key=value fields"""
+    def __init__(self):
+        super().__init__("%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    def format(self, record):
+        return super().format(record) + _format_fields(record)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Terminal lines: just the message and fields, warnings in yellow and errors in red (as print() did)"""
+    COLORS = {logging.WARNING: "\033[1m\033[33m", logging.ERROR: "\033[1m\033[31m", logging.CRITICAL: "\033[1m\033[31m"}
+
+    def format(self, record):
+        text = record.getMessage() + _format_fields(record)
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        color = self.COLORS.get(record.levelno)
+        return f"{color}{text}\033[0m" if color else text
+
+
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Size-rotated log file that flushes at most every flush_interval seconds, except for warnings and errors"""
+    def __init__(self, filepath, max_bytes, backup_count, flush_interval=1.0):
+        super().__init__(filepath, maxBytes=max_bytes, backupCount=backup_count)
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._urgent = False
+
+    def emit(self, record):
+        self._urgent = record.levelno >= logging.WARNING
+        super().emit(record)
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if force or self._urgent or now - self._last_flush >= self.flush_interval:
+            super().flush()
+            self._last_flush = now
+            self._urgent = False
+
+    def close(self):
+        self.flush(force=True)
+        super().close()
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent capacity records in memory; when an error is logged, the ones that were not
+    written (below the writer's level) are handed to target, oldest first"""
+    def __init__(self, capacity=2000, target=None):
+        super().__init__(logging.DEBUG)
+        self.records = collections.deque(maxlen=capacity)
+        self.target = target
+
+    def emit(self, record):
+        if record.levelno >= logging.ERROR and self.target is not None:
+            self.dump(below=self.target.level)
+        self.records.append(record)
+
+    def dump(self, below=logging.CRITICAL + 1):
+        """Hand the buffered records below level below to target, and forget them"""
+        records = [record for record in self.records if record.levelno < below]
+        self.records.clear()
+        for record in records:
+            self.target.handle(record)
+
+
+class LogWriter:
+    """Writer thread: takes records off the queue and hands them to the file and console handlers"""
+    def __init__(self, handlers, flush_interval=1.0):
+        self.queue = queue.SimpleQueue()
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # Quiet for a while: write out what is still buffered
+                for handler in self.handlers:
+                    handler.flush()
+                continue
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self, timeout=2.0):
+        """Write out everything logged so far and close the files"""
+        self.queue.put(None)
+        self._thread.join(timeout)
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup_logging(filepath=None, console=None, level=logging.INFO, max_bytes=1_000_000, backup_count=3,
+                  ring_capacity=2000):
+    """Send all logging to a size-rotated file (if filepath is given) and the console (by default, only if stdout
+    is a terminal; under startup_and_monitor.bash it is monitor.log, which would get every line twice).
+    Returns the LogWriter; call its stop() before exiting."""
+    handlers = []
+    if filepath:
+        file_handler = BatchedRotatingFileHandler(filepath, max_bytes, backup_count)
+        file_handler.setFormatter(FieldFormatter())
+        handlers.append(file_handler)
+    if console is None:
+        console = sys.stdout.isatty() or not filepath
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(ConsoleFormatter())
+        handlers.append(console_handler)
+    writer = LogWriter(handlers)
+
+    queue_handler = logging.handlers.QueueHandler(writer.queue)
+    queue_handler.setLevel(level)
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    # The ring buffer goes first, so that it hands over what led up to an error before the error itself
+    root.addHandler(RingBufferHandler(ring_capacity, target=queue_handler))
+    root.addHandler(queue_handler)
+    return writer
+
+
+class StatusLine:
+    """A status that changes every tick, logged at most every interval seconds and only when it changed"""
+    def __init__(self, logger, message, interval=0.5, clock=time.monotonic):
+        self.logger = logger
+        self.message = message
+        self.interval = interval
+        self.clock = clock
+        self._values = None
+        self._next_time = 0.0
+
+    def update(self, **values):
+        now = self.clock()
+        if now < self._next_time or values == self._values:
+            return
+        self._values = values
+        self._next_time = now + self.interval
+        self.logger.info(self.message, extra=fields(**values))
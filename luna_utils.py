@@ -0,0 +1,67 @@
+import os
+import numpy as np
+
+
+def map_values(value, in_min, in_max, out_min, out_max, clamp=False, clamp_min=None, clamp_max=None):
+    """Linearly map value from [in_min, in_max] to [out_min, out_max]. Works on scalars and NumPy arrays alike."""
+    slope = (out_max - out_min) / (in_max - in_min)
+    intercept = out_min - (slope * in_min)
+    out = (slope * value) + intercept
+    if clamp or clamp_min or clamp_max:
+        clamp_min = min(out_max, out_min) if clamp_min is None else clamp_min
+        clamp_max = max(out_max, out_min) if clamp_max is None else clamp_max
+        if isinstance(out, np.ndarray):
+            out = np.clip(out, clamp_min, clamp_max)
+        else:
+            out = max(clamp_min, min(out, clamp_max))
+    return out
+
+def constrain(value, minimum=0, maximum=180):
+    return max(min(minimum, maximum), min(value, max(minimum, maximum)))
+
+# The original update loop slept 5 ms per iteration; per-iteration smoothing ratios were tuned at this rate
+LEGACY_TICK_SECONDS = 0.005
+
+def smoothing_factor(time_constant, dt):
+    """Exponential smoothing factor for one step of dt seconds: new = prev * factor + input * (1 - factor)"""
+    if time_constant <= 0:
+        return 0.0
+    return float(np.exp(-dt / time_constant))
+
+def smoothing_time_constant(ratio, tick_seconds=LEGACY_TICK_SECONDS):
+    """Convert a per-iteration smoothing ratio (at tick_seconds per iteration) to a time constant in seconds"""
+    if ratio <= 0:
+        return 0.0
+    return -tick_seconds / np.log(ratio)
+
+
+class SupressStdoutStderr(object):
+    """
+    A context manager for doing a "deep suppression" of stdout and stderr in 
+    Python, i.e. will suppress all print, even if the print originates in a 
+    compiled C/Fortran sub-function.
+       This will not suppress raised exceptions, since exceptions are printed
+    to stderr just before a script exits, and after the context manager has
+    exited (at least, I think that is why it lets exceptions through).
+    
+    from:
+    https://stackoverflow.com/questions/11130156/suppress-stdout-stderr-print-from-python-functions      
+    """
+    def __init__(self):
+        # Open a pair of null files
+        self.null_fds =  [os.open(os.devnull, os.O_RDWR) for x in range(2)]
+        # Save the actual stdout (1) and stderr (2) file descriptors.
+        self.save_fds = [os.dup(1), os.dup(2)]
+
+    def __enter__(self):
+        # Assign the null pointers to stdout and stderr.
+        os.dup2(self.null_fds[0],1)
+        os.dup2(self.null_fds[1],2)
+
+    def __exit__(self, *_):
+        # Re-assign the real stdout/stderr back to (1) and (2)
+        os.dup2(self.save_fds[0],1)
+        os.dup2(self.save_fds[1],2)
+        # Close all file descriptors
+        for fd in self.null_fds + self.save_fds:
+            os.close(fd)
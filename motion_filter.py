@@ -0,0 +1,139 @@
+"""Per-servo motion filters, evaluated for all servos at once every frame.
+
+Each servo's target angle (from the servo map, the actuator arbiter or a show) goes through its own filter before
+it is written to the PCA9685, so a noisy trigger, the mic or a stepped track doesn't make it jump or buzz between
+neighbouring positions. Target changes within a deadband are ignored, and a filter settles exactly on its target
+(within SETTLE_DEGREES), so a servo that is holding still (give or take input noise) stops generating I2C writes.
+
+Filters are set per servo name in calibration.json ("motion_filters", defaults in MOTION_FILTERS in luna_control.py):
+    "type":          "none" (raw), "ema" (exponential smoothing), "spring" (critically damped second order:
+                     smooth starts and stops, no overshoot) or "slew" (only the speed limit below)
+    "time_constant": seconds, for "ema" and "spring" (a spring takes about 2 time constants to settle half way)
+    "max_speed":     degrees per second; optional for any type
+    "deadband":      degrees; the target only moves when the input moved further than this (default 0)
+"""
+import numpy as np
+from servo_output import NUM_CHANNELS, board_layout, output_indices
+
+
+FILTER_TYPES = ("none", "ema", "spring", "slew")
+NONE, EMA, SPRING, SLEW = range(len(FILTER_TYPES))
+SETTLE_DEGREES = 0.05  # about a tenth of a PCA9685 step (at 60 Hz)
+
+
+def validate_filter(settings):
+    """Raise ValueError if one servo's filter settings (as in calibration.json) are not usable"""
+    if settings.get("type", "none") not in FILTER_TYPES:
+        raise ValueError(f"type must be one of {FILTER_TYPES}")
+    if not settings.get("time_constant", 0) >= 0:
+        raise ValueError("time_constant must not be negative")
+    if settings.get("max_speed") is not None and not settings["max_speed"] > 0:
+        raise ValueError("max_speed must be positive")
+    if not settings.get("deadband", 0) >= 0:
+        raise ValueError("deadband must not be negative")
+
+
+class MotionFilterBank:
+    """Filter state and parameters as per-channel NumPy arrays (indexed like the output frame, see output_indices()).
+
+    Targets are staged with set_angle()/set_angles() (so it can stand in for the ServoFrameWriter in
+    CompiledServoMap.write()); step(dt) advances every filter, and write() stages the filtered angles into the
+    ServoFrameWriter. Channels that never had a target are left alone.
+    """
+    def __init__(self, n_channels=NUM_CHANNELS):
+        self.kinds = np.zeros(n_channels, dtype=np.int8)
+        self.time_constants = np.zeros(n_channels)
+        self.max_speeds = np.full(n_channels, np.inf)
+        self.deadbands = np.zeros(n_channels)
+        self.inputs = np.full(n_channels, np.nan)   # staged targets
+        self.targets = np.full(n_channels, np.nan)  # the targets being filtered toward (inputs, with the deadband)
+        self.positions = np.full(n_channels, np.nan)
+        self.velocities = np.zeros(n_channels)
+        self._dt = None
+
+    def compile(self, servo_info, filter_settings):
+        """Set each servo's filter from its settings (by servo name); servos without settings are not filtered"""
+        indices = output_indices(servo_info)
+        n_channels = NUM_CHANNELS * len(board_layout(servo_info))
+        if n_channels != len(self.kinds):
+            # Different boards: start over
+            self.__init__(n_channels)
+        kinds = np.zeros_like(self.kinds)
+        time_constants = np.zeros_like(self.time_constants)
+        max_speeds = np.full_like(self.max_speeds, np.inf)
+        deadbands = np.zeros_like(self.deadbands)
+        for name, info in servo_info.items():
+            settings = filter_settings.get(name, {})
+            channel = indices[name]
+            kinds[channel] = FILTER_TYPES.index(settings.get("type", "none"))
+            time_constants[channel] = settings.get("time_constant", 0.0)
+            if settings.get("max_speed") is not None:
+                max_speeds[channel] = settings["max_speed"]
+            deadbands[channel] = settings.get("deadband", 0.0)
+        # A time constant of 0 is no smoothing at all
+        kinds[((kinds == EMA) | (kinds == SPRING)) & (time_constants <= 0)] = NONE
+        self.kinds, self.time_constants, self.max_speeds, self.deadbands = kinds, time_constants, max_speeds, deadbands
+        self._dt = None
+
+    def _prepare(self, dt):
+        """Per-channel coefficients for steps of dt seconds (recomputed only when dt or the filters change)"""
+        self._dt = dt
+        time_constants = np.where(self.time_constants > 0, self.time_constants, 1.0)
+        decay = np.exp(-dt / time_constants)
+        self._ema_gain = np.where(self.kinds == EMA, decay, 0.0)
+        self._spring_gain = np.where(self.kinds == SPRING, decay, 0.0)
+        self._omega = np.where(self.kinds == SPRING, 1.0 / time_constants, 0.0)
+        self._max_step = self.max_speeds * dt
+
+    def set_angle(self, channel: int, angle):
+        self.inputs[channel] = angle
+
+    def set_angles(self, channels, angles):
+        self.inputs[channels] = angles
+
+    def reset(self, angles):
+        """Start every filter from angles (per channel; nan: from its next target), at rest and with no target"""
+        self.positions[:] = angles
+        self.inputs.fill(np.nan)
+        self.targets.fill(np.nan)
+        self.velocities.fill(0.0)
+
+    def step(self, dt: float):
+        """Move every filtered position toward its target by dt seconds; returns the positions"""
+        if dt != self._dt:
+            self._prepare(dt)
+        targets = self.targets
+        # Follow the inputs that moved further than their deadband (and any first input)
+        np.copyto(targets, self.inputs, where=~(np.abs(self.inputs - targets) <= self.deadbands))
+        positions = self.positions
+        velocities = self.velocities
+        # A servo's first target is taken as is
+        np.copyto(positions, targets, where=np.isnan(positions))
+        error = positions - targets
+
+        # Exact solutions over dt (so they behave the same at any frame rate): ema decays the error, and spring is
+        # x'' = -2w x' - w^2 x with w = 1 / time_constant. Other types jump to the target (before the speed limit).
+        spring_velocity = velocities + self._omega * error
+        new_error = error * self._ema_gain + (error + spring_velocity * dt) * self._spring_gain
+        new_velocities = (velocities - self._omega * spring_velocity * dt) * self._spring_gain
+
+        # Speed limit (on top of any filter type)
+        moves = np.minimum(np.maximum(targets + new_error - positions, -self._max_step), self._max_step)
+        new_positions = positions + moves
+        new_velocities = np.minimum(np.maximum(new_velocities, -self.max_speeds), self.max_speeds)
+
+        # Settle exactly on the target, so the servo stops being written
+        settled = (np.abs(new_positions - targets) < SETTLE_DEGREES) & (np.abs(new_velocities) * dt < SETTLE_DEGREES)
+        new_positions[settled] = targets[settled]
+        new_velocities[settled] = 0.0
+
+        # Channels without a target keep their position (nan: unfiltered, never written)
+        has_target = ~np.isnan(targets)
+        positions[has_target] = new_positions[has_target]
+        self.velocities = np.where(has_target, new_velocities, 0.0)
+        return positions
+
+    def write(self, servo_output):
+        """Stage the filtered angles of every channel that has a target into servo_output"""
+        active = np.flatnonzero(~np.isnan(self.positions))
+        servo_output.set_angles(active, self.positions[active])
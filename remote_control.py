@@ -0,0 +1,597 @@
+"""Remote control over the local network: UDP datagrams in OSC layout, e.g. from a show-control computer.
+
+    python luna_control.py --remote-port 9000
+
+Messages (OSC 1.0; several can be batched into one datagram as an OSC bundle):
+    /luna/frame       ,id(sf)*  a frame of servo targets: servo name and value pairs (any of servo_mapping)
+    /luna/controller  ,id(sf)*  control name and value pairs, handled like the PS4 controller's (see CONTROLS)
+    /luna/release     ,id       let go of everything this sender holds
+    /luna/timecode    ,idd      the position (seconds) of the video the show follows, when the "timecode" source
+                                is "udp" (see timecode_sync.py); not buffered, it goes straight to the follower
+Every message starts with a sequence number (int32, one more for each message) and the time it was sent (float64
+seconds on the sender's clock, from any origin). Values are in "controller input" units (-32767 to 32767), mapped
+through the calibration like the sticks; buttons are 1 (pressed) or 0.
+
+Each sender (IP address and port) is a source:
+    - Its messages are applied in sequence order. A message older than one already applied (a duplicate, or one
+      that was overtaken) is dropped.
+    - Jitter buffer: a message is applied jitter_buffer_seconds after it would have arrived over the fastest path
+      seen lately (its send time + the smallest recent transit time), so messages whose transit times vary by up
+      to that much are still applied at the intervals they were sent at. With 0, each is applied at the next frame.
+    - Its jaw and eyelid targets are posted to the ActuatorArbiter at the source's priority level (by default
+      "remote": above the PS4 controller, below lip sync). Sources at the same level share it. Its targets for
+      the other servos override the sticks and idle animations, but not a playing show.
+    - When it has sent nothing for hold_seconds, it is released, as if it had sent /luna/release.
+Only datagrams from the IP addresses in allowed_senders ("*": any) are accepted, on bind_address (by default
+127.0.0.1: this computer only). Remote sources can't enter calibration mode or save a calibration: the options,
+PlayStation and arrow buttons are refused (see CALIBRATION_CONTROLS).
+Settings are in calibration.json, under "remote_control" (defaults in REMOTE_CONTROL in luna_control.py).
+
+Loopback throughput and latency benchmark, into a LunaController on simulated servo boards:
+    python remote_control.py
+Sending values by hand:
+    python remote_control.py --send 192.168.1.30:9000 jaw=20000 tail=-10000
+"""
+import argparse, collections, heapq, logging, math, socket, struct, threading, time
+from actuator_arbiter import PRIORITY_NAMES, PRIORITY_REMOTE
+from luna_log import fields
+from servo_mapping import INPUT_MIN
+
+
+log = logging.getLogger(__name__)
+
+FRAME_ADDRESS = "/luna/frame"
+CONTROLLER_ADDRESS = "/luna/controller"
+RELEASE_ADDRESS = "/luna/release"
+TIMECODE_ADDRESS = "/luna/timecode"
+BUNDLE_TAG = b"#bundle\0"
+ARGUMENT_FORMATS = {"i": ">i", "h": ">q", "f": ">f", "d": ">d"}
+
+SEQUENCE_MODULUS = 2**32
+TRANSIT_DRIFT = 0.001  # seconds per second the fastest transit time may rise by (clock drift, route changes)
+MAX_PENDING = 256      # messages in one source's jitter buffer; beyond that, the oldest are applied right away
+INBOX_SIZE = 4096      # datagrams waiting for the control thread
+MAX_DATAGRAM = 65536
+RECEIVE_BUFFER_BYTES = 1 << 20
+
+# /luna/controller controls. Sticks and buttons go to the same on_* handlers as the PS4 controller's events;
+# the triggers and R1 move the jaw and eyelids at the source's priority.
+STICKS = {"left_x": "on_L3_right", "left_y": "on_L3_down", "right_x": "on_R3_right", "right_y": "on_R3_down"}
+BUTTONS = {
+    "triangle": ("on_triangle_press", "on_triangle_release"),
+    "square": ("on_square_press", "on_square_release"),
+    "circle": ("on_circle_press", "on_circle_release"),
+    "x": ("on_x_press", "on_x_release"),
+    "share": ("on_share_press", "on_share_release"),
+    "L1": ("on_L1_press", "on_L1_release")
+}
+TRIGGERS = ["L2", "R2", "R1"]
+# Options + an arrow enters a calibration mode and the PlayStation button saves it; only the PS4 controller may
+CALIBRATION_CONTROLS = ["options", "playstation", "up", "down", "left", "right"]
+CONTROLS = list(STICKS) + list(BUTTONS) + TRIGGERS
+# The value each control goes back to when a source is released
+REST_VALUES = {**{control: 0 for control in CONTROLS}, "L2": INPUT_MIN, "R2": INPUT_MIN}
+
+
+#### OSC ####
+
+def _osc_string(text):
+    data = text.encode() + b"\0"
+    return data + bytes(-len(data) % 4)
+
+
+def _read_osc_string(data, offset):
+    end = data.index(b"\0", offset)
+    return data[offset:end].decode(), offset + ((end - offset) // 4 + 1) * 4
+
+
+def encode_message(address, type_tags, *args):
+    """One OSC message; type_tags as in OSC (e.g. ",idsf"), for i, h, f, d and s arguments"""
+    parts = [_osc_string(address), _osc_string(type_tags)]
+    for tag, arg in zip(type_tags[1:], args):
+        parts.append(_osc_string(arg) if tag == "s" else struct.pack(ARGUMENT_FORMATS[tag], arg))
+    return b"".join(parts)
+
+
+def encode_bundle(messages, timetag=1):
+    """Encoded messages batched into one OSC bundle (timetag 1 is "immediately")"""
+    return BUNDLE_TAG + struct.pack(">Q", timetag) + b"".join(struct.pack(">i", len(message)) + message
+                                                              for message in messages)
+
+
+def decode_packet(data):
+    """[(address, [arguments])] of an OSC message or bundle (nested bundles flattened, timetags ignored).
+    Raises ValueError or struct.error if it is malformed."""
+    if data.startswith(BUNDLE_TAG):
+        messages = []
+        offset = len(BUNDLE_TAG) + 8
+        while offset < len(data):
+            (size,) = struct.unpack_from(">i", data, offset)
+            offset += 4
+            if not 0 < size <= len(data) - offset:
+                raise ValueError("truncated bundle")
+            messages += decode_packet(data[offset:offset + size])
+            offset += size
+        return messages
+    address, offset = _read_osc_string(data, 0)
+    type_tags, offset = _read_osc_string(data, offset)
+    if not type_tags.startswith(","):
+        raise ValueError("no type tags")
+    args = []
+    for tag in type_tags[1:]:
+        if tag == "s":
+            arg, offset = _read_osc_string(data, offset)
+        elif tag in ARGUMENT_FORMATS:
+            (arg,) = struct.unpack_from(ARGUMENT_FORMATS[tag], data, offset)
+            offset += struct.calcsize(ARGUMENT_FORMATS[tag])
+        elif tag in "TF":
+            arg = tag == "T"
+        else:
+            raise ValueError(f"unsupported OSC type '{tag}'")
+        args.append(arg)
+    return [(address, args)]
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _unwrap(sequence, reference):
+    """A 32-bit sequence number as the integer closest to reference"""
+    half = SEQUENCE_MODULUS // 2
+    return reference + (sequence - reference + half) % SEQUENCE_MODULUS - half
+
+
+def validate_remote_settings(settings):
+    """Raise ValueError if remote_control settings (as in calibration.json) are not usable"""
+    if not settings.get("jitter_buffer_seconds", 0) >= 0:
+        raise ValueError("jitter_buffer_seconds must not be negative")
+    if not settings.get("hold_seconds", 1) > 0:
+        raise ValueError("hold_seconds must be positive")
+    if not isinstance(settings.get("bind_address", ""), str):
+        raise ValueError("bind_address must be an IP address")
+    allowed_senders = settings.get("allowed_senders", [])
+    if not isinstance(allowed_senders, list) or not all(isinstance(host, str) for host in allowed_senders):
+        raise ValueError("allowed_senders must be a list of IP addresses")
+    for host, priority in settings.get("priorities", {}).items():
+        if priority not in PRIORITY_NAMES:
+            raise ValueError(f"priorities: {host}: must be one of {PRIORITY_NAMES}")
+
+
+#### REMOTE CONTROL ####
+
+class RemoteSource:
+    """One sender: its jitter buffer and sequence state, and what it is holding"""
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.pending = []            # heap of (sequence, play time, arrival, address, args)
+        self.newest_sequence = None  # unwrapped, of any message received
+        self.last_sequence = None    # unwrapped, of the last message applied
+        self.transit = None          # smallest recent arrival - send time
+        self.last_arrival = None
+        self.frame = {}              # servo name -> value, of the frames applied since the last flush
+        self.targets = {}            # servo name -> value, for servos outside the arbiter
+        self.posted = set()          # arbitrated servos with an intent at this source's priority
+        self.held = {}               # controls away from their rest value -> value
+
+
+class RemoteControl:
+    """Remote sources of a LunaController. Datagrams are decoded by receive(), on the receiving thread (or event
+    loop); everything else happens on the control thread: dispatch() applies the messages that are due, at the
+    start of a frame, and write_inputs() stages the sources' servo targets."""
+    def __init__(self, controller):
+        self.controller = controller
+        self.clock = controller.clock
+        self.jitter_buffer_seconds = 0.0
+        self.hold_seconds = 0.5
+        self.priorities = {}
+        self.bind_address = "127.0.0.1"
+        self.allowed_senders = frozenset(["127.0.0.1"])
+        self.sources = {}
+        self.inbox = collections.deque(maxlen=INBOX_SIZE)
+        self.port = None
+        self._socket = None
+        self.timecode = None  # the TimecodeFollower that /luna/timecode messages go to (None: they are ignored)
+
+        # Counters
+        self.datagrams = 0
+        self.messages = 0
+        self.applied = 0
+        self.stale = 0       # older than a message already applied
+        self.overflowed = 0  # applied ahead of time, because the source's jitter buffer was full
+        self.dropped = 0     # datagrams the control thread didn't get to before the inbox filled up
+        self.malformed = 0
+        self.unknown = 0     # unknown addresses, servos and controls
+        self.refused = 0     # datagrams from senders that aren't allowed, and calibration controls
+        self.timeouts = 0
+        self.timecodes = 0
+        self._refused_hosts = set()
+
+    def configure(self, settings):
+        """Apply remote_control settings; sources that are connected are released, and get their (possibly new)
+        priority with their next message. A new bind_address takes effect the next time it is started."""
+        self.jitter_buffer_seconds = settings["jitter_buffer_seconds"]
+        self.hold_seconds = settings["hold_seconds"]
+        self.bind_address = settings["bind_address"]
+        self.allowed_senders = frozenset(settings["allowed_senders"])
+        self.priorities = {host: PRIORITY_NAMES.index(name) for host, name in settings["priorities"].items()}
+        now = self.clock()
+        for source in self.sources.values():
+            self.apply_message(source, RELEASE_ADDRESS, [], now)
+        self.sources = {}
+
+    def start(self, port, host=None):
+        """Receive datagrams on port (of host; None: bind_address) in a background thread; returns the port (the one
+        picked, for port 0)"""
+        host = self.bind_address if host is None else host
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_BYTES)
+        except OSError:
+            pass
+        receiver.bind((host, port))
+        receiver.settimeout(0.5)
+        self._socket = receiver
+        self.port = receiver.getsockname()[1]
+        threading.Thread(target=self._serve, args=(receiver,), daemon=True).start()
+        log.info(f"Remote control listening on UDP port {self.port}", extra=fields(host=host))
+        return self.port
+
+    def stop(self):
+        receiver, self._socket = self._socket, None
+        if receiver is not None:
+            receiver.close()
+
+    def _serve(self, receiver):
+        while self._socket is receiver:
+            try:
+                data, sender = receiver.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.receive(data, sender)
+
+    def receive(self, data, sender):
+        """Decode one datagram and queue it for the control thread. Thread-safe."""
+        arrival = self.clock()
+        latency_arrival = self.controller.latency.clock()
+        self.datagrams += 1
+        if not self.allows(sender[0]):
+            self.refused += 1
+            if sender[0] not in self._refused_hosts:
+                self._refused_hosts.add(sender[0])
+                log.warning("Remote datagram from a sender that isn't allowed", extra=fields(host=sender[0]))
+            return
+        try:
+            messages = decode_packet(data)
+        except (ValueError, struct.error) as err:
+            self.malformed += 1
+            log.debug(f"Malformed datagram from {sender}: {err}")
+            return
+        if len(self.inbox) == self.inbox.maxlen:
+            self.dropped += 1
+        self.inbox.append((sender, arrival, latency_arrival, messages))
+
+    def allows(self, host):
+        """Whether datagrams from host (an IP address) are accepted"""
+        allowed_senders = self.allowed_senders
+        return "*" in allowed_senders or host in allowed_senders
+
+    def dispatch(self):
+        """Buffer newly received messages, apply the ones that are due, and release sources that went quiet.
+        Control thread only."""
+        while self.inbox:
+            sender, arrival, latency_arrival, messages = self.inbox.popleft()
+            source = self.sources.get(sender)
+            if source is None:
+                source = self.sources[sender] = self._new_source(sender)
+                # (so that a source whose messages are all unknown or malformed still times out)
+                source.last_arrival = arrival
+            for address, args in messages:
+                self._buffer(source, address, args, arrival, latency_arrival)
+
+        now = self.clock()
+        for sender, source in list(self.sources.items()):
+            while source.pending and source.pending[0][1] <= now:
+                self._apply(source, *heapq.heappop(source.pending))
+            self._flush_frame(source)
+            if not source.pending and now - source.last_arrival > self.hold_seconds:
+                self.apply_message(source, RELEASE_ADDRESS, [], now)
+                del self.sources[sender]
+                self.timeouts += 1
+                log.info("Remote source timed out", extra=fields(source=source.name))
+
+    def write_inputs(self, servo_map):
+        """Stage every source's targets for servos outside the arbiter (the highest priority source's last, so
+        they win)"""
+        for source in sorted(self.sources.values(), key=lambda source: source.priority):
+            for name, value in source.targets.items():
+                servo_map.set_input(name, value)
+
+    def release(self, source):
+        """Let go of everything source holds: its controls, jaw and eyelid intents, and servo targets"""
+        for control in list(source.held):
+            self._set_control(source, control, REST_VALUES[control])
+        for name in source.posted:
+            self.controller.actuators.release(name, source.priority)
+        source.posted.clear()
+        source.frame.clear()
+        source.targets.clear()
+
+    def replay_source(self, name, priority):
+        """A new source that is only fed through apply_message (by session_recorder.SessionPlayer), and doesn't
+        time out; it replaces any earlier one of that name"""
+        source = RemoteSource(name, priority)
+        source.last_arrival = math.inf
+        self.sources[name] = source
+        return source
+
+    def _new_source(self, sender):
+        host, port = sender[:2]
+        priority = self.priorities.get(host, self.priorities.get("*", PRIORITY_REMOTE))
+        source = RemoteSource(f"{host}:{port}", priority)
+        log.info("Remote source connected", extra=fields(source=source.name, priority=PRIORITY_NAMES[priority]))
+        return source
+
+    def _buffer(self, source, address, args, arrival, latency_arrival):
+        self.messages += 1
+        is_timecode = address == TIMECODE_ADDRESS
+        if address not in (FRAME_ADDRESS, CONTROLLER_ADDRESS, RELEASE_ADDRESS) and \
+                not (is_timecode and self.timecode is not None):
+            self.unknown += 1
+            return
+        pairs = args[2:]
+        if is_timecode:
+            valid = len(args) == 3 and all(_is_number(arg) for arg in args)
+        else:
+            valid = len(args) >= 2 and _is_number(args[0]) and _is_number(args[1]) and not len(pairs) % 2 and \
+                all(isinstance(name, str) and _is_number(value) for name, value in zip(pairs[::2], pairs[1::2]))
+        if not valid:
+            self.malformed += 1
+            return
+        reference = int(args[0]) if source.newest_sequence is None else source.newest_sequence
+        sequence = _unwrap(int(args[0]), reference)
+        source.newest_sequence = max(reference, sequence)
+        if source.last_sequence is not None and sequence <= source.last_sequence:
+            self.stale += 1
+            return
+
+        # The fastest transit lately (in the sender's and our clocks), which rises slowly again after a fast one
+        transit = arrival - args[1]
+        if source.transit is None:
+            source.transit = transit
+        else:
+            source.transit = min(transit, source.transit + TRANSIT_DRIFT * (arrival - source.last_arrival))
+        source.last_arrival = arrival
+        self.controller.latency.record("remote_jitter", transit - source.transit)
+        if is_timecode:
+            # When the sender was at that position, on our clock (as far as the fastest transit tells)
+            self.timecode.observe(args[2], args[1] + source.transit)
+            self.timecodes += 1
+            return
+
+        play_time = args[1] + source.transit + self.jitter_buffer_seconds
+        heapq.heappush(source.pending, (sequence, play_time, latency_arrival, address, args))
+        while len(source.pending) > MAX_PENDING:
+            self.overflowed += 1
+            self._apply(source, *heapq.heappop(source.pending))
+
+    def _apply(self, source, sequence, play_time, latency_arrival, address, args):
+        if source.last_sequence is not None and sequence <= source.last_sequence:
+            # A duplicate of one that was still in the buffer
+            self.stale += 1
+            return
+        source.last_sequence = sequence
+        self.apply_message(source, address, args[2:], play_time)
+        self.applied += 1
+        self.controller.latency.since("remote_to_tick", latency_arrival)
+        self.controller.latency.mark("remote", latency_arrival)
+
+    def apply_message(self, source, address, pairs, due):
+        """Act on one of source's messages (name and value pairs), which was due at due (on this clock; later than now
+        if it is applied ahead of time). Every remote change to the controller goes through here, so that sessions
+        record it (see session_recorder.py). Control thread only."""
+        if address == FRAME_ADDRESS:
+            # Only the newest of several frames that are due at once needs to be mapped and posted
+            source.frame.update(zip(pairs[::2], pairs[1::2]))
+        elif address == CONTROLLER_ADDRESS:
+            self._flush_frame(source)
+            for control, value in zip(pairs[::2], pairs[1::2]):
+                self._set_control(source, control, value)
+        else:
+            self.release(source)
+
+    def _flush_frame(self, source):
+        for name, value in source.frame.items():
+            self._set_target(source, name, value)
+        source.frame.clear()
+
+    def _set_target(self, source, name, value):
+        controller = self.controller
+        if name in controller.actuators:
+            controller.actuators.post(name, source.priority, controller.servo_map.angle(name, value))
+            source.posted.add(name)
+        elif name in controller.servo_map.index:
+            source.targets[name] = value
+        else:
+            self.unknown += 1
+
+    def _set_control(self, source, control, value):
+        controller = self.controller
+        if control in STICKS:
+            getattr(controller, STICKS[control])(int(value))
+        elif control in BUTTONS:
+            press, release = BUTTONS[control]
+            getattr(controller, press if value else release)()
+        elif control == "L2":
+            if value > INPUT_MIN:
+                controller.press_jaw(value, source.priority)
+            else:
+                controller.release_jaw(source.priority)
+        elif control == "R2":
+            if value > INPUT_MIN:
+                controller.press_eyelids(value, source.priority)
+            else:
+                controller.release_eyelids(source.priority)
+        elif control == "R1":
+            if value:
+                controller.raise_eyelids(source.priority)
+            else:
+                controller.release_eyelids(source.priority)
+        elif control in CALIBRATION_CONTROLS:
+            self.refused += 1
+            return
+        else:
+            self.unknown += 1
+            return
+        if value == REST_VALUES[control]:
+            source.held.pop(control, None)
+        else:
+            source.held[control] = value
+
+    def stats(self):
+        return {"sources": len(self.sources), "datagrams": self.datagrams, "messages": self.messages,
+                "applied": self.applied, "stale": self.stale, "overflowed": self.overflowed, "dropped": self.dropped,
+                "malformed": self.malformed, "unknown": self.unknown, "refused": self.refused,
+                "timeouts": self.timeouts, "timecodes": self.timecodes}
+
+
+#### CLIENT ####
+
+class RemoteClient:
+    """Sends /luna/... messages to a RemoteControl, numbering and timestamping them"""
+    def __init__(self, host="127.0.0.1", port=9000, clock=time.monotonic):
+        self.address = (host, port)
+        self.clock = clock
+        self.sequence = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def message(self, address, values=None):
+        """One encoded message, with the next sequence number; values is {name: value}"""
+        pairs = list(values.items()) if values else []
+        args = [(self.sequence + 2**31) % SEQUENCE_MODULUS - 2**31, float(self.clock())]
+        for name, value in pairs:
+            args += [name, float(value)]
+        self.sequence += 1
+        return encode_message(address, ",id" + "sf" * len(pairs), *args)
+
+    def send(self, *messages):
+        """Send encoded messages, batched into one bundle if there are several"""
+        self.socket.sendto(messages[0] if len(messages) == 1 else encode_bundle(messages), self.address)
+
+    def send_frame(self, targets):
+        self.send(self.message(FRAME_ADDRESS, targets))
+
+    def send_controls(self, controls):
+        self.send(self.message(CONTROLLER_ADDRESS, controls))
+
+    def release(self):
+        self.send(self.message(RELEASE_ADDRESS))
+
+    def send_timecode(self, position):
+        """The position (seconds) of the video Luna's show follows"""
+        args = [(self.sequence + 2**31) % SEQUENCE_MODULUS - 2**31, float(self.clock()), float(position)]
+        self.sequence += 1
+        self.send(encode_message(TIMECODE_ADDRESS, ",idd", *args))
+
+    def close(self):
+        self.socket.close()
+
+
+def benchmark(frames=20000, rate=120.0, seconds=3.0, jitter_buffer_seconds=0.02):
+    """Send frames of every servo over loopback into a LunaController on simulated servo boards (ticking at
+    60 Hz): first at rate Hz for seconds, for latency, then as fast as possible, for throughput"""
+    from hardware import NullMicrophone, SimulatedServoBoards
+    from luna_control import LunaController, PWM_FREQUENCY
+    controller = LunaController(SimulatedServoBoards(PWM_FREQUENCY), microphone=NullMicrophone(),
+                                start_update_thread=False, interface="/dev/input/js0", connecting_using_ds4drv=False)
+    controller.remote.configure({**controller.remote_control_settings, "jitter_buffer_seconds": jitter_buffer_seconds})
+    client = RemoteClient("127.0.0.1", controller.remote.start(0, "127.0.0.1"))
+    names = list(controller.servo_info)
+    running = True
+
+    def run_frames():
+        while running:
+            controller.update_servos_tick(controller.update_scheduler.wait())
+    frame_thread = threading.Thread(target=run_frames, daemon=True)
+    frame_thread.start()
+
+    def targets(i):
+        return {name: 30000 * math.sin(0.05 * i + k) for k, name in enumerate(names)}
+
+    def wait_for(datagrams, timeout=2.0):
+        deadline = time.perf_counter() + timeout
+        while controller.remote.datagrams < datagrams and time.perf_counter() < deadline:
+            time.sleep(0.001)
+
+    def report(stage):
+        stats = controller.latency.snapshot().get(stage, {})
+        return f"p50 {1000 * stats.get('p50', 0):.3f} ms  p99 {1000 * stats.get('p99', 0):.3f} ms"
+
+    # Latency, at a show-control rate
+    results = {}
+    n_frames = int(rate * seconds)
+    next_send = time.perf_counter()
+    for i in range(n_frames):
+        time.sleep(max(0.0, next_send - time.perf_counter()))
+        client.send_frame(targets(i))
+        next_send += 1 / rate
+    wait_for(n_frames)
+    time.sleep(jitter_buffer_seconds + 2 / PWM_FREQUENCY)
+    snapshot = controller.latency.snapshot()
+    print(f"Latency: {n_frames} frames of {len(names)} servos at {rate:g} Hz, "
+          f"{1000 * jitter_buffer_seconds:g} ms jitter buffer, {PWM_FREQUENCY} Hz frames")
+    for stage in ["remote_jitter", "remote_to_tick", "remote_to_i2c", "tick"]:
+        print(f"  {stage + ':':16}{report(stage)}")
+        results[stage] = snapshot.get(stage, {})
+
+    # Throughput, as fast as the client can send
+    for histogram in controller.latency.histograms.values():
+        histogram.reset()
+    received = controller.remote.datagrams
+    start = time.perf_counter()
+    for i in range(frames):
+        client.send_frame(targets(i))
+    send_seconds = time.perf_counter() - start
+    wait_for(received + frames)
+    receive_seconds = time.perf_counter() - start
+    time.sleep(jitter_buffer_seconds + 2 / PWM_FREQUENCY)
+    running = False
+    frame_thread.join()
+    controller.remote.stop()
+    client.close()
+    stats = controller.remote.stats()
+    lost = received + frames - controller.remote.datagrams
+    print(f"Throughput: {frames} frames sent in {send_seconds:.3f} s ({frames / send_seconds:.0f}/s), "
+          f"received in {receive_seconds:.3f} s ({(frames - lost) / receive_seconds:.0f}/s), {lost} lost")
+    print(f"  tick under load: {report('tick')}")
+    print(f"  {stats}")
+    results.update(sent_per_second=frames / send_seconds, received_per_second=(frames - lost) / receive_seconds,
+                   lost=lost, remote=stats)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remote control endpoint benchmark, or send values to Luna")
+    parser.add_argument("--send", metavar="HOST:PORT", help="send one message to a running luna_control.py")
+    parser.add_argument("--controller", action="store_true",
+                        help="send the values as controller controls (e.g. L2=20000 triangle=1), not servo targets")
+    parser.add_argument("values", nargs="*", metavar="NAME=VALUE", help="servo (or control) values to send")
+    parser.add_argument("--frames", type=int, default=20000, help="frames for the throughput benchmark")
+    parser.add_argument("--rate", type=float, default=120.0, help="frames per second for the latency benchmark")
+    parser.add_argument("--jitter-buffer", type=float, default=0.02, help="jitter buffer seconds for the benchmark")
+    args = parser.parse_args()
+    if args.send is None:
+        benchmark(args.frames, args.rate, jitter_buffer_seconds=args.jitter_buffer)
+        return
+    host, port = args.send.rsplit(":", 1)
+    values = {name: float(value) for name, value in (pair.split("=", 1) for pair in args.values)}
+    client = RemoteClient(host, int(port), clock=time.time)
+    client.send(client.message(CONTROLLER_ADDRESS if args.controller else FRAME_ADDRESS, values))
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
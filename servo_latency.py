@@ -0,0 +1,109 @@
+"""Measure a servo's command-to-motion latency from a recorded session, instead of guessing it.
+
+The mic hears the servo move (the motor whine, and the jaw or eyelids hitting their stops), so a session
+recorded with the mic next to Luna has both the commands and the sound of the motion in it:
+
+    1. In a quiet room, start recording:   python luna_control.py --record latency.lunalog
+    2. Snap L2 all the way in and out (for the jaw), or press and release R1 (for the eyelids),
+       about 10 times, a second or two apart. Then stop the program.
+    3. Measure:                            python servo_latency.py latency.lunalog --servo jaw
+       Add --write to store the result as the servo's latency_seconds in calibration.json.
+
+Each command is matched to the first mic chunk after it that is threshold_db louder than the chunks just before
+it. Mic levels are recorded when a chunk has been processed, so half a chunk is subtracted to estimate when the
+sound started, and half an update period, since controller events wait that long on average for the next
+update tick (lip sync playback doesn't, it samples the track at the tick).
+"""
+import argparse, json, os
+import numpy as np
+from calibration_store import atomic_write_text
+from session_recorder import SessionPlayer, RECORD_EVENT, RECORD_MIC
+
+
+# The controller events that move each servo, as (press handler, release handler)
+SERVO_COMMANDS = {
+    "jaw": ("on_L2_press", "on_L2_release"),
+    "eyelids": ("on_R1_press", "on_R1_release")
+}
+SERVO_NAMES = {"jaw": ["jaw"], "eyelids": ["right_eyelid", "left_eyelid"]}
+
+
+def find_commands(player, servo="jaw"):
+    """Times of the commands that started a move: the first press (past half travel, for triggers) and each release"""
+    press_name, release_name = SERVO_COMMANDS[servo]
+    press_code = player.handler_names.index(press_name)
+    release_code = player.handler_names.index(release_name)
+    commands = []
+    pressed = False
+    for t, kind, code, value in player.records:
+        if kind != RECORD_EVENT:
+            continue
+        if code == press_code and not pressed and (np.isnan(value) or value >= 0):
+            pressed = True
+            commands.append(t)
+        elif code == release_code and pressed:
+            pressed = False
+            commands.append(t)
+    return np.array(commands)
+
+
+def measure_latency(player, servo="jaw", threshold_db=6.0, baseline_seconds=0.3, max_latency=0.5,
+                    chunk_seconds=512 / 44100, update_period=1 / 60):
+    """Command-to-motion latency of each command, in seconds (nan where no motion was heard)"""
+    mic = np.array([(t, value) for t, kind, _, value in player.records if kind == RECORD_MIC]).reshape(-1, 2)
+    mic_times, mic_levels = mic[:, 0], mic[:, 1]
+    latencies = []
+    for command_time in find_commands(player, servo):
+        before = mic_levels[(mic_times >= command_time - baseline_seconds) & (mic_times < command_time)]
+        after = np.flatnonzero((mic_times > command_time) & (mic_times <= command_time + max_latency))
+        if len(before) == 0 or len(after) == 0:
+            latencies.append(np.nan)
+            continue
+        loud = after[mic_levels[after] > np.median(before) + threshold_db]
+        if len(loud) == 0:
+            latencies.append(np.nan)
+            continue
+        latencies.append(mic_times[loud[0]] - command_time - chunk_seconds / 2 - update_period / 2)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure servo command-to-motion latency from a recorded session")
+    parser.add_argument("session_log")
+    parser.add_argument("--servo", choices=sorted(SERVO_COMMANDS), default="jaw")
+    parser.add_argument("--threshold-db", type=float, default=6.0,
+                        help="how much louder than just before the command the servo must sound (default 6 dB)")
+    parser.add_argument("--calibration", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "calibration.json"))
+    parser.add_argument("--write", action="store_true", help="store the median as latency_seconds in the calibration file")
+    args = parser.parse_args()
+
+    with open(args.calibration) as calibration_file:
+        calibration_data = json.load(calibration_file)
+    audio_input_settings = calibration_data.get("audio_input_settings", {"chunk": 512, "rate": 44100})
+    from luna_control import PWM_FREQUENCY
+
+    player = SessionPlayer(args.session_log)
+    latencies = measure_latency(player, args.servo, args.threshold_db,
+                                chunk_seconds=audio_input_settings["chunk"] / audio_input_settings["rate"],
+                                update_period=1 / PWM_FREQUENCY)
+    heard = latencies[~np.isnan(latencies)]
+    print(f"{len(latencies)} commands, motion heard after {len(heard)}")
+    if len(heard) == 0:
+        print("\033[1m\033[33mNo servo motion found. Record closer to the servo, or lower --threshold-db.\033[0m")
+        return 1
+    print(f"  latency median {1000 * np.median(heard):.1f} ms, p10 {1000 * np.percentile(heard, 10):.1f} ms, "
+          f"p90 {1000 * np.percentile(heard, 90):.1f} ms")
+    latency = round(max(0.0, float(np.median(heard))), 3)
+    if args.write:
+        for servo_name in SERVO_NAMES[args.servo]:
+            calibration_data["servo_mapping"][servo_name]["latency_seconds"] = latency
+        # Atomically, as a running luna_control.py may be watching the file (see calibration_store.py)
+        atomic_write_text(args.calibration, json.dumps(calibration_data, indent=2))
+        print(f"Saved latency_seconds = {latency} for {', '.join(SERVO_NAMES[args.servo])}")
+    else:
+        print(f"Suggested latency_seconds for {args.servo}: {latency} (use --write to save it)")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
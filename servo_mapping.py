@@ -0,0 +1,84 @@
+"""Calibration compiled into per-servo affine coefficients, so controller input maps to servo angles without
+dictionary lookups or slope/intercept math on every tick.
+
+Controller input is in "controller input" units (-32767 to 32767). Servos calibrated with center_angle and
+angle_span map that range onto center +/- span/2 (in the direction given by CENTER_SPAN_DIRECTIONS), clamped to
+the servo's range (and to min_angle from below, if set). Servos calibrated with min_angle and max_angle map
+-32767 to min_angle and 32767 to max_angle, clamped between the two.
+"""
+import numpy as np
+from servo_output import output_indices
+
+
+INPUT_MIN = -32767
+INPUT_MAX = 32767
+
+# +1: -32767 -> center - span/2 and 32767 -> center + span/2;  -1: the reverse
+CENTER_SPAN_DIRECTIONS = {
+    "left_eye_horizontal": 1,
+    "left_eye_vertical": 1,
+    "right_eye_horizontal": 1,
+    "right_eye_vertical": -1,
+    "neck_horizontal": -1,
+    "neck_vertical": -1,
+    "tail": 1
+}
+
+
+class CompiledServoMap:
+    """Per-servo slope, intercept and clamp bounds as NumPy arrays, indexed in servo_info order.
+
+    Inputs for a frame are staged with set_input(); write() maps every staged input in one vectorized
+    operation and stages the angles into a ServoFrameWriter. Servos without a staged input are left alone.
+    """
+    def __init__(self, servo_info, actuation_range=180):
+        self.actuation_range = actuation_range
+        self.compile(servo_info)
+
+    def compile(self, servo_info):
+        names = list(servo_info.keys())
+        n = len(names)
+        slope = np.zeros(n)
+        intercept = np.zeros(n)
+        clamp_min = np.zeros(n)
+        clamp_max = np.full(n, float(self.actuation_range))
+        for i, name in enumerate(names):
+            info = servo_info[name]
+            if info.get("center_angle") is not None and info.get("angle_span") is not None:
+                half_span = CENTER_SPAN_DIRECTIONS.get(name, 1) * info["angle_span"] / 2
+                out_min, out_max = info["center_angle"] - half_span, info["center_angle"] + half_span
+                if info.get("min_angle") is not None:
+                    clamp_min[i] = info["min_angle"]
+            else:
+                out_min, out_max = info["min_angle"], info["max_angle"]
+                clamp_min[i] = min(out_min, out_max)
+                clamp_max[i] = max(out_min, out_max)
+            slope[i] = (out_max - out_min) / (INPUT_MAX - INPUT_MIN)
+            intercept[i] = out_min - slope[i] * INPUT_MIN
+
+        # Swap in all at once, so other threads never see a half-compiled map
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        indices = output_indices(servo_info)
+        self.channels = np.array([indices[name] for name in names], dtype=np.intp)
+        self.slope, self.intercept, self.clamp_min, self.clamp_max = slope, intercept, clamp_min, clamp_max
+        self.inputs = np.full(n, np.nan)
+
+    def angle(self, name, value) -> float:
+        """Angle for one servo (for inputs that arrive outside of the update tick, e.g. jaw and eyelids)"""
+        i = self.index[name]
+        return float(min(max(self.slope[i] * value + self.intercept[i], self.clamp_min[i]), self.clamp_max[i]))
+
+    def set_input(self, name, value):
+        self.inputs[self.index[name]] = value
+
+    def angles(self, inputs):
+        """Angles for a whole vector of inputs (one per servo)"""
+        return np.clip(self.slope * inputs + self.intercept, self.clamp_min, self.clamp_max)
+
+    def write(self, servo_output):
+        """Map the staged inputs and stage the resulting angles into servo_output; clears the staged inputs"""
+        inputs = self.inputs
+        staged = ~np.isnan(inputs)
+        servo_output.set_angles(self.channels[staged], self.angles(inputs)[staged])
+        inputs.fill(np.nan)
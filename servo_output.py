@@ -0,0 +1,351 @@
+"""Frame-batched servo output for the PCA9685.
+
+Instead of one I2C transaction per `servo.angle = ...` assignment, servo angles are staged into a frame, and
+flush() (called once per control loop tick) converts the frame to the PCA9685's 12-bit register values, skips
+channels whose registers would not change, and writes each run of contiguous changed channels as a single
+auto-increment block write.
+
+Servos can be spread over several PCA9685 boards, on several I2C buses ("bus" and "address" in a servo_mapping
+entry, next to its "channel"). MultiBoardFrameWriter keeps one frame for all of them, NUM_CHANNELS outputs per
+board (see output_indices()), and writes each bus from its own worker thread, so the buses are written in parallel.
+"""
+import threading, time
+import numpy as np
+
+
+LED0_ON_L = 0x06         # First PWM register; each channel has 4 (ON_L, ON_H, OFF_L, OFF_H)
+FULL_OFF = 0x1000        # OFF register value for "fully off" (servo disabled)
+NUM_CHANNELS = 16
+DEFAULT_BUS = 1          # /dev/i2c-1: the Raspberry Pi's I2C pins (board.SCL, board.SDA)
+DEFAULT_ADDRESS = 0x40   # a PCA9685 with no address jumpers soldered
+
+
+def servo_board(info):
+    """(bus, address) of the board a servo_mapping entry is on (the address may also be a string, like "0x41")"""
+    address = info.get("address", DEFAULT_ADDRESS)
+    return info.get("bus", DEFAULT_BUS), int(address, 0) if isinstance(address, str) else address
+
+
+def board_layout(servo_info):
+    """The boards that servo_info uses, in output order"""
+    return sorted({servo_board(info) for info in servo_info.values()})
+
+
+def output_indices(servo_info):
+    """{servo name: index into the output frame}: NUM_CHANNELS per board, boards in board_layout() order"""
+    layout = board_layout(servo_info)
+    return {name: layout.index(servo_board(info)) * NUM_CHANNELS + info["channel"] for name, info in servo_info.items()}
+
+
+class ServoFrameWriter:
+    """Stages servo angles per channel, and writes the changed ones to the PCA9685 once per frame.
+
+    Angle to pulse width conversion matches adafruit_motor.servo.Servo, so servos end up in exactly
+    the same positions as before. The PCA9685 must have register auto-increment enabled, which
+    adafruit_pca9685 does when its frequency is set.
+    """
+    def __init__(self, i2c_device, frequency: float, actuation_range=180, min_pulse=750, max_pulse=2250):
+        self.i2c_device = i2c_device
+        self.frequency = frequency
+        self.actuation_range = actuation_range
+        # Same math as adafruit_motor.servo._BaseServo.set_pulse_width_range (16-bit duty cycle)
+        self._min_duty = int((min_pulse * frequency) / 1000000 * 0xFFFF)
+        self._duty_range = int((max_pulse * frequency) / 1000000 * 0xFFFF - self._min_duty)
+
+        self.angles = np.full(NUM_CHANNELS, np.nan)          # staged target angle per channel (nan: disabled)
+        self.registers = np.full(NUM_CHANNELS, -1, dtype=np.int32)  # OFF register value last written (-1: unknown)
+        self._buffer = bytearray(1 + 4 * NUM_CHANNELS)
+        self.abandoned = False  # replaced by another writer; it writes nothing more (see abandon())
+
+        # Counters
+        self.frames = 0
+        self.transactions = 0
+        self.bytes_written = 0
+        self._rate_timestamp = time.monotonic()
+        self._rate_counts = (0, 0, 0)
+
+    def channel(self, index: int) -> "FrameServo":
+        return FrameServo(self, index)
+
+    def set_angle(self, channel: int, angle):
+        if angle is None:
+            self.angles[channel] = np.nan
+            return
+        if angle < 0 or angle > self.actuation_range:
+            raise ValueError("Angle out of range")
+        self.angles[channel] = angle
+
+    def set_angles(self, channels, angles):
+        """Stage several channels at once (angles must already be within the actuation range)"""
+        self.angles[channels] = angles
+
+    def get_angle(self, channel: int):
+        angle = self.angles[channel]
+        return None if np.isnan(angle) else float(angle)
+
+    def quantize(self, angles):
+        """Convert angles (degrees) to the 12-bit OFF register value of each channel"""
+        disabled = np.isnan(angles)
+        fractions = np.where(disabled, 0, angles) / self.actuation_range
+        duty_cycle = self._min_duty + (fractions * self._duty_range).astype(np.int32)
+        off = duty_cycle >> 4
+        off[duty_cycle < 0x0010] = FULL_OFF
+        off[disabled] = FULL_OFF
+        return off
+
+    def flush(self):
+        """Write every channel whose register value changed since the last flush. Returns the number of I2C transactions."""
+        off = self.quantize(self.angles.copy())
+        changed = np.flatnonzero(off != self.registers)
+        self.frames += 1
+        if len(changed) == 0:
+            return 0
+
+        # Split the changed channels into runs of consecutive channel numbers
+        run_breaks = np.flatnonzero(np.diff(changed) != 1) + 1
+        transactions = 0
+        for run in np.split(changed, run_breaks):
+            if self.abandoned:
+                # A stalled thread that got out of a hung write: the board is someone else's now
+                break
+            buffer = self._buffer
+            buffer[0] = LED0_ON_L + 4 * int(run[0])
+            i = 1
+            for channel in run:
+                value = int(off[channel])
+                buffer[i] = 0                   # ON_L
+                buffer[i + 1] = 0               # ON_H
+                buffer[i + 2] = value & 0xFF    # OFF_L
+                buffer[i + 3] = value >> 8      # OFF_H
+                i += 4
+            with self.i2c_device as device:
+                device.write(buffer, end=i)
+            self.registers[run] = off[run]
+            transactions += 1
+            self.bytes_written += i
+        self.transactions += transactions
+        return transactions
+
+    def invalidate(self):
+        """Forget what was last written, so the next flush rewrites every channel (e.g. after a chip reset)"""
+        self.registers.fill(-1)
+
+    def abandon(self):
+        """Stop writing, even from a flush() that is in progress (between two I2C writes)"""
+        self.abandoned = True
+
+    def rates(self):
+        """Frames, I2C transactions and bytes per second since the last call"""
+        now = time.monotonic()
+        elapsed = max(now - self._rate_timestamp, 1e-9)
+        frames, transactions, bytes_written = self._rate_counts
+        rates = {
+            "frames_per_second": (self.frames - frames) / elapsed,
+            "transactions_per_second": (self.transactions - transactions) / elapsed,
+            "bytes_per_second": (self.bytes_written - bytes_written) / elapsed
+        }
+        self._rate_timestamp = now
+        self._rate_counts = (self.frames, self.transactions, self.bytes_written)
+        return rates
+
+
+class BusWorker:
+    """Thread that writes the frames of the boards on one I2C bus, when told to by MultiBoardFrameWriter.flush()"""
+    def __init__(self, bus, writers):
+        self.bus = bus
+        self.writers = writers
+        self.busy_seconds = 0.0  # time spent writing the last frame
+        self._start = threading.Semaphore(0)
+        self._done = threading.Semaphore(0)
+        self._result = (0, None)
+        self._stopped = False
+        threading.Thread(target=self._run, name=f"i2c-{bus}", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._start.acquire()
+            if self._stopped:
+                return
+            start = time.perf_counter()
+            transactions = 0
+            try:
+                for writer in self.writers:
+                    transactions += writer.flush()
+                self._result = (transactions, None)
+            except Exception as err:
+                self._result = (transactions, err)
+            self.busy_seconds = time.perf_counter() - start
+            self._done.release()
+
+    def start(self):
+        self._start.release()
+
+    def stop(self):
+        """Exit the thread (after the frame it is writing, if any)"""
+        self._stopped = True
+        self._start.release()
+
+    def wait(self):
+        """(transactions, exception or None) of the frame started last"""
+        self._done.acquire()
+        return self._result
+
+
+class MultiBoardFrameWriter(ServoFrameWriter):
+    """A ServoFrameWriter for several PCA9685 boards: indices (as from output_indices()) address a channel of a board.
+
+    flush() commits the staged frame to every board at once: each bus's worker writes its boards' changed channels,
+    all buses in parallel, and flush() returns when every bus is done. So a frame is never written while the next
+    one is being staged, and no board gets ahead of another by a frame. A failed write is raised from flush() after
+    all buses have finished, and whatever didn't get written is written by the next flush(). With all boards on one
+    bus, the boards are written on the calling thread instead.
+    """
+    def __init__(self, boards, frequency: float, actuation_range=180):
+        """boards: {(bus, address): i2c_device}, in output order"""
+        self.frequency = frequency
+        self.actuation_range = actuation_range
+        self.boards = list(boards)
+        self.angles = np.full(NUM_CHANNELS * len(self.boards), np.nan)
+        self.writers = []
+        self.workers = []
+        self._start_writers(list(boards.values()))
+
+        # Counters
+        self.frames = 0
+        self.transactions = 0
+        self.bytes_written = 0
+        self._rate_timestamp = time.monotonic()
+        self._rate_counts = (0, 0, 0)
+
+    def _start_writers(self, i2c_devices):
+        """New board writers and bus workers, in place of the current ones (which are abandoned)"""
+        self.close()
+        writers = [ServoFrameWriter(i2c_device, self.frequency, self.actuation_range) for i2c_device in i2c_devices]
+        for i, writer in enumerate(writers):
+            # Each board's writer stages straight into its part of the frame
+            writer.angles = self.angles[i * NUM_CHANNELS:(i + 1) * NUM_CHANNELS]
+        for old_writer, writer in zip(self.writers, writers):
+            writer.frames, writer.transactions, writer.bytes_written = \
+                old_writer.frames, old_writer.transactions, old_writer.bytes_written
+            old_writer.abandon()
+        buses = {}
+        for (bus, _), writer in zip(self.boards, writers):
+            buses.setdefault(bus, []).append(writer)
+        self.workers = [BusWorker(bus, bus_writers) for bus, bus_writers in buses.items()] if len(buses) > 1 else []
+        self.writers = writers
+
+    def set_devices(self, boards=None):
+        """Switch to new writers and workers, on re-initialized boards ({(bus, address): i2c_device}, the same
+        boards) if given. A thread stalled in a hung write can't stop the next frames from being written, and once
+        its write returns, writes nothing more (so it never writes at the same time as the thread that took over).
+        The next flush() rewrites every channel."""
+        if boards is None:
+            i2c_devices = [writer.i2c_device for writer in self.writers]
+        else:
+            i2c_devices = [boards[board] for board in self.boards]
+        self._start_writers(i2c_devices)
+
+    def flush(self):
+        """Write the frame to every board. Returns the number of I2C transactions."""
+        self.frames += 1
+        workers = self.workers  # (set_devices() may replace them meanwhile, if this thread stalls)
+        if workers:
+            for worker in workers:
+                worker.start()
+            transactions, error = 0, None
+            for worker in workers:
+                worker_transactions, worker_error = worker.wait()
+                transactions += worker_transactions
+                error = error or worker_error
+        else:
+            transactions, error = 0, None
+            try:
+                for writer in self.writers:
+                    transactions += writer.flush()
+            except Exception as err:
+                error = err
+        self.transactions += transactions
+        self.bytes_written = sum(writer.bytes_written for writer in self.writers)
+        if error is not None:
+            raise error
+        return transactions
+
+    def close(self):
+        """Stop the bus worker threads (the writer can't be flushed anymore)"""
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+    def invalidate(self):
+        for writer in self.writers:
+            writer.invalidate()
+
+    def bus_stats(self):
+        """Time each bus worker spent writing the last frame"""
+        return {f"i2c_{worker.bus}_seconds": worker.busy_seconds for worker in self.workers}
+
+
+class FrameServo:
+    """Drop-in for adafruit_motor.servo.Servo's `angle` property, staging into a ServoFrameWriter.
+
+    Reading `angle` returns the staged value instead of reading the PWM register back over I2C.
+    """
+    def __init__(self, writer: ServoFrameWriter, channel: int):
+        self.writer = writer
+        self.channel = channel
+
+    @property
+    def angle(self):
+        return self.writer.get_angle(self.channel)
+
+    @angle.setter
+    def angle(self, new_angle):
+        self.writer.set_angle(self.channel, new_angle)
+
+
+class CountingI2CDevice:
+    """Stand-in for adafruit_bus_device.i2c_device.I2CDevice that only counts transactions"""
+    def __init__(self):
+        self.transactions = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def write(self, buf, *, start=0, end=None):
+        end = len(buf) if end is None else end
+        self.transactions += 1
+        self.bytes_written += end - start + 1  # +1 for the address byte
+
+
+def compare_bus_traffic(ticks=2000, tick_seconds=0.005):
+    """Drive 10 servos the way update_servos does (eyes and neck smoothed, tail swaying, jaw and eyelids
+    mostly still) and count I2C transactions with per-assignment writes vs. the frame writer."""
+    channels = range(10)
+    per_assignment_bus = CountingI2CDevice()
+    frame_bus = CountingI2CDevice()
+    writer = ServoFrameWriter(frame_bus, frequency=60)
+    for tick in range(ticks):
+        t = tick * tick_seconds
+        angles = {
+            0: 100 + 20 * np.tanh(t - 2), 1: 111, 2: 80 + 20 * np.tanh(t - 2), 3: 90,
+            4: 70, 5: 75, 6: 80 if (tick // 40) % 3 else 60,
+            7: 106, 8: 90 + 10 * np.sin(t * 2 * np.pi / 6.5), 9: 90 + 67.5 * np.sin(t * 2 * np.pi / 5.0)
+        }
+        for channel in channels:
+            # adafruit_motor writes the 4 PWM registers of a channel in its own transaction
+            per_assignment_bus.write(bytearray(5))
+            writer.set_angle(channel, angles[channel])
+        writer.flush()
+    print(f"{ticks} ticks, {len(channels)} servos")
+    print(f"  per-assignment writes: {per_assignment_bus.transactions} transactions, {per_assignment_bus.bytes_written} bytes")
+    print(f"  frame writer:          {frame_bus.transactions} transactions, {frame_bus.bytes_written} bytes")
+    assert frame_bus.transactions < per_assignment_bus.transactions
+    return per_assignment_bus, frame_bus
+
+
+if __name__ == "__main__":
+    compare_bus_traffic()
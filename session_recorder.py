@@ -0,0 +1,259 @@
+"""Record live operator sessions (controller events, mic levels, remote control messages and timecode) to a compact
+binary log, and replay them.
+
+Recording, from luna_control.py:
+    python luna_control.py --record sessions/show.lunalog
+
+Replay through LunaController on simulated hardware, writing the resulting servo angles to a CSV file:
+    python session_recorder.py sessions/show.lunalog -o angles.csv            (as fast as possible)
+    python session_recorder.py sessions/show.lunalog -o angles.csv --speed 1  (in real time)
+
+Log layout (little-endian):
+    header:  8 bytes magic b"LUNASES2", float64 wall-clock start time, uint32 random seed,
+             uint32 length + JSON {"handlers": [handler names], "remote": [remote control and servo names]}
+             (record codes index into them; b"LUNASES1" logs have just the JSON list of handler names)
+    records: float64 seconds since start, uint8 kind, uint8 code, float32 value
+"""
+import argparse, json, math, random, struct, threading, time
+from remote_control import CONTROLLER_ADDRESS, CONTROLS, FRAME_ADDRESS, RELEASE_ADDRESS
+
+
+SESSION_MAGIC = b"LUNASES2"
+SESSION_MAGICS = (b"LUNASES1", SESSION_MAGIC)
+HEADER_FORMAT = "<8sdII"
+RECORD_FORMAT = "<dBBf"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+FLUSH_SECONDS = 1.0  # at most this much of a session is lost if the process dies without closing the log
+
+RECORD_EVENT = 0           # controller on_* handler call; code is the handler, value is its argument (nan if none)
+RECORD_MIC = 1             # mic level of one audio chunk, in dba
+RECORD_REMOTE_SOURCE = 2   # a new remote control source; code is its number, value its ActuatorArbiter priority
+RECORD_REMOTE_VALUE = 3    # a name and value pair of the next RECORD_REMOTE_MESSAGE; code is the (remote) name
+RECORD_REMOTE_MESSAGE = 4  # a remote control message, when it was due; code is the source, value the address
+RECORD_TIMECODE = 5        # a timecode observation: TIMECODE_LAG, TIMECODE_SECONDS and TIMECODE_FRACTION records
+
+# RECORD_REMOTE_MESSAGE addresses (value)
+REMOTE_ADDRESSES = [FRAME_ADDRESS, CONTROLLER_ADDRESS, RELEASE_ADDRESS]
+# RECORD_TIMECODE codes. The position is split in two, as float32 alone would round it by up to 0.1 ms an hour in.
+TIMECODE_LAG = 0       # how long before this record the timecode was at the position (seconds)
+TIMECODE_SECONDS = 1   # whole seconds of the position
+TIMECODE_FRACTION = 2  # the rest of the position; completes the observation
+
+# Every controller handler that pyPS4Controller dispatches to
+HANDLER_NAMES = [
+    "on_x_press", "on_x_release", "on_triangle_press", "on_triangle_release", "on_circle_press", "on_circle_release",
+    "on_square_press", "on_square_release", "on_L1_press", "on_L1_release", "on_L2_press", "on_L2_release",
+    "on_R1_press", "on_R1_release", "on_R2_press", "on_R2_release", "on_up_arrow_press", "on_up_down_arrow_release",
+    "on_down_arrow_press", "on_left_arrow_press", "on_left_right_arrow_release", "on_right_arrow_press",
+    "on_L3_up", "on_L3_down", "on_L3_left", "on_L3_right", "on_L3_y_at_rest", "on_L3_x_at_rest", "on_L3_press",
+    "on_L3_release", "on_R3_up", "on_R3_down", "on_R3_left", "on_R3_right", "on_R3_y_at_rest", "on_R3_x_at_rest",
+    "on_R3_press", "on_R3_release", "on_options_press", "on_options_release", "on_share_press", "on_share_release",
+    "on_playstation_button_press", "on_playstation_button_release"
+]
+
+
+class SessionRecorder:
+    """Wraps a LunaController's on_* handlers and handle_mic_level, its remote control's apply_message and its
+    timecode follower's observe, logging each call with a timestamp"""
+    def __init__(self, filepath, seed: int = 0):
+        self.filepath = filepath
+        self.seed = seed
+        self.clock = time.monotonic
+        self.start_time = None
+        self.records = 0
+        self.remote_names = []
+        self._remote_codes = {}
+        self._remote_sources = {}  # RemoteSource -> its number in the log
+        self._applying_remote = threading.local()
+        self._file = None
+        self._next_flush = 0.0
+        self._lock = threading.Lock()
+
+    def attach(self, controller):
+        self.clock = controller.clock
+        self.start_time = self.clock()
+        self._file = open(self.filepath, 'wb')
+        self.remote_names = CONTROLS + [name for name in controller.servo_info if name not in CONTROLS]
+        self._remote_codes = {name: code for code, name in enumerate(self.remote_names)}
+        names = json.dumps({"handlers": HANDLER_NAMES, "remote": self.remote_names}).encode()
+        self._file.write(struct.pack(HEADER_FORMAT, SESSION_MAGIC, time.time(), self.seed, len(names)))
+        self._file.write(names)
+
+        for code, handler_name in enumerate(HANDLER_NAMES):
+            setattr(controller, handler_name, self._wrap(getattr(controller, handler_name), RECORD_EVENT, code))
+        controller.handle_mic_level = self._wrap(controller.handle_mic_level, RECORD_MIC, 0)
+        controller.remote.apply_message = self._wrap_remote(controller.remote.apply_message)
+        controller.timecode.observe = self._wrap_timecode(controller.timecode.observe)
+
+    def _wrap(self, handler, kind, code):
+        def recorded_handler(*args):
+            # Handlers that a remote message calls are replayed by that message
+            if not getattr(self._applying_remote, "active", False):
+                self.write(kind, code, args[0] if args else math.nan)
+            return handler(*args)
+        return recorded_handler
+
+    def _wrap_remote(self, apply_message):
+        def recorded_apply_message(source, address, pairs, due):
+            timestamp = min(due, self.clock()) - self.start_time
+            records = []
+            number = self._remote_sources.get(source)
+            if number is None:
+                number = self._remote_sources[source] = len(self._remote_sources) % 256
+                records.append((timestamp, RECORD_REMOTE_SOURCE, number, source.priority))
+            for name, value in zip(pairs[::2], pairs[1::2]):
+                if name in self._remote_codes:  # (any others do nothing)
+                    records.append((timestamp, RECORD_REMOTE_VALUE, self._remote_codes[name], value))
+            records.append((timestamp, RECORD_REMOTE_MESSAGE, number, REMOTE_ADDRESSES.index(address)))
+            self.write_records(records)
+            self._applying_remote.active = True
+            try:
+                return apply_message(source, address, pairs, due)
+            finally:
+                self._applying_remote.active = False
+        return recorded_apply_message
+
+    def _wrap_timecode(self, observe):
+        def recorded_observe(position, local_time):
+            now = self.clock()
+            seconds = math.floor(position)
+            self.write_records([(now - self.start_time, RECORD_TIMECODE, TIMECODE_LAG, now - local_time),
+                                (now - self.start_time, RECORD_TIMECODE, TIMECODE_SECONDS, seconds),
+                                (now - self.start_time, RECORD_TIMECODE, TIMECODE_FRACTION, position - seconds)])
+            return observe(position, local_time)
+        return recorded_observe
+
+    def write(self, kind, code, value):
+        self.write_records([(self.clock() - self.start_time, kind, code, value)])
+
+    def write_records(self, records):
+        """Write (seconds since start, kind, code, value) records, together; the file is flushed every
+        FLUSH_SECONDS"""
+        data = b"".join(struct.pack(RECORD_FORMAT, *record) for record in records)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(data)
+                self.records += len(records)
+                now = time.monotonic()
+                if now >= self._next_flush:
+                    self._file.flush()
+                    self._next_flush = now + FLUSH_SECONDS
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class SessionPlayer:
+    """Feeds a recorded session back into a controller; pump(controller, now) works like hardware.ScriptedJoystick's"""
+    def __init__(self, filepath):
+        with open(filepath, 'rb') as log_file:
+            data = log_file.read()
+        magic, self.wall_start_time, self.seed, names_length = struct.unpack_from(HEADER_FORMAT, data)
+        if magic not in SESSION_MAGICS:
+            raise ValueError(f"{filepath} is not a session log")
+        offset = struct.calcsize(HEADER_FORMAT)
+        names = json.loads(data[offset:offset + names_length])
+        if magic == SESSION_MAGIC:
+            self.handler_names, self.remote_names = names["handlers"], names["remote"]
+        else:
+            self.handler_names, self.remote_names = names, []
+        offset += names_length
+        n_records = (len(data) - offset) // RECORD_SIZE
+        self.records = list(struct.iter_unpack(RECORD_FORMAT, data[offset:offset + n_records * RECORD_SIZE]))
+        self.index = 0
+        self.start_time = None
+        self.remote_sources = {}  # number in the log -> RemoteSource
+        self._remote_pairs = []
+        self._timecode = [0.0, 0.0]  # lag, whole seconds
+
+    @property
+    def duration(self) -> float:
+        return self.records[-1][0] if self.records else 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.index >= len(self.records)
+
+    def pump(self, controller, now: float):
+        if self.start_time is None:
+            self.start_time = now
+        dispatched = 0
+        while self.index < len(self.records) and self.records[self.index][0] <= now - self.start_time:
+            timestamp, kind, code, value = self.records[self.index]
+            if kind == RECORD_MIC:
+                controller.handle_mic_level(value)
+            elif kind == RECORD_REMOTE_SOURCE:
+                self.remote_sources[code] = controller.remote.replay_source(f"replay:{code}", int(value))
+            elif kind == RECORD_REMOTE_VALUE:
+                self._remote_pairs += [self.remote_names[code], value]
+            elif kind == RECORD_REMOTE_MESSAGE:
+                controller.remote.apply_message(self.remote_sources[code], REMOTE_ADDRESSES[int(value)],
+                                                self._remote_pairs, self.start_time + timestamp)
+                self._remote_pairs = []
+            elif kind == RECORD_TIMECODE:
+                if code == TIMECODE_FRACTION:
+                    lag, seconds = self._timecode
+                    controller.timecode.observe(seconds + value, self.start_time + timestamp - lag)
+                else:
+                    self._timecode[code] = value
+            else:
+                handler = getattr(controller, self.handler_names[code])
+                handler() if math.isnan(value) else handler(int(value))
+            self.index += 1
+            dispatched += 1
+        return dispatched
+
+
+def replay(filepath, output_filepath=None, speed=0.0, extra_seconds=1.0):
+    """Replay a session log through LunaController on simulated hardware.
+    speed=0 runs as fast as possible on a virtual clock; speed=1 runs in real time."""
+    from hardware import NullMicrophone, SimulatedClock, SimulatedServoBoards
+    from luna_control import LunaController, PWM_FREQUENCY, run_simulation
+
+    player = SessionPlayer(filepath)
+    random.seed(player.seed)
+    clock = SimulatedClock()
+    sleep = clock.sleep
+    if speed > 0:
+        def sleep(seconds):
+            # Advance the virtual clock, pacing it against the wall clock
+            time.sleep(max(0, seconds) / speed)
+            clock.sleep(seconds)
+    controller = LunaController(SimulatedServoBoards(PWM_FREQUENCY), microphone=NullMicrophone(), clock=clock, sleep=sleep, start_update_thread=False,
+                                interface="/dev/input/js0", connecting_using_ds4drv=False)
+
+    servo_names = list(controller.servos.keys())
+    output_file = open(output_filepath, 'w') if output_filepath else None
+    if output_file:
+        output_file.write(",".join(["t"] + servo_names) + "\n")
+    start = clock()
+
+    def write_angles():
+        if output_file:
+            angles = [f"{controller.servos[name].angle:.3f}" for name in servo_names]
+            output_file.write(",".join([f"{clock() - start:.4f}"] + angles) + "\n")
+
+    wall_start = time.perf_counter()
+    ticks = run_simulation(controller, clock, player.duration + extra_seconds, joystick=player, on_tick=write_angles)
+    elapsed = time.perf_counter() - wall_start
+    if output_file:
+        output_file.close()
+    print(f"Replayed {len(player.records)} records, {player.duration:.1f} s session ({ticks} ticks) in {elapsed:.2f} s "
+          f"({(player.duration + extra_seconds) / elapsed:.1f}x real time)")
+    return ticks, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded Luna session through the controller")
+    parser.add_argument("session_log")
+    parser.add_argument("-o", "--output", help="CSV file for the resulting servo angles, one row per tick")
+    parser.add_argument("--speed", type=float, default=0, help="1 for real time; 0 (default) for as fast as possible")
+    args = parser.parse_args()
+    replay(args.session_log, args.output, args.speed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Shows: pre-recorded, time-coded tracks for any of Luna's servos, played back from the controller.
+
+A show is written as JSON, in "controller input" units (-32767 to 32767, as the sticks and triggers), one track
+of [t, value] keyframes per servo name in SERVO_MAPPING (each value holds until the next keyframe):
+    {"tracks": {"jaw": [[0, -32767], [0.4, 12000], ...], "tail": [[0, 0], [1.5, 32767], ...], ...}}
+A plain list of keyframes (like lunas_story_jaw_values.json) is a show with only a jaw track.
+
+Shows go in the shows/ folder. Each is compiled into a binary .lunashow file next to it (rebuilt whenever the
+JSON is newer), which is memory-mapped when the show is opened: only the header is read, and the keyframes are
+paged in from disk as playback reaches them. ShowLibrary only lists file names until a show is selected, and
+keeps at most a couple of shows open, so startup time and memory don't grow with the number or length of shows.
+
+.lunashow layout (little-endian):
+    header:   8 bytes magic b"LUNASHW1", uint32 track count, uint32 reserved
+    tracks:   per track, 24 bytes servo name (UTF-8, zero padded), uint64 keyframe count, uint64 data offset
+    data:     per track, at its offset (8-byte aligned): count x float64 timestamps, then count x int16 values
+"""
+import json, logging, mmap, os, struct, threading
+import numpy as np
+from lip_sync_track import LipSyncTrack
+
+
+log = logging.getLogger(__name__)
+
+SHOW_MAGIC = b"LUNASHW1"
+SHOW_HEADER_FORMAT = "<8sII"
+TRACK_HEADER_FORMAT = "<24sQQ"
+SHOW_EXTENSION = ".lunashow"
+OPEN_SHOWS = 2  # the show playing and the next one
+
+
+def compiled_show_path(json_filepath):
+    return os.path.splitext(json_filepath)[0] + SHOW_EXTENSION
+
+
+def write_show(tracks, filepath):
+    """Write {servo_name: [[t, value], ...]} to a .lunashow file (atomically, via a temp file)"""
+    header_size = struct.calcsize(SHOW_HEADER_FORMAT) + len(tracks) * struct.calcsize(TRACK_HEADER_FORMAT)
+    offset = header_size
+    headers = [struct.pack(SHOW_HEADER_FORMAT, SHOW_MAGIC, len(tracks), 0)]
+    data = []
+    for name, keyframes in tracks.items():
+        keyframes = np.asarray(keyframes, dtype=np.float64).reshape(-1, 2)
+        timestamps = np.ascontiguousarray(keyframes[:, 0], dtype='<f8')
+        values = np.ascontiguousarray(np.clip(np.rint(keyframes[:, 1]), -32767, 32767), dtype='<i2')
+        offset += -offset % 8
+        headers.append(struct.pack(TRACK_HEADER_FORMAT, name.encode()[:24], len(timestamps), offset))
+        data.append((offset, timestamps.tobytes() + values.tobytes()))
+        offset += len(data[-1][1])
+    temp_filepath = filepath + ".tmp"
+    with open(temp_filepath, 'wb') as show_file:
+        show_file.write(b"".join(headers))
+        for offset, track_bytes in data:
+            show_file.write(bytes(offset - show_file.tell()))
+            show_file.write(track_bytes)
+    os.replace(temp_filepath, filepath)
+
+
+def compile_show(json_filepath):
+    """Compile a show's JSON into its .lunashow file, if that is missing or older; returns the .lunashow path"""
+    show_filepath = compiled_show_path(json_filepath)
+    if os.path.exists(show_filepath) and os.path.getmtime(show_filepath) >= os.path.getmtime(json_filepath):
+        return show_filepath
+    with open(json_filepath) as json_file:
+        show_data = json.load(json_file)
+    tracks = {"jaw": show_data} if isinstance(show_data, list) else show_data["tracks"]
+    write_show(tracks, show_filepath)
+    return show_filepath
+
+
+class Show:
+    """An opened show: one LipSyncTrack per servo, backed by a memory map of its .lunashow file"""
+    def __init__(self, name, tracks, memory_map=None):
+        self.name = name
+        self.tracks = tracks
+        self.memory_map = memory_map
+        self.duration = max((track.duration for track in tracks.values()), default=0.0)
+
+    @classmethod
+    def open(cls, name, filepath):
+        """Open a .lunashow file, or a show's JSON (compiling it first if needed)"""
+        if not filepath.endswith(SHOW_EXTENSION):
+            filepath = compile_show(filepath)
+        with open(filepath, 'rb') as show_file:
+            memory_map = mmap.mmap(show_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, _ = struct.unpack_from(SHOW_HEADER_FORMAT, memory_map)
+        if magic != SHOW_MAGIC:
+            raise ValueError(f"{filepath} is not a show file")
+        tracks = {}
+        position = struct.calcsize(SHOW_HEADER_FORMAT)
+        for _ in range(count):
+            raw_name, n_keyframes, offset = struct.unpack_from(TRACK_HEADER_FORMAT, memory_map, position)
+            position += struct.calcsize(TRACK_HEADER_FORMAT)
+            timestamps = np.frombuffer(memory_map, dtype='<f8', count=n_keyframes, offset=offset)
+            values = np.frombuffer(memory_map, dtype='<i2', count=n_keyframes, offset=offset + 8 * n_keyframes)
+            tracks[raw_name.rstrip(b"\0").decode()] = LipSyncTrack(timestamps, values)
+        return cls(name, tracks, memory_map)
+
+    def shape(self, max_rates):
+        """Work out the slew limited tracks (see LipSyncTrack.slew_limited) for {servo name: max_rate}"""
+        for name, track in self.tracks.items():
+            if max_rates.get(name):
+                track.slew_limited(max_rates[name])
+
+    def prefetch(self):
+        """Ask the OS to read the whole file into memory ahead of playback (in the background where supported)"""
+        if self.memory_map is None:
+            return
+        if hasattr(self.memory_map, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            self.memory_map.madvise(mmap.MADV_WILLNEED)
+        else:
+            # Touch one byte per page
+            sum(memoryview(self.memory_map)[::mmap.PAGESIZE])
+
+
+class ShowLibrary:
+    """The shows in a folder (plus any given by name and path), selectable by index.
+
+    get() opens the selected show (or returns it, if it was already opened by prefetch()); only the most
+    recently used OPEN_SHOWS shows are kept open. max_rates ({servo name: input units per second}) is how fast each
+    servo can follow its track; prefetch() shapes the tracks for it, so playback doesn't have to.
+    """
+    def __init__(self, directory, shows=None):
+        self.directory = directory
+        self.extra_shows = {} if shows is None else dict(shows)
+        self.max_rates = {}
+        self.selected = 0
+        self._open_shows = {}  # by name, least recently used first
+        self._failed = set()  # shows that could not be opened (not retried until the next scan())
+        self._lock = threading.Lock()
+        self.scan()
+
+    def scan(self):
+        """List the shows (by file name only; nothing is opened)"""
+        paths = dict(self.extra_shows)
+        try:
+            entries = sorted(os.scandir(self.directory), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            name, extension = os.path.splitext(entry.name)
+            if extension == ".json" or (extension == SHOW_EXTENSION and name not in paths):
+                paths[name] = entry.path
+        self.paths = {name: path for name, path in paths.items() if os.path.exists(path)}
+        self.names = list(self.paths)
+        self._failed = set()
+        self.selected = min(self.selected, max(len(self.names) - 1, 0))
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def selected_name(self):
+        return self.names[self.selected] if self.names else None
+
+    def step(self, delta=1):
+        """Select the next (or previous, for delta=-1) show, and start loading it; returns its name"""
+        if not self.names:
+            return None
+        self.selected = (self.selected + delta) % len(self.names)
+        self.prefetch(self.selected_name)
+        return self.selected_name
+
+    def get(self, name=None):
+        """The selected show (or the one named), opened; None if there are no shows or it can't be opened"""
+        name = self.selected_name if name is None else name
+        if name is None or name in self._failed:
+            return None
+        with self._lock:
+            show = self._open_shows.pop(name, None)
+            if show is not None:
+                self._open_shows[name] = show
+                return show
+        try:
+            show = Show.open(name, self.paths[name])
+        except (OSError, ValueError, KeyError) as err:
+            log.error(f"Could not open show '{name}': {err}")
+            self._failed.add(name)
+            return None
+        with self._lock:
+            self._open_shows[name] = show
+            while len(self._open_shows) > OPEN_SHOWS:
+                self._open_shows.pop(next(iter(self._open_shows)))
+        return show
+
+    def prefetch(self, name):
+        """Open (compiling if needed), read in and shape a show in a background thread, so that it starts right away"""
+        if name is None:
+            return
+
+        def load():
+            show = self.get(name)
+            if show is not None:
+                show.prefetch()
+                show.shape(self.max_rates)
+        threading.Thread(target=load, daemon=True).start()
@@ -5,7 +5,19 @@ SCRIPT_DIR="$(dirname $0)"
 LOG="$SCRIPT_DIR/monitor.log"
 touch $LOG
 
-# Limit the log size by discarding old log lines on startup
+# PID files: this monitor script, and the luna_control.py process it is running (used by kill_monitor.bash)
+MONITOR_PID_FILE="$SCRIPT_DIR/monitor.pid"
+LUNA_PID_FILE="$SCRIPT_DIR/luna.pid"
+
+# Only one monitor at a time
+if [ -f "$MONITOR_PID_FILE" ] && kill -0 "$(cat "$MONITOR_PID_FILE")" 2>/dev/null; then
+    echo "Monitor script is already running (PID $(cat "$MONITOR_PID_FILE"))"
+    exit 1
+fi
+echo $$ > "$MONITOR_PID_FILE"
+
+# Limit the log size by discarding old log lines on startup (luna_control.py logs to luna.log, which it rotates
+# itself; this log only gets restarts and crash output)
 tail -n5000 $LOG > /tmp/temp.log
 cp /tmp/temp.log $LOG
 rm /tmp/temp.log
@@ -14,9 +26,36 @@ source $SCRIPT_DIR/bin/activate
 
 echo -e "\n\n\e[1m\e[32m$(date)\tStarting Luna Control Monitor script.\n\e[0m" >> $LOG
 
-until python -u $SCRIPT_DIR/luna_control.py >> $LOG 2>> $LOG; do
+# When stopped (kill_monitor.bash), stop the python process too and clean up
+LUNA_PID=""
+stop_monitor() {
+    if [ -n "$LUNA_PID" ]; then
+        kill $LUNA_PID 2>/dev/null
+        wait $LUNA_PID
+    fi
+    rm -f "$MONITOR_PID_FILE" "$LUNA_PID_FILE"
+    echo -e "\n\n\e[1m\e[35m$(date)\tLuna Control Monitor script was stopped.\n\e[0m" >> $LOG
+    exit 0
+}
+trap stop_monitor TERM INT
+
+while true; do
+    python -u $SCRIPT_DIR/luna_control.py --pid-file "$LUNA_PID_FILE" >> $LOG 2>> $LOG &
+    LUNA_PID=$!
+    wait $LUNA_PID
+    STATUS=$?
+    LUNA_PID=""
+    rm -f "$LUNA_PID_FILE"
+    if [ $STATUS -eq 0 ]; then
+        break
+    elif [ $STATUS -eq 75 ]; then
+        # The control loop watchdog gave up on recovering in-process; restart right away
+        echo -e "\n\e[1m\e[33m$(date)\tLuna Controller was restarted by its watchdog.\e[0m" >> $LOG
+        continue
+    fi
     echo -e "\n\e[1m\e[33m$(date)\tLuna Controller program has closed. Restarting...\e[0m" >> $LOG
     sleep 1
 done
- 
+
+rm -f "$MONITOR_PID_FILE"
 echo -e "\n\n\e[1m\e[35m$(date)\tLuna Control Monitor script has exited its monitor loop.\n\e[0m" >> $LOG 
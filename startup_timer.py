@@ -0,0 +1,47 @@
+"""Startup milestones, timed from when the process started, so that restart time can be tracked and reduced.
+
+startup_and_monitor.bash restarts luna_control.py after a crash, and Luna is frozen until the new process has
+its servos moving again. LunaController marks each milestone the first time it is reached:
+    imports             all modules imported (LunaController created)
+    calibration         calibration.json loaded and the servo map compiled
+    first_servo_write   the first frame of servo positions written to the PCA9685
+    mic_started         the audio stream opened (after PyAudio found the mic)
+    audio_live          the first chunk of mic audio processed
+The times are printed once audio is live (or failed to start) and are exported with the latency stats.
+"""
+import os, time
+
+
+def process_start_time(clock=time.perf_counter):
+    """When this process started, on clock's time scale (Linux: from /proc; elsewhere: now)"""
+    try:
+        with open("/proc/self/stat") as stat_file:
+            # Field 22 (counting from 1) is the start time in clock ticks since boot; the command name
+            # (field 2) is in parentheses and may contain spaces
+            start_ticks = int(stat_file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        age = uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        age = 0.0
+    return clock() - max(age, 0.0)
+
+
+class StartupTimer:
+    def __init__(self, start=None, clock=time.perf_counter):
+        self.clock = clock
+        self.start = process_start_time(clock) if start is None else start
+        self.milestones = {}
+        self.reported = False
+
+    def mark(self, milestone):
+        """Record the first time a milestone is reached (later calls are ignored)"""
+        if milestone not in self.milestones:
+            self.milestones[milestone] = self.clock() - self.start
+
+    def stats(self):
+        """Seconds from process start to each milestone reached so far"""
+        return dict(self.milestones)
+
+    def report(self):
+        return "Startup: " + ", ".join(f"{milestone} {seconds:.2f} s" for milestone, seconds in self.milestones.items())
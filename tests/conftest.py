@@ -0,0 +1,28 @@
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from hardware import NullMicrophone, SimulatedClock, SimulatedServoBoards
+from luna_control import PWM_FREQUENCY, LunaController
+
+
+@pytest.fixture
+def clock():
+    return SimulatedClock()
+
+
+@pytest.fixture
+def make_controller():
+    """Builds LunaControllers on simulated hardware, driven by the test (no threads), on the given clock"""
+    def new_controller(clock):
+        return LunaController(SimulatedServoBoards(PWM_FREQUENCY), microphone=NullMicrophone(), clock=clock,
+                              sleep=clock.sleep, start_update_thread=False, interface="/dev/input/js0",
+                              connecting_using_ds4drv=False)
+    return new_controller
+
+
+@pytest.fixture
+def controller(make_controller, clock):
+    """A LunaController on simulated hardware, driven by the test (no threads)"""
+    return make_controller(clock)
@@ -0,0 +1,48 @@
+import random, struct
+from pyPS4Controller.controller import Controller
+from async_runtime import AsyncJoystick
+from session_recorder import HANDLER_NAMES
+
+
+def recording_controller(interface):
+    """A pyPS4Controller Controller whose on_* handlers only note that they were called"""
+    controller = Controller(interface=interface, connecting_using_ds4drv=False)
+    controller.calls = []
+    for name in HANDLER_NAMES:
+        setattr(controller, name, lambda *args, name=name: controller.calls.append((name, args)))
+    return controller
+
+
+def random_events(controller, n, seed=0):
+    rng = random.Random(seed)
+    events = []
+    for _ in range(n):
+        button_type = rng.choice([1, 2])
+        value = rng.choice([0, 1]) if button_type == 1 else rng.choice([0, rng.randint(-32767, 32767)])
+        events.append(struct.pack(controller.event_format, 0, 0, 0, value, button_type, rng.randint(0, 13)))
+    return events
+
+
+def test_dispatch_calls_the_same_handlers_as_listen(tmp_path):
+    interface = str(tmp_path / "js0")
+    listening = recording_controller(interface)
+    events = random_events(listening, 2000)
+    with open(interface, 'wb') as interface_file:
+        interface_file.write(b"".join(events))
+    listening.listen(timeout=1)
+
+    dispatching = recording_controller(interface)
+    joystick = AsyncJoystick(interface)
+    for event in events:
+        joystick.dispatch(dispatching, event)
+    assert joystick.events == len(events)
+    assert len(listening.calls) > 1000
+    assert dispatching.calls == listening.calls
+
+
+def test_dispatch_drives_luna(controller):
+    joystick = AsyncJoystick()
+    joystick.dispatch(controller, struct.pack(controller.event_format, 0, 0, 0, 1, 1, 2))
+    assert controller.triangle_is_pressed
+    joystick.dispatch(controller, struct.pack(controller.event_format, 0, 0, 0, 0, 1, 2))
+    assert not controller.triangle_is_pressed
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from scipy import signal
+from audio_envelope import MultirateEnvelope
+
+
+def response_db(envelope, frequencies):
+    _, response = signal.freqz(envelope.taps, worN=frequencies, fs=envelope.rate)
+    return 20 * np.log10(np.maximum(np.abs(response), 1e-12))
+
+
+@pytest.mark.parametrize("rate", [44100, 48000])
+def test_decimation_filter_stops_aliasing_and_passes_speech(rate):
+    envelope = MultirateEnvelope(rate, 1024)
+    nyquist = envelope.decimated_rate / 2
+    assert np.max(response_db(envelope, np.linspace(nyquist, rate / 2, 2000))) <= -50
+    assert abs(response_db(envelope, [3000.0])[0]) <= 1
@@ -0,0 +1,13 @@
+def test_underruns_count_only_once_audio_has_arrived(controller):
+    # No mic (NullMicrophone): waiting for audio that never comes isn't an underrun
+    ring = controller.audio_ring
+    for _ in range(3):
+        assert not ring.wait(timeout=0)
+    assert ring.underruns == 0
+
+    ring.write(bytes(2 * controller.audio_input_settings["chunk"]))
+    assert ring.wait(timeout=0)
+    assert controller.process_pending_audio() == 1
+    assert not ring.wait(timeout=0)
+    assert ring.stats()["underruns"] == 1
+
@@ -0,0 +1,60 @@
+import copy
+import pytest
+from luna_control import IDLE_ANIMATIONS, PWM_FREQUENCY, SERVO_MAPPING, validate_calibration
+
+
+def calibration(servo_mapping=None, idle_animations=None):
+    return {"servo_mapping": copy.deepcopy(SERVO_MAPPING if servo_mapping is None else servo_mapping),
+            "idle_animations": copy.deepcopy(IDLE_ANIMATIONS if idle_animations is None else idle_animations)}
+
+
+def test_center_angle_needs_angle_span():
+    data = calibration()
+    del data["servo_mapping"]["tail"]["angle_span"]
+    with pytest.raises(ValueError, match="tail: center_angle needs angle_span"):
+        validate_calibration(data)
+
+
+def test_idle_animations_used_by_the_control_loop_are_required():
+    data = calibration()
+    del data["idle_animations"]["blink"]
+    with pytest.raises(ValueError, match="blink"):
+        validate_calibration(data)
+    data = calibration()
+    del data["idle_animations"]["tail"]
+    with pytest.raises(ValueError, match="tail"):
+        validate_calibration(data)
+
+
+def test_defaults_are_valid():
+    validate_calibration(calibration())
+
+
+def test_failed_reload_keeps_the_old_calibration(controller, clock):
+    servo_info = controller.servo_info
+    servo_map = controller.servo_map
+    idle_animations = controller.idle_animations
+    servo_output = controller.servo_output
+    data = calibration()
+    del data["servo_mapping"]["tail"]["angle_span"]
+    # Also on a new board, which has to be opened (and closed again)
+    data["servo_mapping"]["tail"]["address"] = 0x41
+
+    controller.reload_calibration(data)
+
+    assert controller.servo_info is servo_info
+    assert controller.servo_map is servo_map
+    assert controller.idle_animations is idle_animations
+    assert controller.servo_output is servo_output
+    # The control loop keeps running
+    for _ in range(10):
+        clock.sleep(1 / PWM_FREQUENCY)
+        controller.update_servos_tick(1 / PWM_FREQUENCY)
+
+
+def test_reload_applies_a_good_calibration(controller):
+    data = calibration()
+    data["servo_mapping"]["tail"]["center_angle"] = 80
+    controller.reload_calibration(data)
+    assert controller.servo_info["tail"]["center_angle"] == 80
+    assert controller.servo_map.angle("tail", 0) == pytest.approx(80)
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+from audio_envelope import MultirateEnvelope
+from compile_lip_sync import chunk_loudness, load_audio_input_settings
+
+
+def test_loudness_matches_the_live_mic(tmp_path):
+    settings = load_audio_input_settings(str(tmp_path / "no_calibration.json"))
+    rate, chunk = 44100, settings["chunk"]
+    # A 200 Hz tone, gated on and off every 0.25 s, in stereo (only the first channel is the mic's)
+    t = np.arange(2 * rate) / rate
+    tone = (8000 * np.sin(2 * np.pi * 200 * t) * (t % 0.5 < 0.25)).astype('<i2')
+    samples = np.column_stack([tone, np.zeros_like(tone)])
+
+    live = MultirateEnvelope.from_settings({**settings, "rate": rate, "channels": 2})
+    expected = [live.process(samples[i:i + chunk].tobytes()) for i in range(0, len(samples) - chunk + 1, chunk)]
+    assert chunk_loudness(samples, rate, settings).tolist() == expected
+    # And the same from float samples
+    assert chunk_loudness(samples / 2**15, rate, settings) == pytest.approx(expected, abs=0.01)
@@ -0,0 +1,82 @@
+import threading
+from hardware import PCA9685_ADDRESS, SimulatedServoBoards
+from luna_control import PWM_FREQUENCY
+from servo_output import MultiBoardFrameWriter
+
+
+class HangingDevice:
+    """An I2C device whose writes block while hang is set (like a hung bus), recording every write"""
+    def __init__(self):
+        self.writes = []
+        self.hang = threading.Event()
+        self.resume = threading.Event()
+        self.hung = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def write(self, buffer, *, start=0, end=None):
+        if self.hang.is_set():
+            self.hung.set()
+            self.resume.wait(5)
+        self.writes.append((threading.current_thread().name, bytes(buffer[start:end])))
+
+
+def test_stalled_flush_stops_writing_once_replaced():
+    device = HangingDevice()
+    output = MultiBoardFrameWriter({(1, 0x40): device}, frequency=60)
+    output.set_angles([0, 1, 5], [10.0, 20.0, 30.0])
+    output.flush()
+    # Two runs of changed channels, so two writes
+    output.set_angles([0, 5], [15.0, 35.0])
+    device.hang.set()
+    stalled = threading.Thread(target=output.flush, name="stalled")
+    stalled.start()
+    assert device.hung.wait(5)
+
+    # Recovery: new writers on the same board (which rewrite every channel, in one run)
+    output.set_devices()
+    device.hang.clear()
+    writes = len(device.writes)
+    assert output.flush() == 1
+    assert len(device.writes) == writes + 1
+
+    # The stalled write returns: the old writer writes nothing more
+    device.resume.set()
+    stalled.join(5)
+    assert [name for name, _ in device.writes].count("stalled") == 1
+
+
+def test_stalled_update_thread_leaves_the_output_to_its_replacement(controller):
+    controller.update_servos_tick(1 / 60, generation=controller.update_generation)
+    frames = controller.servo_output.frames
+    stalled_generation = controller.update_generation
+    # As recover_control_loop() does when it starts a new update thread
+    controller.recover_control_loop()
+    controller.update_generation += 1
+    controller.update_servos_tick(1 / 60, generation=stalled_generation)
+    assert controller.servo_output.frames == frames
+    controller.update_servos_tick(1 / 60, generation=controller.update_generation)
+    assert controller.servo_output.frames == frames + 1
+
+
+def test_recovery_closes_the_old_buses_without_resetting_the_boards(controller):
+    old_boards = controller.servo_boards
+    old_buses = list(old_boards.buses.values())
+    old_chip = old_buses[0].devices[PCA9685_ADDRESS]
+    controller.update_servos_tick(1 / 60, generation=controller.update_generation)
+    mode1 = old_chip.registers[0]
+
+    new_boards = SimulatedServoBoards(PWM_FREQUENCY)
+    controller.recover_control_loop(new_boards)
+    assert controller.servo_boards is new_boards
+    assert all(i2c.closed for i2c in old_buses)
+    assert old_chip.registers[0] == mode1
+    controller.update_servos_tick(1 / 60, generation=controller.update_generation)
+    assert new_boards.transactions > 0
+
+    new_boards.deinit()
+    assert not new_boards.buses
@@ -0,0 +1,32 @@
+import pytest
+from idle_animation import Animator
+
+
+ANIMATIONS = {
+    "blink": {"channel": "eyelids", "keyframes": [[0, -32767], [0.1, 32767], [0.2, -32767]], "enabled": False},
+    "breath": {"channel": "jaw", "waveform": "sine", "period": 4, "amplitude": 1000, "offset": -30000,
+               "origin": "breath", "enabled": False}
+}
+
+
+def test_value_is_the_rest_value_when_nothing_is_playing():
+    animator = Animator.from_data(ANIMATIONS)
+    assert animator.value("eyelids", 5.0) == -32767
+    assert animator.value("jaw", 5.0) == -30000
+    assert animator.value("tail", 5.0) == 0.0
+
+    animator.start("blink", 5.0)
+    assert animator.value("eyelids", 5.1) == pytest.approx(32767)
+
+
+def test_is_playing_is_false_for_missing_animations():
+    animator = Animator.from_data(ANIMATIONS)
+    assert not animator.is_playing("wag", 0.0)
+    animator.start("blink", 0.0)
+    assert animator.is_playing("blink", 0.1)
+    assert not animator.is_playing("blink", 0.3)
+
+
+def test_idle_jaw_without_a_playing_animation(controller):
+    controller.idle_animations = Animator.from_data(ANIMATIONS)
+    controller.handle_jaw_input(controller.idle_animations.value("jaw", 1.0))
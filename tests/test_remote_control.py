@@ -0,0 +1,155 @@
+import time
+import pytest
+from actuator_arbiter import PRIORITY_CONTROLLER, PRIORITY_LIP_SYNC, PRIORITY_REMOTE
+from remote_control import CONTROLLER_ADDRESS, FRAME_ADDRESS, RemoteClient, encode_message
+
+
+@pytest.fixture
+def clients(clock):
+    """Opens RemoteClients (timestamping with the simulated clock) from a loopback address (e.g. 127.0.0.2) to
+    port, closed after the test"""
+    opened = []
+
+    def open_client(port=9000, host="127.0.0.1"):
+        client = RemoteClient("127.0.0.1", port, clock=clock)
+        client.socket.bind((host, 0))
+        opened.append(client)
+        return client
+    yield open_client
+    for client in opened:
+        client.close()
+
+
+def test_listens_on_loopback_by_default(controller):
+    remote = controller.remote
+    remote.start(0)
+    try:
+        assert remote._socket.getsockname()[0] == "127.0.0.1"
+    finally:
+        remote.stop()
+
+
+def test_senders_not_allowed_are_refused(controller, clients):
+    remote = controller.remote
+    client = clients()
+    remote.configure({**controller.remote_control_settings, "jitter_buffer_seconds": 0.0})
+    remote.receive(client.message(CONTROLLER_ADDRESS, {"triangle": 1}), ("192.168.1.50", 9000))
+    remote.dispatch()
+    assert remote.refused == 1
+    assert not remote.sources
+
+    remote.configure({**controller.remote_control_settings, "jitter_buffer_seconds": 0.0,
+                      "allowed_senders": ["192.168.1.50"]})
+    remote.receive(client.message(CONTROLLER_ADDRESS, {"triangle": 1}), ("192.168.1.50", 9000))
+    remote.dispatch()
+    assert remote.refused == 1
+    assert remote.applied == 1
+
+
+def test_remote_sources_cannot_calibrate_or_save(controller, clients):
+    remote = controller.remote
+    client = clients()
+    remote.configure({**controller.remote_control_settings, "jitter_buffer_seconds": 0.0})
+    remote.receive(client.message(CONTROLLER_ADDRESS, {"options": 1, "right": 1}), ("127.0.0.1", 9000))
+    remote.receive(client.message(CONTROLLER_ADDRESS, {"playstation": 1}), ("127.0.0.1", 9000))
+    remote.dispatch()
+    assert remote.refused == 3
+    assert controller.calibration_mode == -1
+    assert not controller.options_is_pressed
+    assert not controller.playstation_button_is_pressed
+
+
+def test_unknown_messages_do_not_stop_the_control_loop(controller, clients, clock):
+    remote = controller.remote
+    client = clients()
+    remote.receive(client.message("/luna/bogus", {"jaw": 1}), ("127.0.0.1", 9000))
+    remote.receive(encode_message(FRAME_ADDRESS, ",ids", 1, clock(), "jaw"), ("127.0.0.1", 9000))
+    controller.update_servos_tick(controller.update_scheduler.wait())
+    assert remote.unknown == 1
+    assert remote.malformed == 1
+
+    # A source that never sent anything usable still times out
+    clock.now += 1.0
+    controller.update_servos_tick(controller.update_scheduler.wait())
+    assert remote.timeouts == 1
+    assert not remote.sources
+
+
+def send(remote, client, *messages):
+    """Send messages over loopback, one datagram each, and wait until the remote control has received them"""
+    expected = remote.datagrams + len(messages)
+    for message in messages:
+        client.send(message)
+    deadline = time.monotonic() + 5
+    while remote.datagrams < expected and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert remote.datagrams == expected
+
+
+@pytest.fixture
+def remote(controller):
+    remote = controller.remote
+    remote.configure({**controller.remote_control_settings, "jitter_buffer_seconds": 0.02,
+                      "allowed_senders": ["127.0.0.1", "127.0.0.2"],
+                      "priorities": {"127.0.0.2": "lip_sync", "*": "remote"}})
+    remote.start(0)
+    yield remote
+    remote.stop()
+
+
+def test_jitter_buffer_applies_messages_in_order_when_due(remote, clients, clock):
+    client = clients(remote.port)
+    # Message 1 overtook message 0, which was sent 10 ms earlier but took 10 ms longer
+    clock.now = 0.99
+    late = client.message(FRAME_ADDRESS, {"tail": -1000})
+    clock.now = 1.0
+    send(remote, client, client.message(FRAME_ADDRESS, {"tail": 1000}), late)
+
+    clock.now = 1.005
+    remote.dispatch()
+    assert remote.applied == 0
+    source = remote.sources[client.socket.getsockname()]
+
+    # Each is applied 20 ms after it would have arrived over the fastest path (no transit time here)
+    clock.now = 1.0101
+    remote.dispatch()
+    assert remote.applied == 1
+    assert source.targets == {"tail": -1000}
+
+    clock.now = 1.0201
+    remote.dispatch()
+    assert remote.applied == 2
+    assert source.targets == {"tail": 1000}
+
+    # A duplicate of one already applied
+    send(remote, client, late)
+    clock.now = 1.05
+    remote.dispatch()
+    assert remote.stale == 1
+    assert source.targets == {"tail": 1000}
+
+
+def test_sources_post_jaw_targets_at_their_priority(remote, clients, controller, clock):
+    remote.configure({**controller.remote_control_settings, "jitter_buffer_seconds": 0.0,
+                      "allowed_senders": ["127.0.0.1", "127.0.0.2"],
+                      "priorities": {"127.0.0.2": "lip_sync", "*": "remote"}})
+    controller.press_jaw(32767)  # the PS4 controller, below both
+    lip_sync = clients(remote.port, "127.0.0.2")
+    other = clients(remote.port)
+    send(remote, other, other.message(FRAME_ADDRESS, {"jaw": -10000}))
+    send(remote, lip_sync, lip_sync.message(FRAME_ADDRESS, {"jaw": 20000}))
+    remote.dispatch()
+    assert controller.actuators.resolve()["jaw"] == controller.servo_map.angle("jaw", 20000)
+    assert controller.actuators.winner("jaw") == PRIORITY_LIP_SYNC
+
+    # Once the lip sync source lets go, the other one wins
+    remote.release(remote.sources[lip_sync.socket.getsockname()])
+    assert controller.actuators.resolve()["jaw"] == controller.servo_map.angle("jaw", -10000)
+    assert controller.actuators.winner("jaw") == PRIORITY_REMOTE
+
+    # And when it times out too, the PS4 controller
+    clock.now += 1.0
+    remote.dispatch()
+    assert remote.timeouts == 2
+    controller.actuators.resolve()
+    assert controller.actuators.winner("jaw") == PRIORITY_CONTROLLER
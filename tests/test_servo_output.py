@@ -0,0 +1,138 @@
+import threading
+import pytest
+from adafruit_motor.servo import Servo
+from hardware import SimulatedServoBoards
+from luna_control import PWM_FREQUENCY
+from servo_output import LED0_ON_L, MultiBoardFrameWriter, ServoFrameWriter
+
+
+@pytest.fixture
+def board():
+    boards = SimulatedServoBoards(PWM_FREQUENCY)
+    pca = boards(1, 0x40)
+    return pca, boards.buses[1], boards.buses[1].devices[0x40]
+
+
+def test_flush_writes_runs_of_changed_channels(board):
+    pca, bus, chip = board
+    writer = ServoFrameWriter(pca.i2c_device, pca.frequency)
+    # The first frame writes every channel (what the chip holds is unknown), in one block
+    assert writer.flush() == 1
+    assert all(chip.channel_angle(channel) is None for channel in range(16))
+
+    transactions = bus.transactions
+    writer.set_angles([0, 1, 2, 5], [10.0, 20.0, 30.0, 40.0])
+    # Channels 0-2 in one auto-increment block, 5 in another
+    assert writer.flush() == 2
+    assert bus.transactions == transactions + 2
+    for channel, angle in [(0, 10.0), (1, 20.0), (2, 30.0), (5, 40.0)]:
+        assert chip.channel_angle(channel) == pytest.approx(angle, rel=0.01, abs=0.5)
+    assert chip.channel_angle(3) is None
+
+    # Nothing changed: nothing written
+    assert writer.flush() == 0
+    assert bus.transactions == transactions + 2
+
+    # One channel changed: one 4-register write, after the register address
+    bytes_transferred = bus.bytes_transferred
+    writer.set_angle(1, 90.0)
+    assert writer.flush() == 1
+    assert bus.bytes_transferred - bytes_transferred == 1 + 1 + 4  # I2C address, register pointer, registers
+    assert chip.channel_angle(1) == pytest.approx(90.0, rel=0.01, abs=0.5)
+
+
+def test_registers_match_adafruit_servo(board):
+    pca, _, chip = board
+    writer = ServoFrameWriter(pca.i2c_device, pca.frequency)
+    for angle in [0.0, 12.5, 90.0, 137.3, 180.0]:
+        writer.set_angle(0, angle)
+        writer.flush()
+        Servo(pca.channels[15]).angle = angle
+        assert chip.channel_off(0) == chip.channel_off(15)
+    writer.set_angle(0, None)
+    writer.flush()
+    assert chip.registers[LED0_ON_L + 3] & 0x10  # fully off
+
+
+def test_invalidate_rewrites_every_channel(board):
+    pca, bus, chip = board
+    writer = ServoFrameWriter(pca.i2c_device, pca.frequency)
+    writer.set_angles(list(range(16)), [45.0] * 16)
+    writer.flush()
+    chip.registers[LED0_ON_L:LED0_ON_L + 64] = bytes(64)  # e.g. a chip reset
+    writer.invalidate()
+    assert writer.flush() == 1
+    assert all(chip.channel_angle(channel) == pytest.approx(45.0, rel=0.01, abs=0.5) for channel in range(16))
+
+
+class BarrierDevice:
+    """An I2C device whose writes wait at a barrier shared with the other buses' devices, recording the thread"""
+    def __init__(self, barrier, fail=False):
+        self.barrier = barrier
+        self.fail = fail
+        self.threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def write(self, buffer, *, start=0, end=None):
+        self.threads.append(threading.current_thread().name)
+        self.barrier.wait()
+        if self.fail:
+            raise OSError("Remote I/O error")
+
+
+def test_buses_are_written_in_parallel_by_their_workers():
+    # Each write waits until the other bus is writing too, so sequential writes would break the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    devices = {(1, 0x40): BarrierDevice(barrier), (3, 0x40): BarrierDevice(barrier)}
+    output = MultiBoardFrameWriter(devices, frequency=60)
+    assert [worker.bus for worker in output.workers] == [1, 3]
+    output.set_angles([0, 16], [10.0, 20.0])
+    assert output.flush() == 2
+    assert devices[(1, 0x40)].threads == ["i2c-1"]
+    assert devices[(3, 0x40)].threads == ["i2c-3"]
+    assert set(output.bus_stats()) == {"i2c_1_seconds", "i2c_3_seconds"}
+    output.close()
+
+
+def test_boards_on_one_bus_are_written_on_the_calling_thread():
+    barrier = threading.Barrier(1)
+    devices = {(1, 0x40): BarrierDevice(barrier), (1, 0x41): BarrierDevice(barrier)}
+    output = MultiBoardFrameWriter(devices, frequency=60)
+    assert output.workers == []
+    assert output.flush() == 2
+    assert devices[(1, 0x41)].threads == [threading.current_thread().name]
+
+
+def test_a_failed_bus_is_raised_after_the_others_are_written_and_retried():
+    barrier = threading.Barrier(2, timeout=5)
+    devices = {(1, 0x40): BarrierDevice(barrier), (3, 0x40): BarrierDevice(barrier, fail=True)}
+    output = MultiBoardFrameWriter(devices, frequency=60)
+    with pytest.raises(OSError):
+        output.flush()
+    assert len(devices[(1, 0x40)].threads) == 1
+
+    devices[(3, 0x40)].fail = False
+    barrier = devices[(3, 0x40)].barrier = threading.Barrier(1)
+    # Bus 1 is up to date; bus 3 writes the frame it failed to
+    assert output.flush() == 1
+    assert len(devices[(1, 0x40)].threads) == 1
+    output.close()
+
+
+def test_frame_indices_reach_the_boards_on_each_bus():
+    boards = SimulatedServoBoards(PWM_FREQUENCY)
+    layout = [(1, 0x40), (1, 0x41), (3, 0x40)]
+    output = MultiBoardFrameWriter({board: boards(*board).i2c_device for board in layout}, PWM_FREQUENCY)
+    output.set_angles([2, 16 + 7, 32 + 15], [30.0, 60.0, 120.0])
+    transactions = boards.buses[3].transactions
+    output.flush()
+    assert boards.buses[1].devices[0x40].channel_angle(2) == pytest.approx(30.0, rel=0.01, abs=0.5)
+    assert boards.buses[1].devices[0x41].channel_angle(7) == pytest.approx(60.0, rel=0.01, abs=0.5)
+    assert boards.buses[3].devices[0x40].channel_angle(15) == pytest.approx(120.0, rel=0.01, abs=0.5)
+    assert boards.buses[3].transactions == transactions + 1
+    output.close()
@@ -0,0 +1,72 @@
+import random
+import pytest
+from hardware import SimulatedClock
+from luna_control import run_simulation
+from remote_control import CONTROLLER_ADDRESS, FRAME_ADDRESS, RELEASE_ADDRESS, RemoteClient
+from session_recorder import HANDLER_NAMES, RECORD_EVENT, SessionPlayer, SessionRecorder
+
+
+class RemoteScript:
+    """Sends remote messages into the controller (and timecode to its follower) at scripted times"""
+    def __init__(self, clock):
+        self.clock = clock
+        # Only encodes the messages, which are handed to receive() directly, so its socket isn't needed
+        self.client = RemoteClient(clock=clock)
+        self.client.close()
+        self.start_time = None
+        self.events = [
+            (0.2, FRAME_ADDRESS, {"jaw": 20000, "tail": -15000}),
+            (0.4, CONTROLLER_ADDRESS, {"left_x": 25000, "R2": 30000}),
+            (0.7, FRAME_ADDRESS, {"tail": 10000, "neck_vertical": 5000}),
+            (0.9, CONTROLLER_ADDRESS, {"left_x": 0, "R2": -32767}),
+            (1.1, RELEASE_ADDRESS, {}),
+            (1.3, FRAME_ADDRESS, {"jaw": -5000})
+        ]
+
+    def pump(self, controller, now):
+        if self.start_time is None:
+            self.start_time = now
+        while self.events and self.events[0][0] <= now - self.start_time:
+            _, address, values = self.events.pop(0)
+            controller.remote.receive(self.client.message(address, values), ("127.0.0.1", 9000))
+        controller.timecode.observe(3600.0 + now - self.start_time, now - 0.004)
+
+
+def run(make_controller, joystick_for_clock, recorder=None):
+    random.seed(0)
+    clock = SimulatedClock()
+    controller = make_controller(clock)
+    if recorder is not None:
+        recorder.attach(controller)
+    angles = []
+    positions = []
+
+    def on_tick():
+        angles.append([servo.angle for servo in controller.servos.values()])
+        positions.append(controller.timecode.position(clock()))
+    run_simulation(controller, clock, 2.0, joystick=joystick_for_clock(clock), on_tick=on_tick)
+    return controller, angles, positions
+
+
+def test_replay_reproduces_remote_control_and_timecode(make_controller, tmp_path):
+    filepath = str(tmp_path / "remote.lunalog")
+    recorder = SessionRecorder(filepath)
+    live, live_angles, live_positions = run(make_controller, RemoteScript, recorder)
+    recorder.close()
+    assert live.remote.applied == 6
+
+    replayed, replay_angles, replay_positions = run(make_controller, lambda clock: SessionPlayer(filepath))
+    assert replayed.remote.datagrams == 0
+    assert replay_angles == live_angles
+    # (float32 rounds the timecode's lag)
+    assert replay_positions == pytest.approx(live_positions, abs=1e-6)
+
+
+def test_records_reach_the_file_before_it_is_closed(controller, tmp_path):
+    filepath = str(tmp_path / "open.lunalog")
+    recorder = SessionRecorder(filepath)
+    recorder.attach(controller)
+    controller.on_triangle_press()
+    # As if the process died here (e.g. the watchdog's os._exit)
+    assert SessionPlayer(filepath).records[0][1:3] == (RECORD_EVENT, HANDLER_NAMES.index("on_triangle_press"))
+    recorder.close()
@@ -0,0 +1,27 @@
+import time
+from lip_sync_track import LipSyncTrack
+
+
+def test_prefetch_shapes_tracks_before_playback(controller, monkeypatch):
+    controller.set_calibration_value("jaw", "max_speed", 300)
+    max_rate = controller.shows.max_rates["jaw"]
+    track = controller.shows.get().tracks["jaw"]
+    deadline = time.monotonic() + 5
+    while max_rate not in track._slew_limited and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    def shape_on_tick(self, max_rate):
+        raise AssertionError("shaped during playback")
+    monkeypatch.setattr(LipSyncTrack, "_shape", shape_on_tick)
+    controller.start_show()
+    assert controller.show_active
+    assert controller.show_tracks["jaw"] is track.slew_limited(max_rate)
+    assert controller.show_tracks["jaw"] is not track
+
+
+def test_slew_limited_keeps_moves_within_max_rate():
+    track = LipSyncTrack.from_keyframes([[0, -32767], [0.5, 32767], [0.6, -32767], [2.0, 0]])
+    shaped = track.slew_limited(100000)
+    assert shaped is track.slew_limited(100000)
+    steps = abs(shaped.values[1:].astype(float) - shaped.values[:-1])
+    assert all(steps <= 100000 * (track.timestamps[1:] - track.timestamps[:-1]) + 1)
@@ -0,0 +1,364 @@
+"""Show playback locked to an external timecode, so shows start and stay in sync with a video without anyone
+having to press Triangle at exactly the right moment.
+
+Timecode sources (calibration.json "timecode", defaults in TIMECODE in luna_control.py):
+    "udp"   /luna/timecode messages on the remote control port (see remote_control.py): ,idd with a sequence
+            number, the send time and the video's position in seconds, a few times a second or more
+    "mtc"   MIDI Time Code (quarter frame and full frame messages) from the MIDI input midi_port (None: the first
+            one); needs mido and python-rtmidi
+    "ltc"   SMPTE linear timecode on channel ltc_channel of the audio input (audio_input_settings "channels" must
+            include it), at fps frames per second
+Every source reports (position, local time) observations to a TimecodeFollower, a phase-locked playback clock:
+    - Between observations, its position advances at its current rate (1.0 plus a correction).
+    - Small errors are never jumped over: a PI loop runs the clock slightly fast or slow (by at most
+      max_rate_error) until the error is gone, and its integral term takes up a steady clock drift.
+    - Errors larger than seek_seconds (the video was started, or jumped) re-base the clock at once (a seek).
+    - Without an advancing observation for timeout_seconds (the video was paused or stopped), it stops.
+The error of each observation is kept in a histogram; stats() reports it (and the latency report shows it as
+luna_timecode). To check the error against a 60 Hz frame, on simulated sources with drift and jitter:
+    python timecode_sync.py
+"""
+import logging, math, threading, time
+import numpy as np
+from latency_stats import LatencyHistogram
+from luna_log import fields
+
+
+log = logging.getLogger(__name__)
+
+FRAME_BUDGET_SECONDS = 1 / 60  # the sync error to stay within: one servo frame
+SAMPLE_CLOCK_DRIFT = 0.001  # seconds per second the audio input's sample clock may fall behind ours by
+
+# SMPTE linear timecode: 80 bits per frame, biphase mark coded, ending with this sync word (bits 64 to 79)
+LTC_BITS = 80
+LTC_SYNC_WORD = 0xBFFC
+# MIDI Time Code rate codes: frames per second, drop frame
+MTC_RATES = [(24, False), (25, False), (30000 / 1001, True), (30, False)]
+
+
+def timecode_seconds(hours, minutes, seconds, frames, fps, drop_frame=False):
+    """Seconds from 00:00:00:00 to a SMPTE timecode (drop frame: 29.97 fps timecode, which skips frame numbers 0 and
+    1 every minute except every tenth)"""
+    nominal_fps = round(fps)
+    frame_number = ((hours * 60 + minutes) * 60 + seconds) * nominal_fps + frames
+    if drop_frame:
+        total_minutes = 60 * hours + minutes
+        frame_number -= 2 * (total_minutes - total_minutes // 10)
+    return frame_number / fps
+
+
+class TimecodeFollower:
+    """A playback clock phase-locked to timecode observations; thread-safe (sources observe from their own threads,
+    the control thread reads position())"""
+    def __init__(self, lock_seconds=0.5, max_rate_error=0.05, seek_seconds=0.25, timeout_seconds=0.5):
+        # Critically damped second-order loop with time constant lock_seconds
+        self.gain = 2 / lock_seconds
+        self.integral_gain = 1 / lock_seconds**2
+        self.max_rate_error = max_rate_error
+        self.seek_seconds = seek_seconds
+        self.timeout_seconds = timeout_seconds
+        self.errors = LatencyHistogram()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.base_time = None
+            self.base_position = 0.0
+            self.rate = 1.0
+            self.drift = 0.0  # the integral term: steady rate difference between the timecode and our clock
+            self.error = 0.0
+            self.last_time = None
+            self.last_position = None
+            self.advanced_time = None  # local time of the last observation that moved forward
+            self.observations = 0
+            self.seeks = 0
+            self.errors.reset()
+
+    def observe(self, position: float, local_time: float):
+        """The timecode was at position (seconds) at local_time (on the clock position() is called with)"""
+        with self._lock:
+            self.observations += 1
+            previous_time, self.last_time = self.last_time, local_time
+            if self.last_position is not None and position == self.last_position:
+                # Paused (or a repeated message): nothing to lock to
+                return
+            self.last_position = position
+            running = self.advanced_time is not None and local_time - self.advanced_time <= self.timeout_seconds
+            self.advanced_time = local_time
+            predicted = self.base_position + self.rate * (local_time - self.base_time) if running else None
+            if predicted is None or abs(position - predicted) > self.seek_seconds:
+                # Started, or jumped: go there directly
+                self.base_time, self.base_position = local_time, position
+                self.rate = 1.0 + self.drift
+                self.error = 0.0
+                self.seeks += 1
+                return
+            error = self.error = position - predicted
+            self.errors.record(abs(error))
+            interval = max(local_time - previous_time, 1e-3)
+            self.drift = min(max(self.drift + self.integral_gain * error * interval, -self.max_rate_error),
+                             self.max_rate_error)
+            # Work the error off over the next observations instead of jumping (never more than half of it per
+            # interval, so that sparse observations don't overshoot)
+            correction = min(self.gain, 0.5 / interval) * error
+            self.rate = 1.0 + min(max(self.drift + correction, -self.max_rate_error), self.max_rate_error)
+            self.base_time, self.base_position = local_time, predicted
+
+    def position(self, now: float):
+        """Timecode position in seconds at local time now; None while the timecode is stopped or lost"""
+        with self._lock:
+            if self.advanced_time is None or now - self.advanced_time > self.timeout_seconds:
+                return None
+            return self.base_position + self.rate * (now - self.base_time)
+
+    def stats(self):
+        return {"observations": self.observations, "seeks": self.seeks, "rate_ppm": round(1e6 * (self.rate - 1.0)),
+                "error_ms": 1000 * self.error, "p50_error_ms": 1000 * self.errors.percentile(50),
+                "p99_error_ms": 1000 * self.errors.percentile(99)}
+
+
+#### MIDI TIME CODE ####
+
+class MtcDecoder:
+    """Assembles MIDI Time Code quarter frames (and full frame SysEx messages) into follower observations"""
+    def __init__(self, follower):
+        self.follower = follower
+        self.pieces = [0] * 8
+        self.received = 0  # bit mask of the pieces received, in order, since piece 0
+
+    def quarter_frame(self, piece: int, value: int, local_time: float):
+        self.pieces[piece] = value & 0xF
+        self.received = 1 if piece == 0 else self.received | (1 << piece) if self.received == (1 << piece) - 1 else 0
+        if piece == 7 and self.received == 0xFF:
+            pieces = self.pieces
+            fps, drop_frame = MTC_RATES[(pieces[7] >> 1) & 3]
+            position = timecode_seconds(pieces[6] | (pieces[7] & 1) << 4, pieces[4] | pieces[5] << 4,
+                                        pieces[2] | pieces[3] << 4, pieces[0] | pieces[1] << 4, fps, drop_frame)
+            # The pieces carry the time of piece 0, which was sent 7 quarter frames ago
+            self.follower.observe(position + 1.75 / fps, local_time)
+
+    def full_frame(self, data, local_time: float):
+        """A full frame SysEx message (data without F0/F7): F0 7F <device> 01 01 hr mn sc fr F7"""
+        if len(data) < 8 or data[0] != 0x7F or data[2:4] != (1, 1):
+            return
+        hours, minutes, seconds, frames = data[4:8]
+        fps, drop_frame = MTC_RATES[(hours >> 5) & 3]
+        self.received = 0
+        self.follower.observe(timecode_seconds(hours & 0x1F, minutes, seconds, frames, fps, drop_frame), local_time)
+
+
+class MidiTimecodeInput:
+    """MIDI Time Code from a MIDI input port (through mido, on its callback thread)"""
+    def __init__(self, follower, port_name=None, clock=time.monotonic):
+        self.decoder = MtcDecoder(follower)
+        self.port_name = port_name
+        self.clock = clock
+        self.port = None
+
+    def start(self):
+        try:
+            import mido
+            self.port = mido.open_input(self.port_name, callback=self._receive)
+        except ImportError:
+            raise OSError("MIDI timecode needs mido and python-rtmidi (pip install mido python-rtmidi)")
+        log.info("Following MIDI timecode", extra=fields(port=self.port.name))
+
+    def _receive(self, message):
+        now = self.clock()
+        if message.type == "quarter_frame":
+            self.decoder.quarter_frame(message.frame_type, message.frame_value, now)
+        elif message.type == "sysex":
+            self.decoder.full_frame(tuple(message.data), now)
+
+    def close(self):
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+
+
+#### LINEAR TIMECODE ####
+
+class LtcDecoder:
+    """Decodes SMPTE linear timecode from audio (one channel, int16), chunk by chunk, into follower observations.
+
+    Biphase mark code: the signal flips at every bit boundary, and a 1 bit also flips half way through. Bits are
+    read from the intervals between zero crossings (counted in samples), with the bit period tracked to follow
+    speed changes. The end of a frame's sync word is the start of the next frame, which is what is observed, at
+    the time of its sample: samples are timed from the earliest chunk start time seen lately (chunks are only
+    ever handed over late), so the time a chunk happened to be handed over at doesn't matter.
+    """
+    def __init__(self, follower, rate: int, fps: float = 30, drop_frame=False):
+        self.follower = follower
+        self.rate = rate
+        self.fps = fps
+        self.drop_frame = drop_frame
+        self.period = rate / (fps * LTC_BITS)  # samples per bit
+        self.samples_read = 0
+        self.origin = None  # local time of sample 0
+        self.origin_time = None
+        self.last_sample = 0.0
+        self.last_crossing = None  # in samples since the start
+        self.half_bit = False
+        self.bits = 0
+        self.frames = 0
+
+    def process(self, samples, start_time: float):
+        """Decode one chunk; start_time is the local time of its first sample"""
+        signal = np.concatenate(([self.last_sample], np.asarray(samples, dtype=np.float64)))
+        below = signal < 0
+        crossings = np.flatnonzero(below[1:] != below[:-1])
+        # Interpolated crossing positions, in samples since the start (sample 0 of this chunk is signal[1])
+        before, after = signal[crossings], signal[crossings + 1]
+        positions = self.samples_read - 1 + crossings + before / np.where(before != after, before - after, 1.0)
+        origin = start_time - self.samples_read / self.rate
+        if self.origin is None:
+            self.origin = origin
+        else:
+            self.origin = min(origin, self.origin + SAMPLE_CLOCK_DRIFT * (start_time - self.origin_time))
+        self.origin_time = start_time
+        self.samples_read += len(signal) - 1
+        self.last_sample = signal[-1]
+        for position in positions.tolist():
+            if self.last_crossing is None:
+                self.last_crossing = position
+                continue
+            interval = position - self.last_crossing
+            self.last_crossing = position
+            if interval > 1.5 * self.period or interval < 0.25 * self.period:
+                # Silence, a dropout or a glitch: start over
+                self.half_bit = False
+                self.bits = 0
+                continue
+            if interval > 0.75 * self.period:
+                bit = 0
+                self.half_bit = False
+                self.period += 0.05 * (interval - self.period)
+            elif self.half_bit:
+                bit = 1
+                self.half_bit = False
+            else:
+                self.half_bit = True
+                continue
+            self.bits = (self.bits >> 1) | (bit << (LTC_BITS - 1))
+            if self.bits >> 64 == LTC_SYNC_WORD:
+                self._frame(self.origin + position / self.rate)
+
+    def _frame(self, end_time):
+        bits = self.bits
+
+        def bcd(shift, units_bits, tens_bits):
+            return (bits >> shift & (1 << units_bits) - 1) + 10 * (bits >> shift + 8 & (1 << tens_bits) - 1)
+        position = timecode_seconds(bcd(48, 4, 2), bcd(32, 4, 3), bcd(16, 4, 3), bcd(0, 4, 2), self.fps,
+                                    self.drop_frame)
+        self.frames += 1
+        self.follower.observe(position + 1 / self.fps, end_time)
+
+
+def encode_ltc(start_position, seconds, fps=30, rate=44100, amplitude=8000, speed=1.0):
+    """int16 audio of linear timecode running from start_position for seconds (speed: timecode seconds per second
+    of audio, to simulate a drifting clock)"""
+    n_frames = int(math.ceil(seconds * speed * fps)) + 1
+    first_frame = int(round(start_position * fps))
+    levels_per_frame = []
+    for frame in range(first_frame, first_frame + n_frames):
+        frames, total_seconds = frame % fps, frame // fps
+        fields_bcd = [(frames, 0, 2), (total_seconds % 60, 16, 3), (total_seconds // 60 % 60, 32, 3),
+                      (total_seconds // 3600 % 24, 48, 2)]
+        bits = LTC_SYNC_WORD << 64
+        for value, shift, tens_bits in fields_bcd:
+            bits |= (value % 10) << shift | (value // 10) << (shift + 8)
+        # Two half-bit levels per bit: flip at every bit start, and in the middle of 1s
+        for i in range(LTC_BITS):
+            levels_per_frame.append(1)
+            levels_per_frame.append(bits >> i & 1)
+    flips = np.cumsum(levels_per_frame) % 2
+    half_bit_seconds = 1 / (fps * LTC_BITS * 2 * speed)
+    sample_times = np.arange(int(seconds * rate)) / rate
+    half_bits = np.minimum((sample_times / half_bit_seconds).astype(np.int64), len(flips) - 1)
+    return np.where(flips[half_bits] == 1, amplitude, -amplitude).astype(np.int16)
+
+
+def simulate(duration=60.0, jump_at=30.0, jump_to=120.0, drift_ppm=300, seed=0):
+    """Follow simulated UDP, MTC and LTC sources (with clock drift, jitter, and a jump) and measure the playback
+    position error at every 60 Hz frame, against the budget of one frame"""
+    rng = np.random.default_rng(seed)
+    speed = 1 + drift_ppm * 1e-6
+    frame_times = np.arange(0, duration, FRAME_BUDGET_SECONDS)
+
+    def truth(t):
+        # The video's position at local time t: starts at 10 s, jumps at jump_at, runs fast by drift_ppm
+        return np.where(t < jump_at, 10.0 + speed * t, jump_to + speed * (t - jump_at))
+
+    def measure(name, observations):
+        """observations: time-ordered (local time, callable) pairs, run until each frame's time"""
+        follower = TimecodeFollower()
+        errors = []
+        index = 0
+        for t in frame_times:
+            while index < len(observations) and observations[index][0] <= t:
+                observations[index][1](follower)
+                index += 1
+            position = follower.position(t)
+            # Frames right after the jump (before any observation could show it) don't count
+            if position is not None and not jump_at <= t < jump_at + 0.1:
+                errors.append(abs(position - truth(t)))
+        errors = np.array(errors)
+        p50, p99, worst = (1000 * np.percentile(errors, 50), 1000 * np.percentile(errors, 99), 1000 * errors.max())
+        print(f"{name}: p50 {p50:.2f} ms  p99 {p99:.2f} ms  max {worst:.2f} ms  ({follower.seeks} seeks, "
+              f"{'within' if p99 < 1000 * FRAME_BUDGET_SECONDS else 'OVER'} the {1000 * FRAME_BUDGET_SECONDS:.1f} ms budget)")
+        return {"p50_ms": p50, "p99_ms": p99, "max_ms": worst, "seeks": follower.seeks}
+
+    results = {}
+    # UDP: 20 messages per second, 1 to 20 ms transit (corrected to the fastest transit, as remote_control.py does)
+    send_times = np.arange(0, duration, 0.05)
+    transits = 0.001 + rng.exponential(0.004, len(send_times))
+    udp = []
+    for send_time, transit in sorted(zip(send_times, transits), key=lambda pair: pair[0] + pair[1]):
+        fastest = transits[max(0, int(send_time / 0.05) - 40):int(send_time / 0.05) + 1].min()
+        position = float(truth(send_time))
+        udp.append((send_time + transit, lambda follower, p=position, t=send_time + fastest: follower.observe(p, t)))
+    results["udp"] = measure("UDP (20/s, 1-20 ms transit)", udp)
+
+    # MTC: 30 fps quarter frames with 0.5 ms of MIDI jitter; each run of 8 pieces carries the frame it started on
+    mtc = []
+    decoder = None
+    quarter_frame_seconds = 1 / (4 * 30 * speed)
+    for start_time, end_time, start_position in ((0.0, jump_at, 10.0), (jump_at, duration, jump_to)):
+        for quarter_frame_index in range(int((end_time - start_time) / quarter_frame_seconds)):
+            piece = quarter_frame_index % 8
+            total_seconds, frames = divmod(round(start_position * 30) + quarter_frame_index // 8 * 2, 30)
+            values = [frames & 0xF, frames >> 4, total_seconds % 60 & 0xF, total_seconds % 60 >> 4,
+                      total_seconds // 60 % 60 & 0xF, total_seconds // 60 % 60 >> 4, total_seconds // 3600 & 0xF,
+                      (total_seconds // 3600 >> 4 & 1) | 3 << 1]
+            arrival = start_time + quarter_frame_index * quarter_frame_seconds + abs(rng.normal(0, 0.0005))
+
+            def quarter_frame(follower, piece=piece, value=values[piece], arrival=arrival):
+                nonlocal decoder
+                if decoder is None or decoder.follower is not follower:
+                    decoder = MtcDecoder(follower)
+                decoder.quarter_frame(piece, value, arrival)
+            mtc.append((arrival, quarter_frame))
+    results["mtc"] = measure("MTC (30 fps quarter frames, 0.5 ms jitter)", sorted(mtc, key=lambda item: item[0]))
+
+    # LTC: 30 fps on a 44.1 kHz input, in 512-sample chunks handed over with up to 3 ms of scheduling jitter
+    rate, chunk = 44100, 512
+    audio = np.concatenate([encode_ltc(10.0, jump_at, rate=rate, speed=speed),
+                            encode_ltc(jump_to, duration - jump_at, rate=rate, speed=speed)])
+    ltc = []
+    ltc_decoder = None
+    for start in range(0, len(audio) - chunk, chunk):
+        arrival = (start + chunk) / rate + rng.uniform(0, 0.003)
+
+        def audio_chunk(follower, start=start, arrival=arrival):
+            nonlocal ltc_decoder
+            if ltc_decoder is None or ltc_decoder.follower is not follower:
+                ltc_decoder = LtcDecoder(follower, rate)
+            ltc_decoder.process(audio[start:start + chunk], arrival - chunk / rate)
+        ltc.append((arrival, audio_chunk))
+    results["ltc"] = measure("LTC (30 fps, 44.1 kHz, 512-sample chunks)", ltc)
+    return results
+
+
+if __name__ == "__main__":
+    simulate()